@@ -0,0 +1,60 @@
+import argparse
+import contextlib
+import io
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from src.main import DataIngestor
+from src import bi_queries
+from src.generator import ListenGenerator
+
+"""
+This script reports the size of the database and the latency of each BI query for the current table layout,
+run it on two revisions to compare layouts.
+"""
+
+def ingest(path, db_name, batch_size):
+    """
+    :return: the open connection to the freshly loaded database
+    """
+    ingestor = DataIngestor(path, db_name, batch_size=batch_size)
+    ingestor.__open_database__()
+    for new_json_list in ingestor.get_new_data():
+        ingestor.__write__(ingestor.extractor.get_rows_for_all_tables(new_json_list))
+    ingestor.__create_indexes__()
+    ingestor.conn.execute("VACUUM")
+    return ingestor.conn
+
+def time_query(function, conn, repeat):
+    """
+    :return: the best of `repeat` runs in milliseconds, printing suppressed
+    """
+    best = float("inf")
+    for i in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            function(conn)
+            best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="database size and query latency of the table layout")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--tracks", type=int, default=100000)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "dataset.txt")
+        ListenGenerator(args.users, args.tracks).write(path, args.rows)
+        db_name = os.path.join(tmp, "spotify")
+        conn = ingest(path, db_name, args.batch_size)
+        print("database size: {:.1f} MB".format(os.path.getsize(db_name + ".db") / 1e6))
+        for function in (bi_queries.query1, bi_queries.query2, bi_queries.query3, bi_queries.make_dwh):
+            print("{0}: {1:.1f} ms".format(function.__name__, time_query(function, conn, args.repeat)))
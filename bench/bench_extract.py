@@ -0,0 +1,54 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+from json import JSONDecoder
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from src.extract import Extractor
+from src.generator import ListenGenerator
+
+"""
+This script measures how many listens per second the Extractor turns into rows for the four tables.
+It generates a ListenBrainz-shaped file first (see ListenGenerator), then decodes it in batches and times only the
+extraction.
+"""
+
+def run(path, batch_size):
+    """
+    :return: the number of listens and the seconds spent inside the Extractor
+    """
+    dec = JSONDecoder()
+    extractor = Extractor()
+    n_rows = 0
+    elapsed = 0.0
+    with open(path) as file:
+        batch = []
+        for line in file:
+            batch.append(dec.decode(line))
+            if len(batch) == batch_size:
+                start = time.perf_counter()
+                extractor.get_rows_for_all_tables(batch)
+                elapsed += time.perf_counter() - start
+                n_rows += len(batch)
+                batch = []
+        if batch:
+            start = time.perf_counter()
+            extractor.get_rows_for_all_tables(batch)
+            elapsed += time.perf_counter() - start
+            n_rows += len(batch)
+    return n_rows, elapsed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark of the Extractor")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--tracks", type=int, default=100000)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "dataset.txt")
+        ListenGenerator(args.users, args.tracks).write(path, args.rows)
+        n_rows, elapsed = run(path, args.batch_size)
+    print("{0} rows in {1:.2f}s: {2:.0f} rows/sec".format(n_rows, elapsed, n_rows / elapsed))
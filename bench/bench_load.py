@@ -0,0 +1,61 @@
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from src.main import DataIngestor
+from src.generator import ListenGenerator
+
+"""
+This script measures the sustained number of listens per second the DataIngestor loads into the database,
+from reading the file until the indexes are built, with and without the bulk load mode.
+"""
+
+def run(path, db_name, batch_size, bulk_load):
+    """
+    :return: the number of listens stored, the seconds it took end to end and the seconds spent writing
+    """
+    ingestor = DataIngestor(path, db_name, batch_size=batch_size, bulk_load=bulk_load)
+    start = time.perf_counter()
+    ingestor.__open_database__()
+    write_elapsed = 0.0
+    for new_json_list in ingestor.get_new_data():
+        new_data = ingestor.extractor.get_rows_for_all_tables(new_json_list)
+        write_start = time.perf_counter()
+        ingestor.__write__(new_data)
+        write_elapsed += time.perf_counter() - write_start
+    write_start = time.perf_counter()
+    ingestor.__create_indexes__()
+    write_elapsed += time.perf_counter() - write_start
+    elapsed = time.perf_counter() - start
+    n_rows = ingestor.conn.execute("SELECT count(*) FROM listeners").fetchone()[0]
+    ingestor.conn.close()
+    return n_rows, elapsed, write_elapsed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark of the bulk load mode")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--tracks", type=int, default=100000)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--target", type=float, default=0,
+                        help="fail if the bulk load mode sustains fewer rows/sec than this")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "dataset.txt")
+        ListenGenerator(args.users, args.tracks).write(path, args.rows)
+        results = {}
+        for bulk_load in (False, True):
+            n_rows, elapsed, write_elapsed = run(path, os.path.join(tmp, "bulk" if bulk_load else "default"),
+                                                 args.batch_size, bulk_load)
+            results[bulk_load] = n_rows / elapsed
+            print("bulk_load={0}: {1} rows in {2:.2f}s: {3:.0f} rows/sec end to end, "
+                  "{4:.0f} rows/sec in the write stage".format(bulk_load, n_rows, elapsed, results[bulk_load],
+                                                               n_rows / write_elapsed))
+    if results[True] < args.target:
+        sys.exit("the bulk load mode sustained {0:.0f} rows/sec, the target is {1:.0f}".format(
+            results[True], args.target))
@@ -0,0 +1,117 @@
+import argparse
+import json
+import logging
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from src.main import DataIngestor
+from src.generator import ListenGenerator
+from src.readpool import ReadPool
+from src import bi_queries
+from bench_suite import percentile
+
+"""
+This script measures the latency of the BI queries run from several reader threads through a ReadPool while
+the DataIngestor keeps writing batches, and how much the readers slow the writer down. The writer appends the
+second half of a generated dataset to the file batch by batch and ingests each one right away.
+"""
+
+QUERY_FUNCTIONS = (bi_queries.query1, bi_queries.query2, bi_queries.query3, bi_queries.make_report)
+
+def write_load(path, db_name, lines, batch_size, stop):
+    """
+    appends the lines to the file in batches and ingests each batch - in the calling thread
+    :return: the number of listens ingested per second
+    """
+    ingestor = DataIngestor(path, db_name, batch_size=batch_size)
+    ingestor.__open_database__()
+    start = time.perf_counter()
+    for i in range(0, len(lines), batch_size):
+        with open(path, "a") as file:
+            file.writelines(lines[i:i + batch_size])
+        for new_json_list in ingestor.get_new_data():
+            ingestor.__write__(ingestor.__extract__(new_json_list))
+    elapsed = time.perf_counter() - start
+    ingestor.conn.close()
+    stop.set()
+    return len(lines) / elapsed
+
+def read_load(pool, stop, latencies, errors, seed):
+    """
+    runs random BI queries until stop is set - in the calling thread
+    :return: None
+    """
+    rnd = random.Random(seed)
+    while not stop.is_set():
+        function = rnd.choice(QUERY_FUNCTIONS)
+        start = time.perf_counter()
+        try:
+            pool.run(function)
+            latencies.append((time.perf_counter() - start) * 1000)
+        except sqlite3.OperationalError as e:
+            errors.append(str(e))
+
+def run(args, tmp, readers):
+    """
+    :return: the writer throughput and the reader latencies with the given number of reader threads
+    """
+    path = os.path.join(tmp, "dataset.txt")
+    db_name = os.path.join(tmp, "spotify{}".format(readers))
+    lines = [line + "\n" for line, kind in ListenGenerator(args.users, args.tracks).lines(args.rows)]
+    # the first half is loaded before the readers start
+    with open(path, "w") as file:
+        file.writelines(lines[:len(lines) // 2])
+    ingestor = DataIngestor(path, db_name, batch_size=args.batch_size)
+    ingestor.__open_database__()
+    for new_json_list in ingestor.get_new_data():
+        ingestor.__write__(ingestor.__extract__(new_json_list))
+    ingestor.__create_indexes__()
+    ingestor.__refresh_report__()
+    ingestor.conn.close()
+
+    pool = ReadPool(db_name + ".db", size=max(readers, 1))
+    stop = threading.Event()
+    latencies = []
+    errors = []
+    threads = [threading.Thread(target=read_load, args=(pool, stop, latencies, errors, i)) for i in range(readers)]
+    for thread in threads:
+        thread.start()
+    rows_per_sec = write_load(path, db_name, lines[len(lines) // 2:], args.batch_size, stop)
+    for thread in threads:
+        thread.join()
+    pool.close()
+    result = {"readers": readers, "writer_rows_per_sec": rows_per_sec, "queries": len(latencies),
+              "errors": len(errors)}
+    if latencies:
+        result.update({"p50_ms": percentile(latencies, 50), "p99_ms": percentile(latencies, 99)})
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="reader latency under a sustained write load")
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--tracks", type=int, default=50000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--readers", default="0,1,4", help="the numbers of reader threads to compare")
+    parser.add_argument("--output", default="bench_readers.json", help="the json file the results are written to")
+    args = parser.parse_args()
+    logging.disable(logging.ERROR)
+    results = []
+    # the queries print their answers
+    stdout = sys.stdout
+    with tempfile.TemporaryDirectory() as tmp, open(os.devnull, "w") as devnull:
+        for readers in [int(n) for n in args.readers.split(",")]:
+            sys.stdout = devnull
+            try:
+                results.append(run(args, tmp, readers))
+            finally:
+                sys.stdout = stdout
+            print(json.dumps(results[-1]))
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
@@ -0,0 +1,133 @@
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from src.main import DataIngestor
+from src.generator import ListenGenerator, CORRUPTION_KINDS
+from src import bi_queries
+
+try:
+    import resource
+except ImportError:
+    # not available on windows, the peak RSS is then not reported
+    resource = None
+
+"""
+This script runs the whole pipeline on a synthetic dataset and writes the numbers to a json file, so that the
+runs before and after a change can be compared:
+    the number of listens per second ingested, end to end until the indexes are built
+    the peak resident set size of the process
+    the size of the database file
+    the p50/p99 latency of each function of bi_queries
+All kinds of corruption are injected by default, the corrupted lines end up in the quarantine (see RejectStore).
+"""
+
+# the functions of bi_queries that are timed, each called with the connection only
+QUERY_FUNCTIONS = (bi_queries.query1, bi_queries.query2, bi_queries.query3, bi_queries.make_report,
+                   bi_queries.make_dwh)
+
+def peak_rss_mb():
+    """
+    :return: the peak resident set size of this process so far in MB, or None if it can't be measured
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports KB, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def percentile(values, q):
+    """
+    :return: the q-th percentile of the values, the nearest rank
+    """
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+def ingest(path, db_name, batch_size):
+    """
+    loads the file the way DataIngestor.main does
+    :return: the ingestor with the open connection and the seconds it took
+    """
+    ingestor = DataIngestor(path, db_name, batch_size=batch_size)
+    start = time.perf_counter()
+    ingestor.__open_database__()
+    for new_json_list in ingestor.get_new_data():
+        ingestor.__write__(ingestor.__extract__(new_json_list))
+    ingestor.rejects.flush()
+    ingestor.tailer.save_checkpoint()
+    ingestor.__create_indexes__()
+    ingestor.__refresh_report__()
+    return ingestor, time.perf_counter() - start
+
+def time_function(function, conn, repeat):
+    """
+    :return: the p50 and p99 latency of `repeat` calls in milliseconds, printing suppressed
+    """
+    latencies = []
+    for i in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            function(conn)
+            latencies.append((time.perf_counter() - start) * 1000)
+    return {"p50_ms": percentile(latencies, 50), "p99_ms": percentile(latencies, 99)}
+
+def run(args, tmp):
+    """
+    :return: the dictionary of results
+    """
+    generator = ListenGenerator(args.users, args.tracks, args.user_skew, args.track_skew, args.duplicate_rate,
+                                args.corrupt_rate, [kind for kind in args.corrupt_kinds.split(",") if kind],
+                                seed=args.seed)
+    path = os.path.join(tmp, "dataset.txt")
+    lines = generator.write(path, args.rows)
+
+    db_name = os.path.join(tmp, "spotify")
+    ingestor, elapsed = ingest(path, db_name, args.batch_size)
+    conn = ingestor.conn
+    listens = conn.execute("SELECT count(*) FROM listeners").fetchone()[0]
+    quarantined = conn.execute("SELECT count(*) FROM quarantine").fetchone()[0]
+    # the rows are in the write-ahead log until it is checkpointed, the database file alone would miss them
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    results = {"config": vars(args),
+               "lines": lines,
+               "listens_stored": listens,
+               "listens_quarantined": quarantined,
+               "ingest_seconds": elapsed,
+               "ingest_rows_per_sec": args.rows / elapsed,
+               "peak_rss_mb": peak_rss_mb(),
+               "db_size_mb": os.path.getsize(db_name + ".db") / 1e6,
+               "queries": dict((function.__name__, time_function(function, conn, args.repeat))
+                               for function in QUERY_FUNCTIONS)}
+    conn.close()
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ingestion and query benchmark on a synthetic dataset")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--tracks", type=int, default=100000)
+    parser.add_argument("--user-skew", type=float, default=1.0)
+    parser.add_argument("--track-skew", type=float, default=1.0)
+    parser.add_argument("--duplicate-rate", type=float, default=0.01)
+    parser.add_argument("--corrupt-rate", type=float, default=0.001)
+    parser.add_argument("--corrupt-kinds", default=",".join(CORRUPTION_KINDS))
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output", default="bench_results.json", help="the json file the results are written to")
+    parser.add_argument("--tmp-dir", default=None, help="where the dataset and the database are written")
+    args = parser.parse_args()
+    # the summaries of the quarantine are not part of the results
+    logging.disable(logging.ERROR)
+    with tempfile.TemporaryDirectory(dir=args.tmp_dir) as tmp:
+        results = run(args, tmp)
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+    print(json.dumps(results, indent=2))
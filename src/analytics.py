@@ -0,0 +1,120 @@
+import os
+import numpy as np
+import pandas as pd
+from src.columnar import ColumnarExport, LISTENER_COLUMNS, RECORDING_ARTIST
+from src.rollup import SECONDS_PER_DAY, day_number
+
+"""
+This module answers the questions of bi_queries from the columnar export instead of SQL: the columns are mapped
+into memory and every aggregate is a vectorized numpy operation over them. Only the handful of ids in a result are
+looked up in the database for their names. The methods return data frames of the same shape as bi_queries.
+"""
+
+def fetch_names(conn, table, id_column, name_column, ids):
+    """
+    :return: a dictionary of the names of the given ids
+    """
+    ids = [int(id) for id in ids]
+    names = {}
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        cmd = "SELECT {0}, {1} FROM {2} WHERE {0} IN (".format(id_column, name_column, table) + \
+              ",".join("?" * len(chunk)) + ")"
+        names.update(conn.execute(cmd, chunk))
+    return names
+
+
+class ListenAnalytics():
+
+    """
+    the BI questions over the memory-mapped columns of a ColumnarExport - create a new instance to see the listens
+    exported after it
+    """
+
+    def __init__(self, directory, conn):
+        self.conn = conn
+        export = ColumnarExport(directory)
+        self.rows = export.rows
+        self.sorted_rows = export.sorted_rows
+        columns = {}
+        for column, dtype in LISTENER_COLUMNS + (RECORDING_ARTIST,):
+            path = export.path(column)
+            size = os.path.getsize(path) // np.dtype(dtype).itemsize if os.path.exists(path) else 0
+            if column != RECORDING_ARTIST[0]:
+                size = min(size, self.rows)
+            # an empty file can't be mapped
+            columns[column] = np.memmap(path, dtype, "r", shape=(size,)) if size else np.zeros(0, dtype)
+        self.user_id = columns["user_id"]
+        self.recording_id = columns["recording_id"]
+        self.listened_at = columns["listened_at"]
+        self.recording_artist = columns[RECORDING_ARTIST[0]]
+
+    def __time_range__(self, start, end):
+        """
+        :return: the user ids of the listens in [start, end) - found by binary search in the sorted part of the
+        columns and by a scan of the unsorted tail
+        """
+        sorted_times = self.listened_at[:self.sorted_rows]
+        lo, hi = np.searchsorted(sorted_times, [start, end])
+        user_ids = self.user_id[lo:hi]
+        if self.sorted_rows < self.rows:
+            tail = self.listened_at[self.sorted_rows:]
+            mask = (tail >= start) & (tail < end)
+            user_ids = np.concatenate([user_ids, self.user_id[self.sorted_rows:][mask]])
+        return user_ids
+
+    def query1(self):
+        # the 10 users with the most listens
+        counts = np.bincount(self.user_id)
+        user_ids = np.flatnonzero(counts)
+        user_ids = user_ids[np.argsort(-counts[user_ids], kind="stable")[:10]]
+        names = fetch_names(self.conn, "users", "user_id", "user_name", user_ids)
+        return pd.DataFrame([(names[id], int(counts[id])) for id in user_ids], columns=["user_name", "cnt"])
+
+    def query2(self, day="2019-03-01"):
+        # the number of distinct users active on a day
+        start = day_number(day) * SECONDS_PER_DAY
+        users = self.__time_range__(start, start + SECONDS_PER_DAY)
+        return pd.DataFrame([(np.count_nonzero(np.bincount(users)) if len(users) else 0,)],
+                            columns=["active_user_count"])
+
+    def query3(self):
+        # the first listen of the 10 users with the lowest ids, like the grouping by user id in sql
+        user_ids = np.flatnonzero(np.bincount(self.user_id))[:10]
+        rows = []
+        # the listens of those users are found in a single scan
+        positions = np.flatnonzero(self.user_id <= user_ids[-1]) if len(user_ids) else []
+        candidates = self.user_id[positions]
+        for user_id in user_ids:
+            own = positions[candidates == user_id]
+            first = own[np.argmin(self.listened_at[own])]
+            rows.append((int(user_id), int(self.listened_at[first]), int(self.recording_id[first])))
+        users = fetch_names(self.conn, "users", "user_id", "user_name", [row[0] for row in rows])
+        tracks = fetch_names(self.conn, "recordings", "recording_id", "track_name", [row[2] for row in rows])
+        return pd.DataFrame([(users[user], listened_at, tracks[recording]) for (user, listened_at, recording) in rows],
+                            columns=["user_name", "first_listened_at", "track_name"])
+
+    def __top_names__(self, counts, table, id_column, name_column, column, limit):
+        """
+        sums the counts per id by name - different ids can share a name - and keeps the top ones
+        :param counts: the counts indexed by id
+        :return: the data frame of the names and their counts
+        """
+        ids = np.flatnonzero(counts)
+        # most ids of a dimension occur, a single scan of it beats looking them up
+        names = dict(self.conn.execute("SELECT {0}, {1} FROM {2}".format(id_column, name_column, table)))
+        labels, inverse = np.unique(np.array([names.get(int(id), "") for id in ids], dtype=object),
+                                    return_inverse=True)
+        totals = np.bincount(inverse, weights=counts[ids]).astype(np.int64)
+        top = np.argsort(-totals, kind="stable")[:limit]
+        return pd.DataFrame([(labels[i], int(totals[i])) for i in top], columns=[column, "times_listened"])
+
+    def make_dwh(self):
+        # the metrics of Task #3
+        distinct_users = pd.DataFrame([(np.count_nonzero(np.bincount(self.user_id)),)], columns=["distinct_users"])
+        track_counts = np.bincount(self.recording_id)
+        tracks = self.__top_names__(track_counts, "recordings", "recording_id", "track_name", "track_name", 10)
+        artist_counts = np.bincount(self.recording_artist[:len(track_counts)],
+                                    weights=track_counts[:len(self.recording_artist)]).astype(np.int64)
+        artists = self.__top_names__(artist_counts, "artists", "artist_id", "artist_name", "artist_name", 5)
+        return distinct_users, tracks, artists
@@ -0,0 +1,129 @@
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from json import JSONDecoder
+from src.dedup import fingerprint_listen
+from src.extract import normalize_listen
+from src.reject import Rejected, MALFORMED_JSON, SPARSE
+
+
+def split_file(path, n_ranges, start=0):
+    """
+    splits a file into byte ranges of roughly equal size that start and end at line boundaries
+    :param path: the path to the file
+    :param n_ranges: the number of ranges wanted
+    :param start: the offset to split the file from, it has to be at the start of a line
+    :return: the list of tuples (start, end) - empty if there is nothing after start
+    """
+    size = os.path.getsize(path)
+    if start >= size:
+        return []
+    boundaries = [start]
+    with open(path, "rb") as file:
+        for i in range(1, n_ranges):
+            position = max(start + (size - start) * i // n_ranges, boundaries[-1])
+            file.seek(position)
+            # move on to the start of the next line
+            file.readline()
+            position = file.tell()
+            if position >= size:
+                break
+            if position > boundaries[-1]:
+                boundaries.append(position)
+    boundaries.append(size)
+    return [(boundaries[i], boundaries[i + 1]) for i in range(len(boundaries) - 1)]
+
+
+def parse_lines(lines, dec=None):
+    """
+    decodes and validates lines of the file - the stateless part of the ingestion, shared by the backfill workers and
+    the parse stage of the IngestPipeline
+    :param lines: an iterable of lines, blank ones are skipped
+    :param dec: the JSONDecoder to use
+    :return: the list of tuples (fingerprint, normalized listen) - the listen is a Rejected tuple holding the line for
+    a line that is not valid JSON or too sparse, so it can be quarantined by the Extractor. A rejected line has no
+    fingerprint (None), it passes the deduplicator like in the sequential ingestion
+    """
+    dec = dec or JSONDecoder()
+    keyed = []
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            ele = dec.decode(line)
+        except ValueError:
+            keyed.append((None, Rejected(MALFORMED_JSON, line)))
+            continue
+        record = normalize_listen(ele)
+        if record is None:
+            keyed.append((None, Rejected(SPARSE, line)))
+        else:
+            keyed.append((fingerprint_listen(ele), record))
+    return keyed
+
+
+def parse_range(task):
+    """
+    decodes and validates the complete lines of one byte range, this is the part of the work done in the worker
+    processes. The output does not depend on any other range, so the ranges can be processed in any order
+    :param task: a tuple (path, start, end)
+    :return: a tuple (the list of tuples (fingerprint, normalized listen), the end offset of the last complete line)
+    """
+    path, start, end = task
+    with open(path, "rb") as file:
+        file.seek(start)
+        data = file.read(end - start)
+    # a trailing line without its newline is still being written and is left to the tailer
+    last_newline = data.rfind(b"\n")
+    keyed = parse_lines(data[:last_newline + 1].decode("utf-8", errors="replace").split("\n"))
+    return keyed, start + last_newline + 1
+
+
+class Backfiller():
+
+    """
+    This class loads a large existing file in parallel. The file is split into newline-aligned byte ranges which
+    worker processes decode and validate (the CPU heavy, stateless part). The results are consumed in file order
+    in the calling process, where the stateful part happens: rejecting duplicates, reconciling the msid sets of
+    the Extractor (so that primary and foreign keys are checked exactly as in a sequential load) and writing to
+    the single SQLite connection.
+    """
+
+    def __init__(self, path, workers=None, range_size=32 << 20):
+        self.path = path
+        self.workers = workers or os.cpu_count() or 1
+        self.range_size = range_size
+
+    def run(self, deduplicator, extractor, write, start=0):
+        """
+        processes the file from an offset on to its end
+        :param deduplicator: the ListenDeduplicator used to reject listens seen before
+        :param extractor: the Extractor whose msid sets are updated in file order
+        :param write: a callable taking the dictionary of rows per table and the offset up to which they were read
+        :param start: the offset to start at, e.g. the checkpoint of an earlier run
+        :return: the offset right after the last complete line of the file
+        """
+        n_ranges = max((os.path.getsize(self.path) - start) // self.range_size, self.workers)
+        tasks = [(self.path, begin, end) for (begin, end) in split_file(self.path, n_ranges, start)]
+        offset = start
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            # keep only a few ranges in flight so that the results waiting to be written stay bounded
+            in_flight = []
+            for task in tasks:
+                in_flight.append(pool.submit(parse_range, task))
+                if len(in_flight) >= 2 * self.workers:
+                    offset = self.__consume__(in_flight.pop(0), deduplicator, extractor, write)
+            while in_flight:
+                offset = self.__consume__(in_flight.pop(0), deduplicator, extractor, write)
+        logging.info("backfill of {0} finished at byte {1}".format(self.path, offset))
+        return offset
+
+    def __consume__(self, future, deduplicator, extractor, write):
+        """
+        merges the result of one range into the database
+        :return: the offset up to which the file has been processed
+        """
+        keyed, offset = future.result()
+        records = deduplicator.filter_keyed(keyed)
+        write(extractor.get_rows_for_normalized(records), offset)
+        return offset
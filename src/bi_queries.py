@@ -1,80 +1,377 @@
-import pandas as pd
-import sqlite3
+import argparse
+import csv
+import os
+import re
+import sys
+from src.rollup import day_number
+from src.report import read_report, GRAINS
+from src.readpool import ReadPool
+from src.partition import listeners_source, per_partition
+from src.profiling import add_profiling_arguments, profiled
 
 """
 This script basically runs a couple of queries on the database to
 answer some specific BI questions. It assumes that the in-file database
 is in the current working directory and is fully populated.
+By default the questions of Task #2 are answered from the summary tables
+the ingestion maintains (see RollupMaintainer), use_rollups=False
+computes them from the listeners fact table instead.
+The queries over a range of days read only the monthly partitions of
+the listeners the range falls in (see listeners_source). The ones over
+the whole history aggregate every partition on its own and merge the
+partial results (the *_PARTIAL_CMD, see over_partitions).
+Every query is meant to be answered from an index, QUERY_PLAN_CHECKS
+lists the index each one must use and check_query_plans verifies it,
+for every partition read.
+Pass a QueryCache to serve repeated calls from memory until new data
+has been ingested. approximate=True answers the distinct user counts
+and the most popular tracks and artists from the sketches instead (see
+SketchMaintainer), falling back to the exact queries for a database
+without them.
+Run as a script (python -m src.bi_queries --help) each question is a
+subcommand whose rows are streamed from a plain cursor as tab separated
+text. pandas (and numpy) are only imported for the functions returning
+data frames, i.e. with --frame, so that a cron job starts fast.
 """
 
-def query1(conn):
+# first answer
+# the listen counts are maintained per user by the ingestion, the index on listen_count yields the top 10
+QUERY1_ROLLUP_CMD = "select user_name, listen_count as cnt " \
+                    "from user_stats join users on user_stats.user_id=users.user_id " \
+                    "order by listen_count desc " \
+                    "limit 10;"
+# the listens are counted per integer user id and partition first, only the top 10 ids are joined to their names
+QUERY1_PARTIAL_CMD = "select user_id, count(*) as cnt from {listeners} group by user_id"
+QUERY1_FACTS_CMD = "select user_name, cnt " \
+                   "from (select user_id, sum(cnt) as cnt " \
+                   "from {partials} " \
+                   "group by user_id " \
+                   "order by cnt desc " \
+                   "limit 10) as t join users on t.user_id=users.user_id " \
+                   "order by cnt desc;"
+
+# second answer
+# the number of distinct users is maintained per day by the ingestion
+QUERY2_ROLLUP_CMD = "select coalesce(max(active_users), 0) as active_user_count " \
+                    "from daily_active_users " \
+                    "where day=?;"
+# the precomputed day bucket is compared as it is, so the index on (day, user_id) answers the query
+# {listeners} is the partition of the day
+QUERY2_FACTS_CMD = "select count(distinct user_id) as active_user_count " \
+                   "from {listeners} " \
+                   "where day=?;"
+
+# third answer
+# the first listen is maintained per user by the ingestion
+QUERY3_ROLLUP_CMD = "select user_name, first_listened_at, track_name " \
+                    "from (select user_id, first_listened_at, first_recording_id " \
+                    "from user_stats " \
+                    "limit 10) as t " \
+                    "join users on t.user_id=users.user_id " \
+                    "join recordings on t.first_recording_id=recordings.recording_id;"
+# sqlite takes the bare column recording_id from the row holding min(listened_at), per partition and then overall
+QUERY3_PARTIAL_CMD = "select user_id, min(listened_at) as first_listened_at, recording_id from {listeners} " \
+                     "group by user_id"
+QUERY3_FACTS_CMD = "select user_name, first_listened_at, track_name " \
+                   "from (select user_id, min(first_listened_at) as first_listened_at, recording_id " \
+                   "from {partials} " \
+                   "group by user_id " \
+                   "limit 10) as t " \
+                   "join users on t.user_id=users.user_id " \
+                   "join recordings on t.recording_id=recordings.recording_id;"
+
+# the metrics of Task #3
+# grouping walks the index on (user_id, ...) in order, unlike count(distinct) which builds a temporary b-tree - only
+# the distinct users of each partition go through one
+DWH_USERS_PARTIAL_CMD = "select user_id from {listeners} group by user_id"
+DWH_USERS_CMD = "select count(*) as distinct_users from (select user_id from {partials} group by user_id)"
+# the listens are counted per integer recording id and partition first, the names are joined to the counts
+DWH_RECORDINGS_PARTIAL_CMD = "select recording_id, count(*) as cnt from {listeners} group by recording_id"
+DWH_TRACKS_CMD = "select track_name, sum(cnt) as times_listened " \
+                 "from {partials} as t " \
+                 "join recordings on t.recording_id=recordings.recording_id " \
+                 "group by track_name " \
+                 "order by times_listened desc " \
+                 "limit 10;"
+DWH_ARTISTS_CMD = "select artist_name, sum(cnt) as times_listened " \
+                  "from {partials} as t " \
+                  "join recordings on t.recording_id=recordings.recording_id " \
+                  "join artists on recordings.artist_id=artists.artist_id " \
+                  "group by artist_name " \
+                  "order by times_listened desc " \
+                  "limit 5;"
+
+# the same from the Space-Saving summaries, the counts are at most the error of each item too large
+SKETCH_TRACKS_CMD = "select track_name, sum(listens) as times_listened " \
+                    "from sketch_topk join recordings on sketch_topk.item_id=recordings.recording_id " \
+                    "where kind='track' " \
+                    "group by track_name " \
+                    "order by times_listened desc " \
+                    "limit 10;"
+SKETCH_ARTISTS_CMD = "select artist_name, sum(listens) as times_listened " \
+                     "from sketch_topk join artists on sketch_topk.item_id=artists.artist_id " \
+                     "where kind='artist' " \
+                     "group by artist_name " \
+                     "order by times_listened desc " \
+                     "limit 5;"
+
+# the columns of read_report
+REPORT_COLUMNS = ["period","listens","active_users","new_users","top_track","top_artist","sessions_per_user",
+                  "hours_listened"]
+
+# (name, command, the partial aggregate of the command or None, parameters, the index the plan must use)
+QUERY_PLAN_CHECKS = [("query1", QUERY1_ROLLUP_CMD, None, (), "index_user_stats_listen_count"),
+                     ("query1 on facts", QUERY1_FACTS_CMD, QUERY1_PARTIAL_CMD, (), "index_listeners_user_time"),
+                     ("query2", QUERY2_ROLLUP_CMD, None, (0,), "INTEGER PRIMARY KEY"),
+                     ("query2 on facts", QUERY2_FACTS_CMD.format(listeners="listeners"), None, (0,),
+                      "index_listeners_day_user"),
+                     ("query3", QUERY3_ROLLUP_CMD, None, (), "INTEGER PRIMARY KEY"),
+                     ("query3 on facts", QUERY3_FACTS_CMD, QUERY3_PARTIAL_CMD, (), "index_listeners_user_time"),
+                     ("distinct users", DWH_USERS_CMD, DWH_USERS_PARTIAL_CMD, (), "index_listeners_user_time"),
+                     ("top tracks", DWH_TRACKS_CMD, DWH_RECORDINGS_PARTIAL_CMD, (), "index_listeners_recording"),
+                     ("top artists", DWH_ARTISTS_CMD, DWH_RECORDINGS_PARTIAL_CMD, (), "index_listeners_recording")]
+# a line of a query plan reading a whole partition of the listeners without any index
+UNINDEXED_SCAN = re.compile(r"^SCAN listeners_\d{6}$")
+
+def over_partitions(conn,cmd,partial_cmd):
+    """
+    :param cmd: a command over the listeners, with {partials} in place of the partial results it merges
+    :param partial_cmd: the partial aggregate computed on every partition, with {listeners} in place of the table
+    :return: the command to run, see per_partition
+    """
+    return cmd.format(partials=per_partition(conn,partial_cmd))
+
+def explain(conn,cmd,params=()):
+    """
+    :return: the lines of the query plan sqlite chooses for the command
+    """
+    return [row[-1] for row in conn.execute("explain query plan " + cmd, params)]
+
+def check_query_plans(conn):
+    """
+    verifies that every query is answered using the index it was designed for - on every partition it reads
+    :return: the list of the names of the queries that don't, together with their plans
+    """
+    failures = []
+    for (name, cmd, partial_cmd, params, index) in QUERY_PLAN_CHECKS:
+        if partial_cmd is not None:
+            cmd = over_partitions(conn, cmd, partial_cmd)
+        plan = explain(conn, cmd, params)
+        if not any(index in line for line in plan) or any(UNINDEXED_SCAN.match(line) for line in plan):
+            failures.append((name, plan))
+    return failures
+
+def read_query(conn,cmd,params=(),cache=None,name=None):
+    """
+    runs a query into a data frame - through the cache if one is given
+    :param cache: a QueryCache, the data frame is then only computed if data has arrived since the last time
+    :param name: the name the result is cached under - defaults to the command itself
+    :return: the data frame
+    """
+    import pandas as pd
+    if cache is None:
+        return pd.read_sql_query(cmd,conn,params=params)
+    return cache.get(name or cmd,tuple(params),lambda: pd.read_sql_query(cmd,conn,params=params))
+
+def query1(conn,use_rollups=True,cache=None):
     # first answer
-    cmd = "select user_name, count(*) as cnt " \
-             "from listeners " \
-             "group by user_name " \
-             "order by cnt desc " \
-             "limit 10;"
-    print(pd.read_sql_query(cmd,conn))
-
-def query2(conn):
+    cmd = QUERY1_ROLLUP_CMD if use_rollups else over_partitions(conn,QUERY1_FACTS_CMD,QUERY1_PARTIAL_CMD)
+    df = read_query(conn,cmd,cache=cache)
+    print(df)
+    return df
+
+def read_distinct_users(conn,day,column,cache=None):
+    """
+    :return: a data frame of the estimated number of distinct users of a day bucket, or of all days - None if the
+    database has no sketches
+    """
+    import pandas as pd
+    from src.sketch import approx_distinct_users
+
+    def compute():
+        count = approx_distinct_users(conn,day)
+        return None if count is None else pd.DataFrame({column: [count]})
+
+    return compute() if cache is None else cache.get("approx " + column,(day,),compute)
+
+def query2(conn,day="2019-03-01",use_rollups=True,cache=None,approximate=False):
     # second answer
-    cmd = "select distinct count(user_name) as active_user_count " \
-             "from listeners " \
-             "where date(listened_at,'unixepoch')='2019-03-01';"
-    print(pd.read_sql_query(cmd, conn))
+    day = day_number(day)
+    df = read_distinct_users(conn,day,"active_user_count",cache) if approximate else None
+    if df is None:
+        cmd = QUERY2_ROLLUP_CMD if use_rollups else QUERY2_FACTS_CMD.format(listeners=listeners_source(conn,day,day))
+        df = read_query(conn,cmd,(day,),cache=cache)
+    print(df)
+    return df
 
-def query3(conn):
-    cmd = "select user_name, min(listened_at) as first_listened_at, track_name " \
-          "from listeners join recordings on listeners.recording_msid=recordings.recording_msid " \
-          "group by user_name " \
-          "limit 10;"
+def query3(conn,use_rollups=True,cache=None):
+    cmd = QUERY3_ROLLUP_CMD if use_rollups else over_partitions(conn,QUERY3_FACTS_CMD,QUERY3_PARTIAL_CMD)
+    df = read_query(conn,cmd,cache=cache)
+    print(df)
+    return df
 
-    print(pd.read_sql_query(cmd,conn))
 
+def make_report(conn,grain="month",cache=None):
+    # the time series of the Task #3 metrics per day, week or month, read from the report the ingestion materializes
+    import pandas as pd
+    compute = lambda: pd.DataFrame(read_report(conn,grain),columns=REPORT_COLUMNS)
+    df = compute() if cache is None else cache.get("make_report",(grain,),compute)
+    print(df)
+    return df
 
-def make_dwh(conn):
+def make_dwh(conn,grain="month",cache=None,approximate=False):
     # Transformation step
     # execute queries to get a fact report for Task #3
+    # the sketches answer in constant time, the exact queries scan the whole fact table
+    from src.sketch import TOTAL_DAY
+    users = read_distinct_users(conn,TOTAL_DAY,"distinct_users",cache) if approximate else None
+    if users is None:
+        approximate = False
+        users = read_query(conn,over_partitions(conn,DWH_USERS_CMD,DWH_USERS_PARTIAL_CMD),cache=cache)
 
     # 1st metric - number of distinct users
-    cmd1 = "select distinct count(user_name) from listeners"
-    print(pd.read_sql_query(cmd1,conn))
+    print(users)
 
     # 2nd metric - 10 most popular tracks
-    cmd2 = "select track_name, count(*) as times_listened " \
-           "from listeners join recordings " \
-           "on listeners.recording_msid=recordings.recording_msid " \
-           "group by track_name " \
-           "order by times_listened desc " \
-           "limit 10;"
-    print(pd.read_sql_query(cmd2,conn))
+    print(read_query(conn,SKETCH_TRACKS_CMD if approximate else
+                     over_partitions(conn,DWH_TRACKS_CMD,DWH_RECORDINGS_PARTIAL_CMD),cache=cache))
 
     # 3rd metric - 5 most popular artists
-    cmd3 = "select artist_name, count(*) as times_listened " \
-           "from listeners join (select artist_name, recording_msid " \
-           "from artists join recordings " \
-           "on artists.artist_msid=recordings.artist_msid) as t " \
-           "on listeners.recording_msid=t.recording_msid " \
-           "group by artist_name " \
-           "order by times_listened desc " \
-           "limit 5;"
+    print(read_query(conn,SKETCH_ARTISTS_CMD if approximate else
+                     over_partitions(conn,DWH_ARTISTS_CMD,DWH_RECORDINGS_PARTIAL_CMD),cache=cache))
 
-    print(pd.read_sql_query(cmd3,conn))
+    # the same metrics over time - see ReportEngine
+    make_report(conn,grain,cache)
 
     """
     some other metrics that might be useful are:
-    1. listening duration for each track can give us who is the most engaged user
+    1. listening duration for each track can give us who is the most engaged user - the report approximates the
+    time listened per period from the listening sessions, see SessionMaintainer
     2. ratings/reviews for each track can give us the most liked track
     3. genre of music can help us understand the taste of the user-base.
     """
 
     return None
 
+def stream_rows(columns,rows,out=None):
+    """
+    writes rows as they come, tab separated under a header of the column names - no data frame is built
+    :param columns: the names of the columns
+    :param rows: an iterable of tuples, e.g. a cursor
+    :param out: the file to write to - stdout by default
+    :return: None
+    """
+    writer = csv.writer(out or sys.stdout,delimiter="\t",lineterminator="\n")
+    writer.writerow(columns)
+    writer.writerows(rows)
+
+def stream_query(conn,cmd,params=(),out=None):
+    """
+    runs a query and streams its rows from the cursor, see stream_rows
+    :return: None
+    """
+    cursor = conn.execute(cmd,params)
+    stream_rows([column[0] for column in cursor.description],cursor,out)
+
+# the subcommands of the command line, each answers from a connection and the parsed arguments
+# --frame goes through the functions above and prints their data frames, otherwise the rows are streamed
+
+def run_query1(conn,args):
+    if args.frame:
+        return query1(conn,use_rollups=not args.facts)
+    stream_query(conn,over_partitions(conn,QUERY1_FACTS_CMD,QUERY1_PARTIAL_CMD) if args.facts else QUERY1_ROLLUP_CMD)
+
+def run_query2(conn,args):
+    if args.frame:
+        return query2(conn,args.day,use_rollups=not args.facts,approximate=args.approximate)
+    day = day_number(args.day)
+    if args.approximate:
+        from src.sketch import approx_distinct_users
+        count = approx_distinct_users(conn,day)
+        if count is not None:
+            return stream_rows(["active_user_count"],[(count,)])
+    if args.facts:
+        stream_query(conn,QUERY2_FACTS_CMD.format(listeners=listeners_source(conn,day,day)),(day,))
+    else:
+        stream_query(conn,QUERY2_ROLLUP_CMD,(day,))
+
+def run_query3(conn,args):
+    if args.frame:
+        return query3(conn,use_rollups=not args.facts)
+    stream_query(conn,over_partitions(conn,QUERY3_FACTS_CMD,QUERY3_PARTIAL_CMD) if args.facts else QUERY3_ROLLUP_CMD)
+
+def run_dwh(conn,args):
+    if args.frame:
+        return make_dwh(conn,args.grain,approximate=args.approximate)
+    count = None
+    if args.approximate:
+        from src.sketch import approx_distinct_users, TOTAL_DAY
+        count = approx_distinct_users(conn,TOTAL_DAY)
+    if count is not None:
+        stream_rows(["distinct_users"],[(count,)])
+    else:
+        stream_query(conn,over_partitions(conn,DWH_USERS_CMD,DWH_USERS_PARTIAL_CMD))
+    for (sketch_cmd, cmd) in ((SKETCH_TRACKS_CMD, DWH_TRACKS_CMD), (SKETCH_ARTISTS_CMD, DWH_ARTISTS_CMD)):
+        print()
+        stream_query(conn,sketch_cmd if count is not None else over_partitions(conn,cmd,DWH_RECORDINGS_PARTIAL_CMD))
+    print()
+    run_report(conn,args)
+
+def run_report(conn,args):
+    if args.frame:
+        return make_report(conn,args.grain)
+    stream_rows(REPORT_COLUMNS,read_report(conn,args.grain))
+
+def run_plans(conn,args):
+    for (name, plan) in check_query_plans(conn):
+        print("{0} does not use its index: {1}".format(name, plan))
+
+def run_all(conn,args):
+    # the answers of Task #2 and the metrics of Task #3
+    for run in (run_query1, run_query2, run_query3, run_dwh):
+        run(conn,args)
+        print()
+    run_plans(conn,args)
+
+def make_parser():
+    parser = argparse.ArgumentParser(description="answers the BI questions from the database of the ingestion")
+    parser.add_argument("--db",default="spotify.db",help="the path of the database")
+    parser.add_argument("--frame",action="store_true",help="print pandas data frames instead of streaming the rows")
+    parser.add_argument("--facts",action="store_true",help="compute the answers from the listens, not the summaries")
+    parser.add_argument("--approximate",action="store_true",help="answer from the sketches where there are some")
+    parser.add_argument("--day",default="2019-03-01",help="the day of query2, YYYY-MM-DD")
+    parser.add_argument("--grain",choices=GRAINS,default="month",help="the periods of the report")
+    add_profiling_arguments(parser)
+    subparsers = parser.add_subparsers(dest="command",metavar="command")
+    for (name, run, help) in (("query1", run_query1, "the 10 most active users"),
+                              ("query2", run_query2, "the number of users active on --day"),
+                              ("query3", run_query3, "the first song of 10 users"),
+                              ("dwh", run_dwh, "the distinct users, the top tracks and artists and the report"),
+                              ("report", run_report, "the metrics per --grain"),
+                              ("plans", run_plans, "the queries that don't use their index"),
+                              ("all", run_all, "all of the above - the default")):
+        subparsers.add_parser(name,help=help).set_defaults(run=run)
+    parser.set_defaults(run=run_all)
+    return parser
+
+def main(argv=None):
+    """
+    the command line: runs one subcommand, or all, on a read-only connection next to the running ingestion so
+    that every answer comes from the same snapshot
+    :param argv: the arguments, sys.argv by default
+    :return: None
+    """
+    args = make_parser().parse_args(argv)
+    with profiled(args.profile,args.trace_memory):
+        pool = ReadPool(args.db,size=1)
+        try:
+            with pool.connection() as conn:
+                args.run(conn,args)
+        except BrokenPipeError:
+            # the reader of the rows, e.g. head, has stopped reading - the rest is discarded silently
+            os.dup2(os.open(os.devnull,os.O_WRONLY),sys.stdout.fileno())
+        finally:
+            pool.close()
+
 if __name__ == "__main__":
-    db_name = "spotify"
-    conn = sqlite3.connect('{}.db'.format(db_name))
-    # write specific queries to answer the questions for Task#2
-    query1(conn)
-    query2(conn)
-    query3(conn)
-    make_dwh(conn)
\ No newline at end of file
+    main()
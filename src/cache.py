@@ -0,0 +1,102 @@
+import logging
+from collections import OrderedDict
+from sqlite3 import OperationalError
+
+
+class IngestWatermark():
+
+    """
+    This class keeps the ingestion watermark: a sequence number in the table ingest_watermark that the ingestor
+    increments in the same transaction as every batch it writes and after every refresh of the report. A reader that
+    sees the same number as before knows that the data has not changed in between, see QueryCache.
+    """
+
+    def __init__(self, db_conn):
+        self.conn = db_conn
+        self.conn.execute("CREATE TABLE IF NOT EXISTS ingest_watermark "
+                          "(id INTEGER PRIMARY KEY CHECK (id = 1), "
+                          "batch_seq INTEGER)")
+        self.conn.execute("INSERT OR IGNORE INTO ingest_watermark VALUES (1, 0)")
+        self.conn.commit()
+
+    def bump(self):
+        """
+        increments the watermark without committing, the caller commits together with the data
+        :return: None
+        """
+        self.conn.execute("UPDATE ingest_watermark SET batch_seq = batch_seq + 1 WHERE id = 1")
+
+
+def read_watermark(conn):
+    """
+    :return: the current watermark, 0 for a database that has never been written to by the ingestor
+    """
+    try:
+        row = conn.execute("SELECT batch_seq FROM ingest_watermark WHERE id = 1").fetchone()
+    except OperationalError:
+        return 0
+    return row[0] if row else 0
+
+
+class QueryCache():
+
+    """
+    This class caches the results of the BI queries, keyed by the name of the query and its parameters and valid
+    for as long as the ingestion watermark stays the same. The least recently used results are evicted once more
+    than max_entries are held.
+    Reading the watermark is skipped altogether as long as nothing has been committed since the last read: sqlite
+    changes PRAGMA data_version whenever another connection commits and the connection counts its own changes in
+    total_changes. A repeated query on unchanged data is therefore answered without touching a table.
+    The results are handed out as they are cached, the callers must not modify them.
+    """
+
+    def __init__(self, conn, max_entries=256):
+        self.conn = conn
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # what the watermark was derived from the last time it was read
+        self.change_marker = None
+        self.last_watermark = None
+
+    def watermark(self):
+        """
+        :return: the current ingestion watermark
+        """
+        marker = (self.conn.execute("PRAGMA data_version").fetchone()[0], self.conn.total_changes)
+        if marker != self.change_marker:
+            self.last_watermark = read_watermark(self.conn)
+            self.change_marker = marker
+        return self.last_watermark
+
+    def get(self, name, params, compute):
+        """
+        :param name: the name of the query
+        :param params: the tuple of its parameters
+        :param compute: a callable without arguments that computes the result
+        :return: the cached result if the data has not changed since it was computed, the computed one otherwise
+        """
+        # the watermark is read before computing, a result computed while data arrives is recomputed next time
+        watermark = self.watermark()
+        key = (name, params)
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == watermark:
+            self.entries.move_to_end(key)
+            self.hits = self.hits + 1
+            return entry[1]
+        self.misses = self.misses + 1
+        result = compute()
+        self.entries[key] = (watermark, result)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        logging.info("{0}{1} has been computed at watermark {2}".format(name, params, watermark))
+        return result
+
+    def clear(self):
+        """
+        forgets all results
+        :return: None
+        """
+        self.entries.clear()
@@ -0,0 +1,180 @@
+import json
+import logging
+import os
+import numpy as np
+
+# the columns of the listeners fact table and their types
+LISTENER_COLUMNS = (("user_id", np.int32), ("recording_id", np.int32), ("listened_at", np.int64))
+# the dimension column recording_id -> artist_id, indexed by the recording id
+RECORDING_ARTIST = ("recording_artist", np.int32)
+META_FILE = "meta.json"
+
+
+class ColumnarExport():
+
+    """
+    This class keeps a copy of the listeners fact table in a directory as one raw binary file per column, which
+    numpy maps into memory without reading it (see ListenAnalytics):
+        user_id.bin (int32), recording_id.bin (int32), listened_at.bin (int64) - one value per listen
+        recording_artist.bin (int32) - the artist id of each recording, at the position of the recording id
+        meta.json - the number of listens exported and how many of them, from the start, are sorted by time
+    The listens are sorted by time. Each batch is appended after it has been committed to the database: a batch
+    that starts no earlier than the last listen exported keeps the columns sorted, a batch of late listens is
+    appended as it is and the columns are re-sorted once the unsorted tail grows beyond compact_ratio of the rows.
+    meta.json is replaced only after the columns have been written, so the export always agrees with a prefix of
+    the files. If the export does not match the number of listens in the database (e.g. after a crash between the
+    commit and the append) it is rebuilt from the database by sync. The listens dropped by the retention are
+    trimmed off by expire.
+    """
+
+    def __init__(self, directory, compact_ratio=0.1):
+        self.directory = directory
+        self.compact_ratio = compact_ratio
+        os.makedirs(directory, exist_ok=True)
+        self.rows, self.sorted_rows, self.last_listened_at = self.__load_meta__()
+
+    def path(self, column):
+        return os.path.join(self.directory, column + ".bin")
+
+    def __load_meta__(self):
+        try:
+            with open(os.path.join(self.directory, META_FILE)) as file:
+                meta = json.load(file)
+            return meta["rows"], meta["sorted_rows"], meta["last_listened_at"]
+        except FileNotFoundError:
+            return 0, 0, None
+
+    def __save_meta__(self):
+        path = os.path.join(self.directory, META_FILE)
+        with open(path + ".tmp", "w") as file:
+            json.dump({"rows": self.rows, "sorted_rows": self.sorted_rows,
+                       "last_listened_at": self.last_listened_at}, file)
+        os.replace(path + ".tmp", path)
+
+    def __write_column__(self, column, dtype, values, position, truncate=True):
+        """
+        writes values into a column file starting at a row position
+        :param truncate: a flag to drop anything after the values
+        :return: None
+        """
+        path = self.path(column)
+        with open(path, "r+b" if os.path.exists(path) else "w+b") as file:
+            file.seek(position * np.dtype(dtype).itemsize)
+            file.write(np.asarray(values, dtype=dtype).tobytes())
+            if truncate:
+                file.truncate()
+
+    def __append_recordings__(self, recording_rows):
+        """
+        writes the artist ids of new recordings at the positions of their ids
+        :return: None
+        """
+        column, dtype = RECORDING_ARTIST
+        path = self.path(column)
+        size = os.path.getsize(path) // np.dtype(dtype).itemsize if os.path.exists(path) else 0
+        ids = np.fromiter((row[0] for row in recording_rows), np.int64, len(recording_rows))
+        artists = np.fromiter((row[3] for row in recording_rows), np.int64, len(recording_rows))
+        # the ids are handed out sequentially, so the new recordings extend the column
+        new = ids >= size
+        tail = np.zeros(max(int(ids.max()) + 1 - size, 0), dtype)
+        tail[ids[new] - size] = artists[new]
+        self.__write_column__(column, dtype, tail, size)
+        for id, artist in zip(ids[~new], artists[~new]):
+            self.__write_column__(column, dtype, [artist], int(id), truncate=False)
+
+    def append(self, listener_rows, recording_rows=()):
+        """
+        appends a committed batch
+        :param listener_rows: the list of tuples (user_id, recording_id, listened_at, day) inserted into listeners
+        :param recording_rows: the list of tuples (recording_id, recording_msid, release_id, artist_id, track_name)
+        inserted into recordings
+        :return: None
+        """
+        if recording_rows:
+            self.__append_recordings__(recording_rows)
+        if not listener_rows:
+            return None
+        n = len(listener_rows)
+        listened_at = np.fromiter((row[2] for row in listener_rows), np.int64, n)
+        order = np.argsort(listened_at, kind="stable")
+        listened_at = listened_at[order]
+        user_ids = np.fromiter((row[0] for row in listener_rows), np.int64, n)[order]
+        recording_ids = np.fromiter((row[1] for row in listener_rows), np.int64, n)[order]
+        for (column, dtype), values in zip(LISTENER_COLUMNS, (user_ids, recording_ids, listened_at)):
+            self.__write_column__(column, dtype, values, self.rows)
+
+        in_order = self.sorted_rows == self.rows and (self.last_listened_at is None or
+                                                      listened_at[0] >= self.last_listened_at)
+        self.rows = self.rows + n
+        if in_order:
+            self.sorted_rows = self.rows
+            self.last_listened_at = int(listened_at[-1])
+        self.__save_meta__()
+        if self.rows - self.sorted_rows > self.compact_ratio * self.rows:
+            self.compact()
+
+    def compact(self):
+        """
+        sorts all listens by time
+        :return: None
+        """
+        if self.rows == 0:
+            return None
+        columns = [np.fromfile(self.path(column), dtype, self.rows) for (column, dtype) in LISTENER_COLUMNS]
+        order = np.argsort(columns[2], kind="stable")
+        for (column, dtype), values in zip(LISTENER_COLUMNS, columns):
+            self.__write_column__(column, dtype, values[order], 0)
+        self.sorted_rows = self.rows
+        self.last_listened_at = int(columns[2][order[-1]])
+        self.__save_meta__()
+        logging.info("the columnar export of {} listens has been sorted".format(self.rows))
+
+    def expire(self, before):
+        """
+        drops the listens older than a timestamp, e.g. those of the partitions dropped by the retention
+        :param before: the first timestamp kept
+        :return: the number of listens dropped
+        """
+        if self.rows == 0:
+            return 0
+        columns = [np.fromfile(self.path(column), dtype, self.rows) for (column, dtype) in LISTENER_COLUMNS]
+        keep = columns[2] >= before
+        n_dropped = self.rows - int(np.count_nonzero(keep))
+        if n_dropped == 0:
+            return 0
+        for (column, dtype), values in zip(LISTENER_COLUMNS, columns):
+            self.__write_column__(column, dtype, values[keep], 0)
+        # the listens kept stay in their order, the sorted ones still come first
+        self.sorted_rows = int(np.count_nonzero(keep[:self.sorted_rows]))
+        self.rows = self.rows - n_dropped
+        if self.sorted_rows == 0:
+            self.last_listened_at = None
+        self.__save_meta__()
+        logging.info("{} listens have been dropped from the columnar export".format(n_dropped))
+        return n_dropped
+
+    def sync(self, conn, chunk_size=1000000):
+        """
+        rebuilds the export from the database if it doesn't hold exactly the listens stored there
+        :param conn: the connection to the database
+        :param chunk_size: the number of listens read at once
+        :return: True if the export has been rebuilt
+        """
+        n_listens = conn.execute("SELECT count(*) FROM listeners").fetchone()[0]
+        if n_listens == self.rows:
+            return False
+        logging.warning("the columnar export holds {0} listens, the database {1}, rebuilding it".format(
+            self.rows, n_listens))
+        self.rows, self.sorted_rows, self.last_listened_at = 0, 0, None
+        for column, dtype in LISTENER_COLUMNS + (RECORDING_ARTIST,):
+            self.__write_column__(column, dtype, [], 0)
+        self.append([], conn.execute("SELECT recording_id, recording_msid, release_id, artist_id, track_name "
+                                     "FROM recordings").fetchall())
+        cursor = conn.execute("SELECT user_id, recording_id, listened_at FROM listeners ORDER BY listened_at")
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            self.append(rows)
+        self.__save_meta__()
+        return True
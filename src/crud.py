@@ -1,6 +1,25 @@
 import logging
 from sqlite3 import Error
 
+def enable_bulk_load(db_conn,cache_size_mb=256,mmap_size_mb=1024):
+    """
+    tunes the connection for sustained high-volume inserts:
+    WAL journaling (readers don't block the writer and a commit is a sequential append instead of a rewrite),
+    synchronous=NORMAL (no fsync per commit in WAL mode - a power loss can only lose the latest commits, never corrupt
+    the file), temporary b-trees in memory and a large page cache
+    :param db_conn: the connection to tune
+    :param cache_size_mb: the size of the page cache in MB
+    :param mmap_size_mb: the size of the memory-mapped I/O region in MB
+    :return: the journal mode in effect (an in-memory database for example can't use WAL)
+    """
+    journal_mode = db_conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+    db_conn.execute("PRAGMA synchronous=NORMAL")
+    db_conn.execute("PRAGMA temp_store=MEMORY")
+    db_conn.execute("PRAGMA cache_size=-{}".format(cache_size_mb * 1024))
+    db_conn.execute("PRAGMA mmap_size={}".format(mmap_size_mb * 1024 * 1024))
+    logging.info("bulk load mode enabled, journal mode is {}".format(journal_mode))
+    return journal_mode
+
 class CrudTable():
 
     """
@@ -14,13 +33,14 @@ class CrudTable():
         self.schema = schema # a tuple datatype
         self.__create__()
 
-    def __execute_commands__(self,command,commit=False,many=False,rows=None):
+    def __execute_commands__(self,command,commit=False,many=False,rows=None,silent=True):
         """
         this function executes the DML and DDL commands for the tables
         :param command: the command to execute
         :param commit: used in case of insertion operation - a flag to save the changes or not
         :param many: used in case of insertion operation - a flag to insert multiple rows
         :param rows: the list of tuples containing values for each row & column
+        :param silent: a flag to only print errors - set it to False to let the caller roll back a transaction
         :return: None
         """
         try:
@@ -31,6 +51,8 @@ class CrudTable():
             if commit:
                 self.conn.commit()
         except Error as e:
+            if not silent:
+                raise
             print(e)
 
     def dispose(self):
@@ -40,23 +62,27 @@ class CrudTable():
         """
         del self
 
-    def insert(self, rows):
+    def insert(self, rows, commit=True, or_ignore=False):
         """
         this function is responsible to insert records into the table
         :param rows: the list of tuples containing the values for each row & column
+        :param commit: a flag to commit right away - set it to False to insert into several tables in one transaction,
+        errors are then raised instead of printed so that the caller can roll the whole transaction back
+        :param or_ignore: a flag to skip rows violating a uniqueness constraint instead of failing the whole batch
         :return: None
         """
         try:
             if len(rows):
                 # make a placeholder string
                 placeholder_var = "("+ "?,"*(len(rows[0])-1) + "?)"
-                cmd = "INSERT INTO " + self.table_name + " VALUES " + placeholder_var
-                self.__execute_commands__(cmd,commit=True,many=True,rows=rows)
-                return None
-            else:
-                pass
-            logging.info("{0} rows has been inserted into {1}".format(len(rows), self.table_name))
+                cmd = "INSERT OR IGNORE INTO " if or_ignore else "INSERT INTO "
+                cmd = cmd + self.table_name + " VALUES " + placeholder_var
+                self.__execute_commands__(cmd,commit=commit,many=True,rows=rows,silent=commit)
+                logging.info("{0} rows has been inserted into {1}".format(len(rows), self.table_name))
+            return None
         except Error as e:
+            if not commit:
+                raise
             print(e)
 
 
@@ -97,15 +123,19 @@ class CrudTable():
         except Error as e:
             print(e)
 
-    def add_index(self,field_name):
+    def add_index(self,field_name,index_name=None):
         """
-        adds the index on a particular column
-        :param field_name: the column name to add the index
+        adds the index on a particular column - or on several columns, e.g. to make a covering index
+        :param field_name: the column name to add the index, or a tuple of column names
+        :param index_name: the name of the index - defaults to index_ followed by the column name
         :return: None
         """
         try:
-            index_name = "index_{}".format(field_name)
-            cmd = "CREATE INDEX {0} ON {1}({2})".format(index_name,self.table_name,field_name)
+            if isinstance(field_name,tuple):
+                field_name = ", ".join(field_name)
+            if index_name is None:
+                index_name = "index_{}".format(field_name)
+            cmd = "CREATE INDEX IF NOT EXISTS {0} ON {1}({2})".format(index_name,self.table_name,field_name)
             self.__execute_commands__(cmd)
             logging.info("Table {} has been altered".format(self.table_name))
         except Error as e:
@@ -114,14 +144,14 @@ class CrudTable():
 
     def __create__(self):
         """
-        this function creates a new table right after this class is instantiated
+        this function creates the table right after this class is instantiated - unless it exists already, in which
+        case its rows are kept (see SchemaManager for how outdated tables are handled)
         :return: None
         """
         try:
-            self.drop()
-            cmd = "CREATE TABLE " + self.table_name + str(self.schema) +";"
+            cmd = "CREATE TABLE IF NOT EXISTS " + self.table_name + str(self.schema) +";"
             self.__execute_commands__(cmd)
-            logging.info("Table {} has been created".format(self.table_name))
+            logging.info("Table {} is ready".format(self.table_name))
             return None
         except Error as e:
             print(e)
@@ -0,0 +1,191 @@
+import logging
+from collections import OrderedDict
+from hashlib import blake2b
+
+def fingerprint_listen(ele):
+    """
+    computes the fingerprint of the natural key (user_name, listened_at, recording_msid) of a listen. The key is
+    built from the repr of the fields so that their types count, e.g. "1555286560" and 1555286560 differ
+    :param ele: the listen as a dictionary
+    :return: a signed 64-bit integer
+    """
+    if isinstance(ele, dict):
+        try:
+            recording_msid = ele["track_metadata"]["additional_info"]["recording_msid"]
+        except (KeyError, TypeError):
+            recording_msid = ele.get("recording_msid")
+        key = repr((ele.get("user_name"), ele.get("listened_at"), recording_msid))
+    else:
+        key = str(ele)
+    digest = blake2b(key.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+class ListenDeduplicator():
+
+    """
+    This class rejects listens that have already been ingested, keyed on the natural key of a listen:
+    (user_name, listened_at, recording_msid). Instead of the listens themselves only a 64-bit fingerprint
+    of the key is kept, in two tiers:
+        1.an in-memory LRU of bounded size which answers the checks for recently seen listens
+        2.the listen_fingerprints table in the database (the fingerprint is its INTEGER PRIMARY KEY) which
+        answers the checks for everything else with an indexed lookup
+    so the memory of the process stays flat no matter how much history has been ingested.
+    """
+
+    def __init__(self, db_conn, cache_size=1000000):
+        self.conn = db_conn
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        # fingerprints accepted but not yet written to the database
+        self.pending = []
+        # the fingerprints of the items returned by the last call of filter_keyed, see discard
+        self.batch = []
+        self.__create_fingerprint_table__()
+
+    def __create_fingerprint_table__(self):
+        """
+        creates the table holding the fingerprints of all ingested listens if it doesn't exist yet
+        :return: None
+        """
+        cmd = "CREATE TABLE IF NOT EXISTS listen_fingerprints (fingerprint INTEGER PRIMARY KEY)"
+        self.conn.execute(cmd)
+        self.conn.commit()
+
+    def __remember__(self, fingerprint):
+        """
+        adds a fingerprint to the in-memory tier and evicts the least recently used one if it is full
+        :param fingerprint: the fingerprint
+        :return: None
+        """
+        self.cache[fingerprint] = None
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def __find_stored__(self, fingerprints, chunk_size=500):
+        """
+        looks up fingerprints in the database
+        :param fingerprints: the collection of fingerprints to look up
+        :param chunk_size: the number of fingerprints per query (sqlite limits the number of parameters)
+        :return: the set of fingerprints that are stored already
+        """
+        stored = set()
+        fingerprints = list(fingerprints)
+        for i in range(0, len(fingerprints), chunk_size):
+            chunk = fingerprints[i:i + chunk_size]
+            cmd = "SELECT fingerprint FROM listen_fingerprints WHERE fingerprint IN (" + \
+                  ",".join("?" * len(chunk)) + ")"
+            stored.update(row[0] for row in self.conn.execute(cmd, chunk))
+        return stored
+
+    def filter_new(self, list_of_jsons):
+        """
+        drops the listens that have been ingested before, in an earlier batch. The copies of a new listen within the
+        batch are all kept, since the first one may yet be rejected by the Extractor - which stores only the first
+        valid copy (see Extractor.duplicates)
+        :param list_of_jsons: the list of decoded listens
+        :return: the list of listens not ingested before, in their original order
+        """
+        return self.filter_keyed([(fingerprint_listen(ele), ele) for ele in list_of_jsons])
+
+    def filter_keyed(self, keyed):
+        """
+        same as filter_new for items whose fingerprints have been computed already, e.g. by a worker process
+        :param keyed: the list of tuples (fingerprint, item) - an item without a fingerprint (None), e.g. a line
+        rejected already, is passed through
+        :return: the list of items not ingested before, in their original order
+        """
+        cache = self.cache
+        misses = set()
+        for fingerprint, item in keyed:
+            if fingerprint is None:
+                continue
+            if fingerprint in cache:
+                cache.move_to_end(fingerprint)
+            else:
+                misses.add(fingerprint)
+        # only the fingerprints not in memory have to be looked up in the database
+        stored = self.__find_stored__(misses) if misses else set()
+
+        new_items = []
+        self.batch = batch = []
+        new = misses - stored
+        accepted = set()
+        for fingerprint, item in keyed:
+            if fingerprint is None:
+                new_items.append(item)
+                batch.append(None)
+                continue
+            if fingerprint in new:
+                # every copy within this batch is passed on, the fingerprint is accepted once
+                if fingerprint not in accepted:
+                    accepted.add(fingerprint)
+                    self.pending.append(fingerprint)
+                new_items.append(item)
+                batch.append(fingerprint)
+            self.__remember__(fingerprint)
+
+        n_duplicates = len(keyed) - len(new_items)
+        if n_duplicates:
+            logging.info("{} duplicate rows have been skipped".format(n_duplicates))
+        return new_items
+
+    def discard(self, positions):
+        """
+        forgets the fingerprints of listens of the last batch that have not been stored after all, e.g. those
+        rejected by the Extractor - so that a valid copy of a listen isn't skipped because of a rejected one
+        :param positions: the positions of the listens in the list returned by the last call of filter_keyed
+        :return: None
+        """
+        positions = set(positions)
+        # a fingerprint is kept as long as any copy of its listen has not been rejected
+        kept = set(fingerprint for (position, fingerprint) in enumerate(self.batch) if position not in positions)
+        discarded = set(self.batch[position] for position in positions) - kept
+        discarded.discard(None)
+        if not discarded:
+            return None
+        for fingerprint in discarded:
+            self.cache.pop(fingerprint, None)
+        self.pending = [fingerprint for fingerprint in self.pending if fingerprint not in discarded]
+
+    def flush(self, commit=True):
+        """
+        writes the fingerprints of the accepted listens to the database
+        :param commit: a flag to commit the transaction - set it to False to commit together with the data, then
+        commit or rollback is to be called once the transaction has ended
+        :return: None
+        """
+        if self.pending:
+            cmd = "INSERT OR IGNORE INTO listen_fingerprints VALUES (?)"
+            self.conn.executemany(cmd, ((fingerprint,) for fingerprint in self.pending))
+        if commit:
+            self.conn.commit()
+            self.commit()
+
+    def commit(self):
+        """
+        to be called once the fingerprints flushed have been committed
+        :return: None
+        """
+        self.pending = []
+
+    def rollback(self):
+        """
+        to be called if the batch could not be committed - the fingerprints accepted since the last commit are
+        evicted from the in-memory tier, so their listens are accepted again when the batch is retried
+        :return: None
+        """
+        for fingerprint in self.pending:
+            self.cache.pop(fingerprint, None)
+        self.pending = []
+
+    def reset(self):
+        """
+        forgets every fingerprint, both in memory and in the database
+        :return: None
+        """
+        self.cache.clear()
+        self.pending = []
+        self.batch = []
+        self.conn.execute("DELETE FROM listen_fingerprints")
+        self.conn.commit()
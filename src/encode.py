@@ -0,0 +1,186 @@
+import logging
+from collections import OrderedDict
+from src.rollup import SECONDS_PER_DAY
+
+
+class KeyEncoder():
+
+    """
+    This class maps the text keys of one table (msids, user names) to compact INTEGER ids, the INTEGER PRIMARY KEY
+    of that table. The mappings are looked up in three places:
+        1.the keys that got a new id in the current (not yet committed) batch
+        2.an in-memory LRU cache of bounded size
+        3.the UNIQUE index on the key column of the table
+    New ids are handed out sequentially after the largest id stored - this relies on the ingestor being the only
+    writer of the table.
+    """
+
+    def __init__(self, db_conn, table_name, id_column, key_column, cache_size=1000000):
+        self.conn = db_conn
+        self.table_name = table_name
+        self.id_column = id_column
+        self.key_column = key_column
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.pending = {}
+        # the next id to hand out, read from the table on first use
+        self.next_id = None
+        self.committed_next_id = None
+
+    def __find_stored__(self, keys, chunk_size=500):
+        """
+        looks up keys in the table
+        :param keys: the list of keys to look up
+        :param chunk_size: the number of keys per query (sqlite limits the number of parameters)
+        :return: a dictionary of the keys found with their ids
+        """
+        found = {}
+        for i in range(0, len(keys), chunk_size):
+            chunk = keys[i:i + chunk_size]
+            cmd = "SELECT {0}, {1} FROM {2} WHERE {0} IN (".format(self.key_column, self.id_column,
+                                                                  self.table_name) + ",".join("?" * len(chunk)) + ")"
+            found.update(self.conn.execute(cmd, chunk))
+        return found
+
+    def __remember__(self, key, id):
+        """
+        adds a mapping to the in-memory cache and evicts the least recently used one if it is full
+        :return: None
+        """
+        self.cache[key] = id
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def encode_many(self, keys):
+        """
+        maps keys to their ids, handing out new ids for the keys never seen before
+        :param keys: the list of keys
+        :return: a tuple (the list of ids in the order of the keys, the list of tuples (id, key) for the new keys)
+        """
+        cache = self.cache
+        pending = self.pending
+        # the ids of the batch are collected here, the cache may evict some of them before the batch is done
+        known = {}
+        misses = []
+        for key in keys:
+            if key in known:
+                continue
+            if key in cache:
+                cache.move_to_end(key)
+                known[key] = cache[key]
+            elif key in pending:
+                known[key] = pending[key]
+            else:
+                misses.append(key)
+
+        new_keys = []
+        if misses:
+            misses = list(dict.fromkeys(misses))
+            found = self.__find_stored__(misses)
+            for key, id in found.items():
+                self.__remember__(key, id)
+            known.update(found)
+            if self.next_id is None:
+                cmd = "SELECT coalesce(max({0}), 0) + 1 FROM {1}".format(self.id_column, self.table_name)
+                self.next_id = self.committed_next_id = self.conn.execute(cmd).fetchone()[0]
+            for key in misses:
+                if key not in found:
+                    pending[key] = known[key] = self.next_id
+                    new_keys.append((self.next_id, key))
+                    self.next_id = self.next_id + 1
+
+        ids = [known[key] for key in keys]
+        return ids, new_keys
+
+    def commit(self):
+        """
+        to be called once the rows with the new ids have been committed to the table
+        :return: None
+        """
+        for key, id in self.pending.items():
+            self.__remember__(key, id)
+        self.pending = {}
+        self.committed_next_id = self.next_id
+
+    def rollback(self):
+        """
+        to be called if the rows with the new ids could not be committed - the new ids are forgotten
+        :return: None
+        """
+        self.pending = {}
+        self.next_id = self.committed_next_id
+
+
+class DictionaryEncoder():
+
+    """
+    This class sits in the ingestion path between the Extractor and the tables. It turns the rows the Extractor
+    produces with text keys into rows keyed by INTEGER ids, so that the fact table listeners consists of integer
+    columns only and the dimension tables store each msid and user name exactly once:
+        artists (artist_id, artist_msid, artist_name)
+        releases (release_id, release_msid, release_name)
+        recordings (recording_id, recording_msid, release_id, artist_id, track_name)
+        users (user_id, user_name)
+        listeners (user_id, recording_id, listened_at, day)
+    """
+
+    def __init__(self, db_conn, cache_size=1000000):
+        self.artists = KeyEncoder(db_conn, "artists", "artist_id", "artist_msid", cache_size)
+        self.releases = KeyEncoder(db_conn, "releases", "release_id", "release_msid", cache_size)
+        self.recordings = KeyEncoder(db_conn, "recordings", "recording_id", "recording_msid", cache_size)
+        self.users = KeyEncoder(db_conn, "users", "user_id", "user_name", cache_size)
+
+    def encode_rows(self, rows):
+        """
+        encodes the rows of one batch
+        :param rows: dictionary of list of tuples per table as returned by the Extractor
+        :return: dictionary of list of tuples per table, with the additional key "user_data" for the users table
+        """
+        artist_data = rows["artist_data"]
+        artist_ids, new_artists = self.artists.encode_many([row[0] for row in artist_data])
+        new_artist_ids = set(id for (id, key) in new_artists)
+        encoded_artists = [(id,) + row for (id, row) in zip(artist_ids, artist_data) if id in new_artist_ids]
+
+        release_data = rows["release_data"]
+        release_ids, new_releases = self.releases.encode_many([row[0] for row in release_data])
+        new_release_ids = set(id for (id, key) in new_releases)
+        encoded_releases = [(id,) + row for (id, row) in zip(release_ids, release_data) if id in new_release_ids]
+
+        recording_data = rows["recording_data"]
+        recording_ids, new_recordings = self.recordings.encode_many([row[0] for row in recording_data])
+        new_recording_ids = set(id for (id, key) in new_recordings)
+        release_ids, unknown = self.releases.encode_many([row[1] for row in recording_data])
+        artist_ids, unknown = self.artists.encode_many([row[2] for row in recording_data])
+        encoded_recordings = [(recording_ids[i], row[0], release_ids[i], artist_ids[i], row[3])
+                              for (i, row) in enumerate(recording_data) if recording_ids[i] in new_recording_ids]
+
+        listener_data = rows["listener_data"]
+        user_ids, new_users = self.users.encode_many([row[0] for row in listener_data])
+        recording_ids, unknown = self.recordings.encode_many([row[1] for row in listener_data])
+        encoded_listeners = [(user_ids[i], recording_ids[i], row[2], row[2] // SECONDS_PER_DAY)
+                             for (i, row) in enumerate(listener_data)]
+
+        if len(encoded_artists) < len(artist_data) or len(encoded_recordings) < len(recording_data):
+            logging.info("some dimension rows of the batch have been stored before and are skipped")
+
+        return {"artist_data": encoded_artists,
+                "release_data": encoded_releases,
+                "recording_data": encoded_recordings,
+                "user_data": new_users,
+                "listener_data": encoded_listeners}
+
+    def commit(self):
+        """
+        to be called once the encoded batch has been committed
+        :return: None
+        """
+        for encoder in (self.artists, self.releases, self.recordings, self.users):
+            encoder.commit()
+
+    def rollback(self):
+        """
+        to be called if the encoded batch could not be committed
+        :return: None
+        """
+        for encoder in (self.artists, self.releases, self.recordings, self.users):
+            encoder.rollback()
@@ -1,5 +1,51 @@
-import logging
 import re
+import time
+from src.reject import Rejected, SPARSE, INVALID_MSID, INVALID_FIELD, UNKNOWN_RECORDING, EXPIRED, INVALID_TIMESTAMP
+from src.keystore import KeyStore, SetKeyStore
+
+# regex pattern of the msids used for validation checks
+MSID_PATTERN = re.compile("[a-f0-9]{8}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{12}")
+# the seconds a timestamp may lie ahead of the clock (skewed clocks of the clients), anything later is rejected -
+# a listen stamped in the future would create its partition and move the retention window past all real listens
+FUTURE_MARGIN = 86400
+
+def normalize_listen(ele,reg_pattern=MSID_PATTERN):
+    """
+    the stateless half of the extraction: looks up every field a listen contributes to the tables once and checks
+    its validity. It does not depend on the listens seen before, so it can also run in a worker process
+    :param ele: the listen as a dictionary
+    :param reg_pattern: the compiled regex pattern of the msids
+    :return: a tuple (artist_msid, artist_name, release_msid, release_name, recording_msid, track_name, user_name,
+    listened_at) in which every value that failed its check is None - or None if the listen is too sparse to use.
+    Nothing is logged here, the rejections are accounted for per batch (see Extractor.rejected)
+    """
+    try:
+        track_metadata = ele["track_metadata"]
+        additional_info = track_metadata["additional_info"]
+        artist_msid = additional_info.get("artist_msid")
+        release_msid = additional_info.get("release_msid")
+        recording_msid = additional_info.get("recording_msid")
+        artist_name = track_metadata.get("artist_name")
+        release_name = track_metadata.get("release_name")
+        track_name = track_metadata.get("track_name")
+        user_name = ele.get("user_name")
+        listened_at = ele.get("listened_at")
+    except (KeyError, TypeError, AttributeError):
+        return None
+
+    # each msid is validated exactly once, the results are reused for all tables
+    valid_artist = type(artist_msid) is str and reg_pattern.match(artist_msid) is not None
+    valid_release = type(release_msid) is str and reg_pattern.match(release_msid) is not None
+    valid_recording = type(recording_msid) is str and reg_pattern.match(recording_msid) is not None
+
+    return (artist_msid if valid_artist else None,
+            artist_name if type(artist_name) is str else None,
+            release_msid if valid_release else None,
+            release_name if type(release_name) is str else None,
+            recording_msid if valid_recording else None,
+            track_name if type(track_name) is str else None,
+            user_name if type(user_name) is str else None,
+            listened_at if type(listened_at) is int else None)
 
 class Extractor():
 
@@ -9,23 +55,43 @@ class Extractor():
         1.check for sparse rows and data type of each element in a row before adding the element to the list of tuples
         2.check the msids that each one has equal length, follow the same regex pattern and are unique
             regex pattern of msids : [a-f0-9]{8}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{12}
+        3.check that the timestamp is neither before 1970 nor in the future (see FUTURE_MARGIN), and that the listen
+        isn't older than the listens kept by the retention, see expired_before
+        4.check that a listen is stored once per batch - a copy of a listen stored earlier in it is skipped, so the
+        first valid copy is kept even if an earlier one was rejected, see duplicates
     if any of the above checks fail do not create the corresponding tuple for the row and skip to the next one
+    every listen that yields no listener row is noted in rejected with its reason, see RejectStore
+    Every listen is processed in a single pass: each nested field is looked up once, each msid is validated once
+    (see normalize_listen) and the rows are appended straight to the output list of the corresponding table.
+    The msids seen so far are not held in memory but in a KeyStore per dimension table, which answers for all msids
+    of a batch at once, so the memory stays bounded however many msids have been ingested.
     Many aspects of this class are hard-coded and expect the input to be the specific ListenBrainz dataset
     """
 
-    def __init__(self):
-        self.list_of_jsons = []
-        # initialize empty sets of msids
-        self.set_of_artist_msids = set([])
-        self.set_of_release_msids = set([])
-        self.set_of_recording_msids = set([])
+    def __init__(self,list_of_jsons=None,db_conn=None,key_store=None):
+        """
+        :param db_conn: the database the msids of earlier runs are looked up in, see KeyStore - without one the
+        msids are kept in memory
+        :param key_store: a callable (table_name, key_column) returning the store of the msids of a table, to
+        configure or replace KeyStore
+        """
+        self.list_of_jsons = list_of_jsons if list_of_jsons is not None else []
+        if key_store is None:
+            key_store = (lambda table_name, key_column: KeyStore(db_conn, table_name, key_column)) \
+                if db_conn is not None else (lambda table_name, key_column: SetKeyStore())
+        # the stores of the msids seen so far
+        self.set_of_artist_msids = key_store("artists", "artist_msid")
+        self.set_of_release_msids = key_store("releases", "release_msid")
+        self.set_of_recording_msids = key_store("recordings", "recording_msid")
         # fix the regex pattern of the msids later to be used for validation checks
-        self.reg_pattern = re.compile("[a-f0-9]{8}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{12}")
-        # fix the field-names and the data-type for each table
-        self.dict_of_fields_recording = {"recording_msid": str, "release_msid": str, "artist_msid": str, "track_name":str}
-        self.dict_of_fields_listener = {"listened_at":int, "recording_msid":str,"user_name":str}
-        self.dict_of_fields_release = {"release_msid": str, "release_name": str}
-        self.dict_of_fields_artist = {"artist_msid": str, "artist_name": str}
+        self.reg_pattern = MSID_PATTERN
+        # the listens of the last batch that yielded no listener row, as tuples (position in the batch, reason,
+        # the normalized listen or the line it was read from)
+        self.rejected = []
+        # the number of listens of the last batch skipped as copies of a listen stored earlier in the batch
+        self.duplicates = 0
+        # the first timestamp kept by the retention, the listens before it are rejected as EXPIRED - None to keep all
+        self.expired_before = None
         pass
 
     def dispose(self):
@@ -35,219 +101,168 @@ class Extractor():
         """
         del self
 
-    def __is_consistent_datatype__(self,element,dict_of_fields):
+    def commit(self):
         """
-        this function checks if all the values have valid datatypes
-        :param element: the collection of key-value pairs in the form of dictionary
-        :param dict_of_fields: a dictionary with key as the field-names and values as required data-type
-        :return: flg: A flag denoting if the check passed or not
+        to be called once the rows of the last batch have been committed
+        :return: None
         """
-        flg = True
-        for (k,v) in element.items():
-            if type(v)!=dict_of_fields[k]:
-                flg=False
-                break
-        return flg
+        for store in (self.set_of_artist_msids, self.set_of_release_msids, self.set_of_recording_msids):
+            store.commit()
 
-    def __is_a_valid_msid__(self,id):
+    def rollback(self):
         """
-        this function checks the validity of an msid
-        :param id: the msid
-        :return: A boolean denoting whether the id passed the check or not
+        to be called if the rows of the last batch could not be committed - its msids are forgotten
+        :return: None
         """
-        # check if the id is a string
-        if isinstance(id,str):
-            # check if the id matches the pattern
-            if self.reg_pattern.match(id):
-                return True
-            else:
-                return False
-        else:
-            return False
+        for store in (self.set_of_artist_msids, self.set_of_release_msids, self.set_of_recording_msids):
+            store.rollback()
 
-    def __extract_artist_data__(self,dict):
+    def __accept__(self,records):
         """
-        this function extracts the values for a row in the artist table - also ensuring that each value
-        qualifies all the consistency checks.
-        :return: a tuple containing the values
+        the stateful half of the extraction: enforces the primary-key and foreign-key constraints against the msids
+        seen so far and appends the rows straight to the output list of the corresponding table
+        :param records: an iterable of the tuples returned by normalize_listen, in the order of the listens - or of
+        Rejected tuples for lines rejected before
+        :return: dictionary containing the keys as table names and list of tuples as values
         """
-        art = {}
-        try:
-            if self.__is_a_valid_msid__(dict["track_metadata"]["additional_info"]["artist_msid"]):
-                art["artist_msid"] = dict["track_metadata"]["additional_info"]["artist_msid"]
-            else:
-                logging.warning(
-                    "invalid artist msid: " + str(dict["track_metadata"]["additional_info"]["artist_msid"]))
-                art["artist_msid"] = 0
-            art["artist_name"] = dict["track_metadata"]["artist_name"]
-            if self.__is_consistent_datatype__(art, self.dict_of_fields_artist):
-                # primary key contraint ensured
-                if art["artist_msid"] not in self.set_of_artist_msids:
-                    self.set_of_artist_msids.add(art["artist_msid"])
-                    return tuple(val for (key, val) in art.items())
-                else:
-                    return None
-            else:
-                return None
-        except KeyError as error:
-            logging.error("sparse artist data")
-            return None
+        records = list(records)
+        # the msids of the batch that are stored already, looked up at once - the msids of the rows appended are
+        # added to these sets and to the stores
+        listens = [record for record in records if record is not None and type(record) is not Rejected]
+        artist_msids = self.set_of_artist_msids.present(record[0] for record in listens)
+        release_msids = self.set_of_release_msids.present(record[2] for record in listens)
+        recording_msids = self.set_of_recording_msids.present(record[4] for record in listens)
 
-    def __extract_release_data__(self,dict):
-        """
-        this function extracts the values for a row in the release table - also ensuring that each value
-        qualifies all the consistency checks.
-        :return: a tuple containing the values
-        """
-        release = {}
-        try:
-            if self.__is_a_valid_msid__(dict["track_metadata"]["additional_info"]["release_msid"]):
-                release["release_msid"] = dict["track_metadata"]["additional_info"]["release_msid"]
-            else:
-                logging.warning(
-                    "invalid artist msid: " + str(dict["track_metadata"]["additional_info"]["release_msid"]))
-                release["release_msid"] = 0
-            release["release_name"] = dict["track_metadata"]["release_name"]
-            if self.__is_consistent_datatype__(release, self.dict_of_fields_release):
-                # primary key contraint ensured
-                if release["release_msid"] not in self.set_of_release_msids:
-                    self.set_of_release_msids.add(release["release_msid"])
-                    return tuple(val for (key, val) in release.items())
-                else:
-                    return None
-            else:
-                return None
-        except KeyError as error:
-            logging.error("sparse release data")
-            return None
+        rows = {}
+        rows["artist_data"] = []
+        rows["release_data"] = []
+        rows["recording_data"] = []
+        rows["listener_data"] = []
 
-    def __extract_recording_data__(self,dict):
-        """
-        this function extracts the values for a row in the recordings table - also ensuring that each value
-        qualifies all the consistency checks.
-        :return: a tuple containing the values
-        """
-        recording = {}
-        try:
-            if self.__is_a_valid_msid__(dict["track_metadata"]["additional_info"]["recording_msid"]):
-                recording["recording_msid"] = dict["track_metadata"]["additional_info"]["recording_msid"]
-            else:
-                logging.warning(
-                    "invalid recording msid: " + str(dict["track_metadata"]["additional_info"]["recording_msid"]))
-                recording["recording_msid"] = 0
+        # bind everything used per listen to locals once per batch
+        artist_rows = rows["artist_data"].append
+        release_rows = rows["release_data"].append
+        recording_rows = rows["recording_data"].append
+        listener_rows = rows["listener_data"].append
+        add_artist = self.set_of_artist_msids.add
+        add_release = self.set_of_release_msids.add
+        add_recording = self.set_of_recording_msids.add
+        self.rejected = []
+        rejected = self.rejected.append
+        # the natural keys (user_name, recording_msid, listened_at) of the listener rows of this batch - the
+        # deduplicator passes on every copy of a new listen, only the first valid one is stored
+        stored = set()
+        duplicates = 0
+        expired_before = self.expired_before
+        latest = int(time.time()) + FUTURE_MARGIN
 
-            # check if key exists in parent table - releases
-            if dict["track_metadata"]["additional_info"]["release_msid"] in self.set_of_release_msids:
-                recording["release_msid"] = dict["track_metadata"]["additional_info"]["release_msid"]
-            else:
-                logging.warning("invalid release msid: " + str(dict["track_metadata"]["additional_info"]["release_msid"]))
-                recording["release_msid"] = 0
+        for index, record in enumerate(records):
+            if record is None:
+                rejected((index, SPARSE, None))
+                continue
+            if type(record) is Rejected:
+                rejected((index, record.reason, record.payload))
+                continue
+            (artist_msid, artist_name, release_msid, release_name,
+             recording_msid, track_name, user_name, listened_at) = record
+            if (user_name, recording_msid, listened_at) in stored:
+                duplicates = duplicates + 1
+                continue
+            if listened_at is not None and not 0 <= listened_at <= latest:
+                rejected((index, INVALID_TIMESTAMP, record))
+                continue
+            if expired_before is not None and listened_at is not None and listened_at < expired_before:
+                rejected((index, EXPIRED, record))
+                continue
 
-            # check if key exists in parent table - artists
-            if dict["track_metadata"]["additional_info"]["artist_msid"] in self.set_of_artist_msids:
-                recording["artist_msid"] = dict["track_metadata"]["additional_info"]["artist_msid"]
-            else:
-                logging.warning("invalid artist msid: " + str(dict["track_metadata"]["additional_info"]["artist_msid"]))
-                recording["artist_msid"] = 0
+            # primary key contraint ensured for the dimension tables
+            if artist_msid is not None and artist_name is not None and artist_msid not in artist_msids:
+                artist_msids.add(artist_msid)
+                add_artist(artist_msid)
+                artist_rows((artist_msid, artist_name))
+
+            if release_msid is not None and release_name is not None and release_msid not in release_msids:
+                release_msids.add(release_msid)
+                add_release(release_msid)
+                release_rows((release_msid, release_name))
 
-            recording["track_name"] = dict["track_metadata"]["track_name"]
+            if recording_msid is not None:
+                # the parent keys must exist in releases and artists (foreign-key constraints)
+                if track_name is not None and recording_msid not in recording_msids \
+                        and release_msid in release_msids and artist_msid in artist_msids:
+                    recording_msids.add(recording_msid)
+                    add_recording(recording_msid)
+                    recording_rows((recording_msid, release_msid, artist_msid, track_name))
 
-            if self.__is_consistent_datatype__(recording, self.dict_of_fields_recording):
-                # primary key contraint ensured
-                if recording["recording_msid"] not in self.set_of_recording_msids:
-                    self.set_of_recording_msids.add(recording["recording_msid"])
-                    return tuple(val for (key, val) in recording.items())
+                # the parent key must exist in recordings (foreign-key constraint)
+                if recording_msid in recording_msids:
+                    if user_name is not None and listened_at is not None:
+                        stored.add((user_name, recording_msid, listened_at))
+                        listener_rows((user_name, recording_msid, listened_at))
+                    else:
+                        rejected((index, INVALID_FIELD, record))
                 else:
-                    return None
+                    rejected((index, UNKNOWN_RECORDING, record))
             else:
-                return None
-        except KeyError as error:
-            logging.error("sparse recording data!")
-            return None
+                rejected((index, INVALID_MSID, record))
 
-    def __extract_listener_data__(self,dict):
-        """
-        this function extracts the values for a row in the listener table - also ensuring that each value
-        qualifies all the consistency checks.
-        :return: a tuple containing the values
-        """
-        listener = {}
-        try:
-            listener["user_name"] = dict["user_name"]
-            # check if key exists in parent table
-            if dict["track_metadata"]["additional_info"]["recording_msid"] in self.set_of_recording_msids:
-                listener["recording_msid"] = dict["track_metadata"]["additional_info"]["recording_msid"]
-            else:
-                logging.warning(
-                    "invalid recording msid: " + str(dict["track_metadata"]["additional_info"]["recording_msid"]))
-                listener["recording_msid"] = 0
-            listener["listened_at"] = dict["listened_at"]
-            if self.__is_consistent_datatype__(listener, self.dict_of_fields_listener):
-                return tuple(val for (key, val) in listener.items())
-            else:
-                return None
-        except KeyError as error:
-            logging.error("sparse listener data!")
-            return None
+        self.duplicates = duplicates
+        return rows
 
     def __create_list_of_tuples_from_json__(self):
         """
         extract the data corresponding to each table
         :return: dictionary containing the keys as table names and list of tuples as values
         """
-        rows = {}
-        rows["artist_data"] = []
-        rows["release_data"] = []
-        rows["recording_data"] = []
-        rows["listener_data"] = []
-        for ele in self.list_of_jsons:
-            artist_data_row = self.__extract_artist_data__(ele)
-            if artist_data_row:
-                rows["artist_data"].append(artist_data_row)
-            release_data_row = self.__extract_release_data__(ele)
-            if release_data_row:
-                rows["release_data"].append(release_data_row)
-            recording_data_row = self.__extract_recording_data__(ele)
-            if recording_data_row:
-                rows["recording_data"].append(recording_data_row)
+        reg_pattern = self.reg_pattern
+        return self.__accept__(normalize_listen(ele, reg_pattern) for ele in self.list_of_jsons)
 
-            listener_data_row = self.__extract_listener_data__(ele)
-            if listener_data_row:
-                rows["listener_data"].append(listener_data_row)
-
-        return rows
 
     # the below written schema extraction must be automatic
     # but for this purpose it has been hard-coded
     # this could be done by creating a map between the data-types of pandas and sqlite3
     # because pandas, to some extent, can infer schema automatically
 
+    # the rows produced here carry the msids and user names as text, the tables store them dictionary-encoded
+    # as INTEGER ids (see DictionaryEncoder) so that the fact table listeners holds integer columns only
+    # listeners also carries the precomputed day bucket of listened_at so that a filter on the day can use an index
+
     def __create_listener_schema__(self):
-        schema = "(user_name TEXT, " \
-                 "recording_msid TEXT, " \
-                 "listened_at INTEGER," \
-                 "FOREIGN KEY(recording_msid) REFERENCES recording(recording_msid))"
+        schema = "(user_id INTEGER, " \
+                 "recording_id INTEGER, " \
+                 "listened_at INTEGER, " \
+                 "day INTEGER," \
+                 "FOREIGN KEY(user_id) REFERENCES users(user_id)," \
+                 "FOREIGN KEY(recording_id) REFERENCES recordings(recording_id))"
         return schema
 
     def __create_release_schema__(self):
-        schema = "(release_msid TEXT PRIMARY KEY, " \
+        schema = "(release_id INTEGER PRIMARY KEY, " \
+                 "release_msid TEXT UNIQUE, " \
                  "release_name TEXT)"
         return schema
 
     def __create_recording_schema__(self):
-        schema = "(recording_msid TEXT PRIMARY KEY, " \
-                 "release_msid TEXT , " \
-                 "artist_msid TEXT ," \
+        schema = "(recording_id INTEGER PRIMARY KEY, " \
+                 "recording_msid TEXT UNIQUE, " \
+                 "release_id INTEGER , " \
+                 "artist_id INTEGER ," \
                  "track_name TEXT, " \
-                 "FOREIGN KEY(release_msid) REFERENCES release(release_msid)," \
-                 "FOREIGN KEY(artist_msid) REFERENCES artist(artist_msid))"
+                 "FOREIGN KEY(release_id) REFERENCES releases(release_id)," \
+                 "FOREIGN KEY(artist_id) REFERENCES artists(artist_id))"
         return schema
 
     def __create_artist_schema__(self):
-        schema_tuple = "(artist_msid TEXT PRIMARY KEY," \
+        schema_tuple = "(artist_id INTEGER PRIMARY KEY," \
+                       "artist_msid TEXT UNIQUE," \
                        "artist_name TEXT)"
         return schema_tuple
 
+    def __create_user_schema__(self):
+        schema = "(user_id INTEGER PRIMARY KEY, " \
+                 "user_name TEXT UNIQUE)"
+        return schema
+
     # the public functions although python doesnot support explicit access modifiers
     def get_schema_for_all_tables(self):
         """
@@ -255,12 +270,23 @@ class Extractor():
         :return:
         """
         return self.__create_listener_schema__(), self.__create_release_schema__(), \
-               self.__create_recording_schema__(), self.__create_artist_schema__()
+               self.__create_recording_schema__(), self.__create_artist_schema__(), self.__create_user_schema__()
 
-    def get_rows_for_all_tables(self,list_of_jsons):
+    def get_rows_for_all_tables(self,list_of_jsons=None):
         """
         public function to be accessed from the main code to obtain the list of values to be inserted for all the table
+        :param list_of_jsons: the list of json/dict rows - if omitted the list given to the constructor is used
+        :return: dictionary of list of tuples
+        """
+        if list_of_jsons is not None:
+            self.list_of_jsons = list_of_jsons
+        return self.__create_list_of_tuples_from_json__()
+
+    def get_rows_for_normalized(self,records):
+        """
+        public function to obtain the list of values to be inserted for all the tables from listens that have
+        already been passed through normalize_listen, e.g. by worker processes during a backfill
+        :param records: an iterable of the tuples returned by normalize_listen, in the order of the listens
         :return: dictionary of list of tuples
         """
-        self.list_of_jsons = list_of_jsons
-        return self.__create_list_of_tuples_from_json__()
\ No newline at end of file
+        return self.__accept__(records)
\ No newline at end of file
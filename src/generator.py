@@ -0,0 +1,160 @@
+import argparse
+import itertools
+import json
+import logging
+import random
+import uuid
+
+# the kinds of corrupted lines the generator can inject
+CORRUPTION_KINDS = ("truncated", "invalid_msid", "missing_field", "wrong_type")
+
+def zipf_weights(n, skew):
+    """
+    :param n: the number of items
+    :param skew: the exponent of the distribution - 0 is uniform, around 1 is a realistic popularity skew
+    :return: the list of cumulative weights of the items 1 to n
+    """
+    return list(itertools.accumulate(1.0 / (rank ** skew) for rank in range(1, n + 1)))
+
+
+class ListenGenerator():
+
+    """
+    This class writes a deterministic stream of ListenBrainz-shaped listens, one json document per line, for
+    testing and benchmarking at any scale. The same arguments always produce the same file.
+        users and recordings are drawn from zipf distributions of configurable skew, so a few users are very
+        active and a few tracks very popular, like in the real dataset
+        every recording belongs to one release and one artist, there are a tenth as many artists and a fifth as many
+        releases as recordings
+        the listens move forward in time over the given number of days
+        a share of the lines repeats a recent line exactly (duplicates) and a share is corrupted, see
+        CORRUPTION_KINDS
+    Only the catalogue of users and recordings is held in memory, the listens are streamed.
+    """
+
+    def __init__(self, n_users=10000, n_tracks=100000, user_skew=1.0, track_skew=1.0, duplicate_rate=0.0,
+                 corrupt_rate=0.0, corrupt_kinds=CORRUPTION_KINDS, days=365, start=1546300800, seed=42):
+        self.n_users = n_users
+        self.n_tracks = n_tracks
+        self.user_skew = user_skew
+        self.track_skew = track_skew
+        self.duplicate_rate = duplicate_rate
+        self.corrupt_rate = corrupt_rate
+        self.corrupt_kinds = tuple(corrupt_kinds)
+        self.days = days
+        self.start = start
+        self.seed = seed
+        for kind in self.corrupt_kinds:
+            if kind not in CORRUPTION_KINDS:
+                raise ValueError("unknown kind of corruption {}".format(kind))
+
+    def __make_msid__(self, rnd):
+        return str(uuid.UUID(int=rnd.getrandbits(128), version=4))
+
+    def __make_catalogue__(self, rnd):
+        """
+        :return: the list of user names and the list of tuples (recording_msid, track_name, release, artist) with
+        release and artist tuples (msid, name), both in the order of their popularity
+        """
+        artists = [(self.__make_msid__(rnd), "artist {}".format(i)) for i in range(max(self.n_tracks // 10, 1))]
+        releases = [(self.__make_msid__(rnd), "release {}".format(i)) for i in range(max(self.n_tracks // 5, 1))]
+        recordings = [(self.__make_msid__(rnd), "track {}".format(i), rnd.choice(releases), rnd.choice(artists))
+                      for i in range(self.n_tracks)]
+        users = ["user {}".format(i) for i in range(self.n_users)]
+        return users, recordings
+
+    def __make_listen__(self, user_name, recording, listened_at):
+        recording_msid, track_name, release, artist = recording
+        return {"track_metadata": {"additional_info": {"release_msid": release[0], "release_mbid": None,
+                                                       "recording_mbid": None, "artist_mbids": [], "tags": [],
+                                                       "artist_msid": artist[0], "recording_msid": recording_msid},
+                                   "artist_name": artist[1], "track_name": track_name, "release_name": release[1]},
+                "listened_at": listened_at, "recording_msid": recording_msid, "user_name": user_name}
+
+    def __corrupt__(self, rnd, kind, listen):
+        """
+        :return: the line of a listen corrupted in the given way
+        """
+        if kind == "truncated":
+            line = json.dumps(listen)
+            return line[:rnd.randrange(1, len(line) - 1)]
+        if kind == "invalid_msid":
+            listen["track_metadata"]["additional_info"]["recording_msid"] = "not-an-msid"
+        elif kind == "missing_field":
+            del listen["track_metadata"]
+        elif kind == "wrong_type":
+            listen["listened_at"] = str(listen["listened_at"])
+        return json.dumps(listen)
+
+    def lines(self, n_rows, chunk_size=10000):
+        """
+        generates the lines of the file
+        :param n_rows: the number of lines in total, including the duplicates and the corrupted ones
+        :param chunk_size: the number of users and recordings drawn at once
+        :return: yields tuples (line without newline, kind) with kind "listen", "duplicate" or a corruption kind
+        """
+        rnd = random.Random(self.seed)
+        users, recordings = self.__make_catalogue__(rnd)
+        user_weights = zipf_weights(len(users), self.user_skew)
+        track_weights = zipf_weights(len(recordings), self.track_skew)
+        seconds = self.days * 86400
+        # the lines duplicates are drawn from
+        recent = []
+        i = 0
+        while i < n_rows:
+            n = min(chunk_size, n_rows - i)
+            chunk_users = rnd.choices(users, cum_weights=user_weights, k=n)
+            chunk_recordings = rnd.choices(recordings, cum_weights=track_weights, k=n)
+            for j in range(n):
+                draw = rnd.random()
+                if recent and draw < self.duplicate_rate:
+                    yield rnd.choice(recent), "duplicate"
+                    continue
+                listened_at = self.start + (i + j) * seconds // n_rows + rnd.randrange(60)
+                listen = self.__make_listen__(chunk_users[j], chunk_recordings[j], listened_at)
+                if self.corrupt_kinds and draw < self.duplicate_rate + self.corrupt_rate:
+                    kind = rnd.choice(self.corrupt_kinds)
+                    yield self.__corrupt__(rnd, kind, listen), kind
+                    continue
+                line = json.dumps(listen)
+                if len(recent) < 1000:
+                    recent.append(line)
+                else:
+                    recent[rnd.randrange(1000)] = line
+                yield line, "listen"
+            i = i + n
+
+    def write(self, path, n_rows):
+        """
+        writes the lines to a file
+        :param path: the path of the file to write
+        :param n_rows: the number of lines in total
+        :return: a dictionary of the number of lines written per kind
+        """
+        counts = {}
+        with open(path, "w") as file:
+            for line, kind in self.lines(n_rows):
+                file.write(line + "\n")
+                counts[kind] = counts.get(kind, 0) + 1
+        logging.info("{0} lines have been written to {1}: {2}".format(n_rows, path, counts))
+        return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="writes a synthetic ListenBrainz dataset")
+    parser.add_argument("path")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--tracks", type=int, default=100000)
+    parser.add_argument("--user-skew", type=float, default=1.0)
+    parser.add_argument("--track-skew", type=float, default=1.0)
+    parser.add_argument("--duplicate-rate", type=float, default=0.0)
+    parser.add_argument("--corrupt-rate", type=float, default=0.0)
+    parser.add_argument("--corrupt-kinds", default=",".join(CORRUPTION_KINDS))
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    generator = ListenGenerator(args.users, args.tracks, args.user_skew, args.track_skew, args.duplicate_rate,
+                                args.corrupt_rate, [kind for kind in args.corrupt_kinds.split(",") if kind],
+                                args.days, seed=args.seed)
+    print(generator.write(args.path, args.rows))
@@ -0,0 +1,253 @@
+import hashlib
+import logging
+import math
+from collections import OrderedDict
+import numpy as np
+from src.sketch import hash64
+
+
+def compact_key(key):
+    """
+    :param key: an msid, or any other text key
+    :return: the 16 bytes of the UUID an msid spells out in hex, the 128 bit blake2b hash of any other key
+    """
+    digits = key.replace("-", "")
+    if len(digits) == 32:
+        try:
+            return bytes.fromhex(digits)
+        except ValueError:
+            pass
+    return hashlib.blake2b(key.encode(), digest_size=16).digest()
+
+def compact_keys(keys):
+    """
+    :param keys: a list of keys
+    :return: the concatenation of their compact_key - decoded in one go if they are all msids
+    """
+    digits = "".join(keys).replace("-", "")
+    if len(digits) == 32 * len(keys):
+        try:
+            return bytes.fromhex(digits)
+        except ValueError:
+            pass
+    return b"".join(compact_key(key) for key in keys)
+
+
+class BloomFilter():
+
+    """
+    This class answers "has this key been added?" with no false negatives and a false positive rate of about
+    error_rate for up to capacity keys, in -capacity * ln(error_rate) / ln(2)**2 bits - about 1.2 bytes per key at
+    1%. The k bit positions of a compact key are derived from the splitmix64 hashes of its two halves (double
+    hashing), vectorized over a whole batch of keys.
+    """
+
+    def __init__(self, capacity, error_rate=0.01, max_bytes=None):
+        """
+        :param capacity: the number of keys the error rate holds for
+        :param max_bytes: the largest size of the bit array - a filter capped by it fills up earlier, which only
+        raises the false positive rate
+        """
+        n_bits = max(int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)), 64)
+        if max_bytes is not None:
+            n_bits = min(n_bits, max_bytes * 8)
+        self.capacity = capacity
+        self.n_bits = n_bits
+        self.n_hashes = max(int(round(n_bits / capacity * math.log(2))), 1)
+        self.bits = np.zeros((n_bits + 7) // 8, dtype=np.uint8)
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+    def __positions__(self, blob):
+        """
+        :param blob: the concatenation of 16 byte keys, see compact_keys
+        :return: the array of the bit positions, one row of n_hashes per key
+        """
+        halves = np.frombuffer(blob, dtype=np.int64).reshape(-1, 2)
+        h1 = hash64(halves[:, 0])
+        h2 = hash64(halves[:, 1]) | np.uint64(1)
+        i = np.arange(self.n_hashes, dtype=np.uint64)
+        return ((h1[:, None] + i[None, :] * h2[:, None]) % np.uint64(self.n_bits)).astype(np.intp)
+
+    def add_many(self, blob):
+        if not blob:
+            return None
+        positions = self.__positions__(blob).ravel()
+        np.bitwise_or.at(self.bits, positions >> 3, (1 << (positions & 7)).astype(np.uint8))
+
+    def contains_many(self, blob):
+        """
+        :return: the boolean array telling for each key of the blob whether it may have been added
+        """
+        if not blob:
+            return np.zeros(0, dtype=bool)
+        positions = self.__positions__(blob)
+        return np.all((self.bits[positions >> 3] >> (positions & 7)) & 1, axis=1)
+
+
+class SetKeyStore():
+
+    """
+    This class keeps the keys in a plain in-memory set - for an Extractor without a database, where nothing else
+    could answer for the keys. It has the interface of KeyStore
+    """
+
+    def __init__(self):
+        self.keys = set()
+        self.pending = []
+
+    def __len__(self):
+        return len(self.keys)
+
+    def present(self, keys):
+        """
+        :param keys: an iterable of keys, None is ignored
+        :return: the set of the given keys that have been added
+        """
+        stored = self.keys
+        return set(key for key in keys if key in stored)
+
+    def add(self, key):
+        self.keys.add(key)
+        self.pending.append(key)
+
+    def commit(self):
+        self.pending = []
+
+    def rollback(self):
+        self.keys.difference_update(self.pending)
+        self.pending = []
+
+
+class KeyStore():
+
+    """
+    This class tells which keys of a dimension table, e.g. the msids of artists, are stored, in bounded memory
+    however many there are. A key is looked up in four places:
+        1.the keys added in the current (not yet committed) batch
+        2.an in-memory LRU cache of at most cache_size keys
+        3.a Bloom filter of the compact_key of all stored keys - a key it doesn't know is not stored
+        4.the UNIQUE index on the key column of the table, only for the keys the Bloom filter may know
+    The lookups are made once per batch for all of its keys, see present. The Bloom filter is built from the table
+    on first use and rebuilt twice as large when the keys outgrow it, up to max_bloom_bytes.
+    """
+
+    def __init__(self, db_conn, table_name, key_column, cache_size=100000, error_rate=0.01,
+                 max_bloom_bytes=64 * 1024 * 1024):
+        self.conn = db_conn
+        self.table_name = table_name
+        self.key_column = key_column
+        self.cache_size = cache_size
+        self.error_rate = error_rate
+        self.max_bloom_bytes = max_bloom_bytes
+        self.cache = OrderedDict()
+        self.pending = set()
+        # the Bloom filter and the number of keys stored, read from the table on first use
+        self.bloom = None
+        self.count = 0
+
+    def __len__(self):
+        if self.bloom is None:
+            self.__build__()
+        return self.count + len(self.pending)
+
+    def __build__(self, capacity=None, chunk_size=100000):
+        """
+        (re-)builds the Bloom filter from all keys stored in the table
+        :param capacity: the number of keys the filter is sized for - twice the number stored by default
+        :return: None
+        """
+        count = self.conn.execute("SELECT count(*) FROM {}".format(self.table_name)).fetchone()[0]
+        bloom = BloomFilter(capacity or max(2 * count, 1 << 16), self.error_rate, self.max_bloom_bytes)
+        cursor = self.conn.execute("SELECT {0} FROM {1}".format(self.key_column, self.table_name))
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            bloom.add_many(compact_keys([row[0] for row in rows]))
+        self.bloom = bloom
+        self.count = count
+        logging.info("the Bloom filter of the {0} {1} stored takes {2:.1f} MB".format(
+            count, self.key_column, bloom.nbytes / 1e6))
+
+    def __find_stored__(self, keys, chunk_size=500):
+        """
+        looks up keys in the table
+        :param chunk_size: the number of keys per query (sqlite limits the number of parameters)
+        :return: the list of the keys found
+        """
+        found = []
+        for i in range(0, len(keys), chunk_size):
+            chunk = keys[i:i + chunk_size]
+            cmd = "SELECT {0} FROM {1} WHERE {0} IN (".format(self.key_column, self.table_name) + \
+                  ",".join("?" * len(chunk)) + ")"
+            found.extend(row[0] for row in self.conn.execute(cmd, chunk))
+        return found
+
+    def __remember__(self, key):
+        """
+        adds a key to the in-memory cache and evicts the least recently used one if it is full
+        :return: None
+        """
+        self.cache[key] = None
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def present(self, keys):
+        """
+        :param keys: an iterable of keys, None is ignored
+        :return: the set of the given keys that are stored or have been added in the current batch
+        """
+        if self.bloom is None:
+            self.__build__()
+        cache = self.cache
+        pending = self.pending
+        found = set()
+        candidates = []
+        for key in set(keys):
+            if key is None:
+                continue
+            if key in pending:
+                found.add(key)
+            elif key in cache:
+                cache.move_to_end(key)
+                found.add(key)
+            else:
+                candidates.append(key)
+        if candidates:
+            maybe = self.bloom.contains_many(compact_keys(candidates))
+            for key in self.__find_stored__([key for (key, flag) in zip(candidates, maybe) if flag]):
+                self.__remember__(key)
+                found.add(key)
+        return found
+
+    def add(self, key):
+        """
+        notes a key whose row is inserted in the current batch
+        :return: None
+        """
+        self.pending.add(key)
+
+    def commit(self):
+        """
+        to be called once the rows of the added keys have been committed to the table
+        :return: None
+        """
+        if not self.pending:
+            return None
+        self.bloom.add_many(compact_keys(list(self.pending)))
+        for key in self.pending:
+            self.__remember__(key)
+        self.count = self.count + len(self.pending)
+        self.pending = set()
+        if self.count > self.bloom.capacity and self.bloom.nbytes < self.max_bloom_bytes:
+            self.__build__(2 * self.count)
+
+    def rollback(self):
+        """
+        to be called if the rows of the added keys could not be committed - the keys are forgotten
+        :return: None
+        """
+        self.pending = set()
@@ -1,12 +1,35 @@
-from src.crud import CrudTable
+from src.crud import CrudTable, enable_bulk_load
 from src.extract import Extractor
+from src.tail import FileTailer
+from src.dedup import ListenDeduplicator
+from src.backfill import Backfiller
+from src.schema import SchemaManager
+from src.encode import DictionaryEncoder
+from src.keystore import KeyStore
+from src.rollup import RollupMaintainer, SECONDS_PER_DAY
+from src.sketch import SketchMaintainer
+from src.sessions import SessionMaintainer, SESSION_GAP
+from src.report import ReportEngine
+from src.metrics import MetricsRegistry, MetricsServer, MetricsFileWriter, STAGE_HELP
+from src.watch import make_watcher
+from src.pipeline import IngestPipeline
+from src.columnar import ColumnarExport
+from src.cache import IngestWatermark
+from src.partition import PartitionManager, first_day_of
+from src.reject import RejectStore, MALFORMED_JSON
+from src.dedup import fingerprint_listen
+from src.profiling import add_profiling_arguments, profiled
+from src.sources import ShardLoader, ShardProgress, is_sharded, is_compressed, list_shards, watched_directory
 import sqlite3
 from sqlite3 import Error
 from json import JSONDecoder
+import argparse
 import logging
 import os
 import time
 
+REJECTED_HELP = "the number of lines quarantined, by reason"
+
 class DataIngestor():
 
     """
@@ -16,120 +39,563 @@ class DataIngestor():
     2. Start a database instance and opens a connection to it so that it can be populated with the available data
     """
 
-    def __init__(self,path):
+    def __init__(self,path,db_name="spotify",batch_size=10000,bulk_load=True,metrics_port=None,metrics_path=None,
+                 columnar_dir=None,retention_months=None,key_cache_size=100000,session_gap=SESSION_GAP,
+                 hll_error=0.02,topk_error=0.001):
+        # a single file, or a directory or glob pattern of shards - plain or gzip-compressed, see ingest_shards
         self.path=path
+        self.sharded=is_sharded(path)
+        # the tailers of the plain shards by path and the progress of the compressed ones
+        self.shard_tailers={}
+        self.shard_progress=None
+        self.db_name=db_name
+        # a flag to run with the pragmas tuned for sustained inserts, see enable_bulk_load
+        self.bulk_load=bulk_load
+        # the indexes are only created once the initial load has caught up with the file
+        self.indexes_created=False
+        # the maximum number of listens read, extracted and inserted at once - a larger batch gives more throughput,
+        # a smaller one less latency and a lower peak memory
+        self.batch_size=batch_size
+        # the connection, the table objects, the tailer, the deduplicator and the extractor are attached
+        # once the database is opened
+        self.conn=None
+        self.tailer=None
+        self.deduplicator=None
+        self.extractor=None
+        self.encoder=None
+        self.rollups=None
+        self.sketches=None
+        self.sessions=None
+        self.report=None
+        self.watermark=None
+        # the quarantine of the rejected lines, and the offsets of the listens of the batch get_new_data handed out
+        self.rejects=None
+        self.batch_listens=None
+        self.batch_offsets=None
+        # the counters, gauges and stage timings of the loop - served over http on metrics_port and/or written to
+        # the file metrics_path if given
+        self.metrics=MetricsRegistry()
+        self.metrics_port=metrics_port
+        self.metrics_path=metrics_path
+        self.metrics_writer=None
+        # wakes the loop up as soon as the file is written to, see make_watcher
+        self.watcher=None
+        # the directory the listens are exported to as memory-mapped columns after every batch, see ColumnarExport
+        self.columnar_dir=columnar_dir
+        self.columnar=None
+        # the number of months of listens kept, older partitions are dropped - None keeps everything
+        self.retention_months=retention_months
+        # the number of keys per table the extractor and the encoder keep in memory, the others are looked up in the
+        # database - see KeyStore and KeyEncoder
+        self.key_cache_size=key_cache_size
+        # the seconds of inactivity that end a listening session, see SessionMaintainer
+        self.session_gap=session_gap
+        # the error bounds of the sketches - the relative standard error of the distinct users and the largest
+        # overcount of a heavy hitter as a fraction of all listens, see SketchMaintainer
+        self.hll_error=hll_error
+        self.topk_error=topk_error
 
 
-    def get_new_data(self,old_json_list):
+    def get_new_data(self):
         """
-        this function tries to read the raw data from the text file, it is part of the Extraction step
-        :param path: the path to the file
-        :param old_json_list: the list of json/dict already read before
-        :return: the list of json/dict rows newly added to the text file
+        this function lazily reads the lines appended to the text file since the last call, it is part of the
+        Extraction step. Nothing but the current batch is held in memory and the tailer offset always points right
+        after the last line of the batch handed out, so the checkpoint can be saved once the batch is written
+        :return: yields lists of at most batch_size json/dict rows which have not been ingested before - a line that
+        is not valid JSON is quarantined instead
         """
-        # initialize a new empty list
+        # initialize a new empty list, and one of the offsets of its lines
         new_json_list = []
+        offsets = []
         # initialize a decoder
         dec = JSONDecoder()
-        # initializing a set for fast checks if an element already exists or not (list has O(N) time complexity for this)
-        check_set = set()
-        # open the file and iterate through each line while
-        n_lines_old = len(old_json_list)
-        with open(self.path) as file:
-            line_nr = 0
-            for line in file:
-                # increment line number
-                line_nr = line_nr + 1
-                # check if new lines have been added
-                if line_nr>n_lines_old:
-                    # decoding each line to a dictionary
-                    ele = dec.decode(line)
-                    # below are the checks for duplcation
-                    # check if new records are not same as old
-                    if ele not in old_json_list:
-                        # check if new are not same as themselves
-                        if str(ele) not in check_set:
-                            # and appending to the total list
-                            new_json_list.append(ele)
-                            check_set.add(str(ele))
-
-        logging.info("{} new rows have been fetched from disk".format(len(new_json_list)))
-
-
-        return new_json_list
-
+        n_rows = 0
+        # the seconds spent reading and decoding the current batch - not counting the time the caller holds it
+        read_elapsed = 0.0
+        decode_elapsed = 0.0
+        last = time.perf_counter()
+        # only the bytes after the last checkpoint are read
+        for offset, line in self.tailer.read_lines():
+            read_done = time.perf_counter()
+            read_elapsed += read_done - last
+            # skip blank lines
+            if not line.strip():
+                last = read_done
+                continue
+            # decoding each line to a dictionary
+            try:
+                new_json_list.append(dec.decode(line))
+                offsets.append(offset)
+            except ValueError:
+                self.rejects.add(MALFORMED_JSON, line, offset)
+                self.metrics.inc("ingest_lines_read_total", 1, "the number of listens decoded")
+                self.metrics.inc("ingest_rejected_total", 1, REJECTED_HELP, reason=MALFORMED_JSON)
+            last = time.perf_counter()
+            decode_elapsed += last - read_done
+            if len(new_json_list) >= self.batch_size:
+                new_json_list = self.__filter_batch__(new_json_list, offsets, read_elapsed, decode_elapsed)
+                n_rows = n_rows + len(new_json_list)
+                if new_json_list:
+                    yield new_json_list
+                new_json_list = []
+                offsets = []
+                read_elapsed = 0.0
+                decode_elapsed = 0.0
+                last = time.perf_counter()
+        read_elapsed += time.perf_counter() - last
+        new_json_list = self.__filter_batch__(new_json_list, offsets, read_elapsed, decode_elapsed)
+        n_rows = n_rows + len(new_json_list)
+        if new_json_list:
+            yield new_json_list
 
+        logging.info("{} new rows have been fetched from disk".format(n_rows))
 
+    def __filter_batch__(self, new_json_list, offsets, read_elapsed, decode_elapsed):
+        """
+        the checks for duplication - against the earlier batches as well as within this one - and the metrics of
+        reading the batch. The offsets of the listens kept are remembered to quarantine them by, see __extract__
+        :param new_json_list: the list of decoded listens
+        :param offsets: the list of the byte offsets of their lines
+        :param read_elapsed: the seconds spent reading the lines of the batch
+        :param decode_elapsed: the seconds spent decoding them
+        :return: the list of the listens which have not been ingested before
+        """
+        if not new_json_list:
+            return new_json_list
+        metrics = self.metrics
+        metrics.observe("ingest_stage_seconds", read_elapsed, STAGE_HELP, stage="read")
+        metrics.observe("ingest_stage_seconds", decode_elapsed, STAGE_HELP, stage="decode")
+        with metrics.time("ingest_stage_seconds", STAGE_HELP, stage="dedup"):
+            kept = self.deduplicator.filter_keyed([(fingerprint_listen(ele), i) for i, ele in enumerate(new_json_list)])
+            new_listens = [new_json_list[i] for i in kept]
+        self.batch_listens = new_listens
+        self.batch_offsets = [offsets[i] for i in kept]
+        metrics.inc("ingest_lines_read_total", len(new_json_list), "the number of listens decoded")
+        metrics.inc("ingest_duplicates_total", len(new_json_list) - len(new_listens),
+                    "the number of listens skipped as ingested before")
+        return new_listens
 
-    def main(self):
 
+    def __open_database__(self):
+        """
+        opens the connection to the database and creates the tables and the helper objects around it
+        :return: None
+        """
         # making a dummy extractor object for defining schema that is later used for creation of the tables
         extr = Extractor()
-        listener_schema, release_schema, recording_schema, artist_schema = extr.get_schema_for_all_tables()
+        listener_schema, release_schema, recording_schema, artist_schema, user_schema = \
+            extr.get_schema_for_all_tables()
 
-        # define database names and table names here
-        db_name = "spotify"
-        table_name1 = "listeners"
+        # define table names here - the listeners are stored in one partition per month, see PartitionManager
         table_name2 = "recordings"
         table_name3 = "artists"
         table_name4 = "releases"
+        table_name5 = "users"
 
-        # create a database and open a connection to it
+        # Connects to an in-file database in the current working directory, or creates one, if it doesn't exist:
+        self.conn = sqlite3.connect('{}.db'.format(self.db_name))
+        if self.bulk_load:
+            enable_bulk_load(self.conn)
+        else:
+            # readers (see ReadPool) must not block the writer
+            self.conn.execute("PRAGMA journal_mode=WAL")
+        # an existing database with the current schema is resumed from, an outdated one is wiped first
+        schema_manager = SchemaManager(self.conn)
+        schema_manager.prepare()
+
+        # create table objects
+        self.partitions = PartitionManager(self.conn,listener_schema)
+        self.recording_table_object = CrudTable(table_name2,self.conn,recording_schema)
+        self.artist_table_object = CrudTable(table_name3,self.conn,artist_schema)
+        self.release_table_object = CrudTable(table_name4,self.conn,release_schema)
+        self.user_table_object = CrudTable(table_name5,self.conn,user_schema)
+
+        # the lines that could not be ingested are kept with the reason
+        self.rejects = RejectStore(self.conn,source=os.path.abspath(self.path))
+        # the tailer remembers how far the file has been read
+        if self.sharded:
+            self.shard_progress = ShardProgress(self.conn)
+        else:
+            self.tailer = FileTailer(self.path,self.conn)
+        # the deduplicator remembers the fingerprints of all listens ingested so far
+        self.deduplicator = ListenDeduplicator(self.conn)
+        # the summary tables the BI queries read from
+        self.rollups = RollupMaintainer(self.conn)
+        # the approximate distinct users and heavy hitters, see SketchMaintainer
+        self.sketches = SketchMaintainer(self.conn,self.hll_error,self.topk_error)
+        # the listening sessions of every user, see SessionMaintainer
+        self.sessions = SessionMaintainer(self.conn,gap=self.session_gap)
+        # the materialized management report, refreshed whenever the file has been caught up with
+        self.report = ReportEngine(self.conn)
+        # tells the readers whether anything has changed, see QueryCache
+        self.watermark = IngestWatermark(self.conn)
+        schema_manager.commit_version()
+
+        # instantiate the object only once - so that upon updation of new data the set of msids are not deleted
+        # and the new rows can be checked for duplication especially for the dimension tables e.g. artist & release
+        # the msids ingested by earlier runs are looked up in the database, see KeyStore
+        key_cache_size = self.key_cache_size
+        self.extractor = Extractor(db_conn=self.conn,key_store=lambda table_name, key_column: KeyStore(
+            self.conn,table_name,key_column,cache_size=key_cache_size))
+        # the listens of the months the retention has dropped are not stored again
+        self.__expire_before_retention__()
+        # the encoder maps the msids and user names to the INTEGER ids the tables are keyed by
+        self.encoder = DictionaryEncoder(self.conn,cache_size=key_cache_size)
+        if self.columnar_dir:
+            self.columnar = ColumnarExport(self.columnar_dir)
+            self.columnar.sync(self.conn)
+
+
+    def __write__(self,new_data,checkpoint=None):
+        """
+        encodes the extracted rows and inserts them into all tables, the summaries, the fingerprints and the
+        checkpoint in a single transaction
+        :param new_data: dictionary of list of tuples per table as returned by the Extractor
+        :param checkpoint: a callable saving how far the input has been read without committing - defaults to the
+        checkpoint of the tailer
+        :return: None
+        """
+        metrics = self.metrics
         try:
-            # Connects to an in-file database in the current working directory, or creates one, if it doesn't exist:
-            conn = sqlite3.connect('{}.db'.format(db_name))
+            with metrics.time("ingest_stage_seconds", STAGE_HELP, stage="encode"):
+                new_data = self.encoder.encode_rows(new_data)
+            with metrics.time("ingest_stage_seconds", STAGE_HELP, stage="insert"):
+                # the below sequence is important to ensure foreign-key constraints
+                # rows that are already stored (e.g. after a crash right before the checkpoint was saved) are skipped
+                self.artist_table_object.insert(new_data["artist_data"],commit=False,or_ignore=True)
+                self.release_table_object.insert(new_data["release_data"],commit=False,or_ignore=True)
+                self.recording_table_object.insert(new_data["recording_data"],commit=False,or_ignore=True)
+                self.user_table_object.insert(new_data["user_data"],commit=False,or_ignore=True)
+                self.partitions.insert(new_data["listener_data"])
+                self.rollups.apply(new_data["listener_data"])
+                self.sketches.apply(new_data["listener_data"])
+                # a session extended by the batch may have started before its listens
+                first_day = self.sessions.apply(new_data["listener_data"])
+                self.report.mark_dirty(new_data["listener_data"],first_day)
+                self.watermark.bump()
+
+                # remember which listens have been ingested and how far the file has been read in the same commit
+                self.deduplicator.flush(commit=False)
+                self.rejects.flush(commit=False)
+                if checkpoint is None:
+                    self.tailer.save_checkpoint(commit=False)
+                else:
+                    checkpoint()
+                self.conn.commit()
+            self.encoder.commit()
+            self.extractor.commit()
+            self.deduplicator.commit()
+            if self.columnar is not None:
+                # only committed listens are exported, the export is rebuilt on startup if a crash interrupted this
+                with metrics.time("ingest_stage_seconds", STAGE_HELP, stage="export"):
+                    self.columnar.append(new_data["listener_data"],new_data["recording_data"])
+            metrics.inc("ingest_listens_total", len(new_data["listener_data"]), "the number of listens stored")
+            metrics.inc("ingest_batches_total", 1, "the number of batches committed")
+            # the writer is rate-limited, a long catch-up must not leave the file stale until it ends
+            if self.metrics_writer is not None:
+                self.metrics_writer.maybe_write()
+            logging.info("all rows have been inserted into {}".format(self.db_name))
+        except Exception:
+            # any exception, not only those of sqlite, must not leave the transaction of the batch open
+            self.conn.rollback()
+            self.encoder.rollback()
+            self.extractor.rollback()
+            self.deduplicator.rollback()
+            self.partitions.rollback()
+            metrics.inc("ingest_failed_batches_total", 1, "the number of batches rolled back")
+            raise
+
+
+    def __create_indexes__(self):
+        """
+        adds the indices to the tables for faster quering - this is deferred until the initial load is done because
+        maintaining them row by row during the load is slower than building them once.
+        The msid and user name columns are UNIQUE and therefore indexed by sqlite already. The indexes on listeners
+        cover the access patterns of bi_queries, each query is answered from an index without touching the table:
+            by user and time - the listens per user and the first listen per user
+            by day - the distinct users of a day
+            by recording - the listens per track and per artist
+        :return: None
+        """
+        if not self.indexes_created:
+            # every partition gets the same indexes, see PARTITION_INDEXES
+            self.partitions.create_indexes()
+            self.indexes_created = True
+
+
+    def backfill(self,workers=None):
+        """
+        loads everything the file holds right now with a pool of worker processes, see Backfiller. It starts at
+        the checkpoint, so the part of the file ingested by an earlier run is neither parsed nor quarantined again
+        :param workers: the number of worker processes - defaults to the number of cores
+        :return: None
+        """
+        def write(new_data,offset):
+            self.tailer.advance_to(offset)
+            self.__quarantine__(self.extractor.rejected,offset=offset)
+            self.__write__(new_data)
+
+        start = self.tailer.resume_offset()
+        if start is None:
+            logging.info("{} has nothing to backfill".format(self.path))
+            return None
+        Backfiller(self.path,workers).run(self.deduplicator,self.extractor,write,start)
+        self.__refresh_report__()
+
+
+    def __shard_tailer__(self,path):
+        """
+        :return: the tailer of a plain shard, created on its first use
+        """
+        if path not in self.shard_tailers:
+            self.shard_tailers[path] = FileTailer(path,self.conn)
+        return self.shard_tailers[path]
+
+
+    def ingest_shards(self,workers=None):
+        """
+        ingests everything added to the shards since the last call - new shards, the lines appended to the plain
+        ones and the rest of the compressed ones a previous run stopped in. The shards are independent, so they are
+        decoded by a pool of worker processes at once while this process writes the batches, see ShardLoader. Every
+        batch is committed together with the progress of its shard
+        :param workers: the number of worker processes - defaults to the number of cores
+        :return: the number of listens stored
+        """
+        tasks = []
+        for path in list_shards(self.path):
+            if is_compressed(path):
+                offset = self.shard_progress.get(path)
+            else:
+                offset = self.__shard_tailer__(path).resume_offset()
+            if offset is not None:
+                tasks.append((path,offset))
+        n_listens = 0
 
-            # create table objects
-            listeners_table_object = CrudTable(table_name1,conn,listener_schema)
-            recording_table_object = CrudTable(table_name2,conn,recording_schema)
-            artist_table_object = CrudTable(table_name3,conn,artist_schema)
-            release_table_object = CrudTable(table_name4,conn,release_schema)
+        def consume(path,inode,keyed,offset,done):
+            nonlocal n_listens
+            if is_compressed(path):
+                checkpoint = lambda: self.shard_progress.save(path,inode,offset,done,commit=False)
+            else:
+                tailer = self.shard_tailers[path]
+                tailer.advance_to(offset,inode)
+                checkpoint = lambda: tailer.save_checkpoint(commit=False)
+            with self.metrics.time("ingest_stage_seconds",STAGE_HELP,stage="dedup"):
+                records = self.deduplicator.filter_keyed(keyed)
+            self.metrics.inc("ingest_lines_read_total",len(keyed),"the number of listens decoded")
+            self.metrics.inc("ingest_duplicates_total",len(keyed)-len(records),
+                             "the number of listens skipped as ingested before")
+            if not records:
+                # nothing new, only the progress moves on
+                self.rejects.flush(commit=False)
+                checkpoint()
+                self.conn.commit()
+                return None
+            with self.metrics.time("ingest_stage_seconds",STAGE_HELP,stage="extract"):
+                new_data = self.extractor.get_rows_for_normalized(records)
+            self.__quarantine__(self.extractor.rejected,offset=offset,source=path)
+            self.__write__(new_data,checkpoint)
+            n_listens = n_listens + len(new_data["listener_data"])
 
+        if tasks:
+            ShardLoader(workers,self.batch_size).run(tasks,consume)
+            logging.info("{0} shards have been read, {1} new listens stored".format(len(tasks),n_listens))
+        return n_listens
 
-            # initially it is assumed that data is not updated
-            old_json_list = []
 
-            # a flg is used to instantiate the Extractor object only once required to load the values
-            flg = True
+    def __pending_bytes__(self):
+        """
+        :return: the number of bytes of the input not ingested yet - compressed shards are not counted
+        """
+        if self.sharded:
+            return sum(self.__shard_tailer__(path).pending_bytes() for path in list_shards(self.path)
+                       if not is_compressed(path))
+        return self.tailer.pending_bytes()
+
+
+    def __refresh_report__(self):
+        """
+        recomputes the periods of the report the new listens fall in and moves the watermark past them
+        :return: None
+        """
+        if self.report.refresh() is not None:
+            self.watermark.bump()
+            self.conn.commit()
+
+
+    def __apply_retention__(self):
+        """
+        drops the partitions of the listens older than retention_months and moves the watermark past them. The
+        first day kept becomes the floor of the report, which keeps the periods before it as they were materialized,
+        and of the ingestion - a listen arriving later for a dropped month is quarantined instead of creating its
+        partition again
+        :return: None
+        """
+        if self.retention_months and self.partitions.retain(self.retention_months):
+            self.report.retain(first_day_of(self.partitions.months[0]))
+            self.watermark.bump()
+            self.conn.commit()
+            self.__expire_before_retention__()
+            if self.columnar is not None:
+                # the export keeps matching the database, so it isn't rebuilt on the next start
+                self.columnar.expire(self.extractor.expired_before)
+
+
+    def __expire_before_retention__(self):
+        """
+        makes the extractor reject the listens older than the first day kept by the retention
+        :return: None
+        """
+        retained_from = self.report.retained_from()
+        if retained_from is not None:
+            self.extractor.expired_before = retained_from * SECONDS_PER_DAY
+
+
+    def __extract__(self,new_json_list):
+        """
+        extracts the rows for all tables from a batch of listens and quarantines the listens rejected by the checks
+        :param new_json_list: the list of listens
+        :return: dictionary of list of tuples per table as returned by the Extractor
+        """
+        with self.metrics.time("ingest_stage_seconds",STAGE_HELP,stage="extract"):
+            new_data = self.extractor.get_rows_for_all_tables(new_json_list)
+        # the offsets are known for the batch get_new_data handed out last
+        offsets = self.batch_offsets if new_json_list is self.batch_listens else None
+        self.__quarantine__(self.extractor.rejected,new_json_list,offsets)
+        return new_data
+
+
+    def __quarantine__(self,rejected,listens=None,offsets=None,offset=None,source=None):
+        """
+        buffers the listens rejected by the Extractor for the quarantine, which is written with the next batch,
+        counts them per reason and makes the deduplicator forget them - only the stored listens are duplicates. The
+        copies of a listen the Extractor skipped within the batch are counted as duplicates here as well
+        :param rejected: the list of tuples (position in the batch, reason, payload) as noted by the Extractor
+        :param listens: the batch as given to the Extractor - the listens are stored rather than the payloads
+        :param offsets: the list of the byte offsets of the listens of the batch
+        :param offset: the offset of the batch otherwise, how far the source had been read with it
+        :param source: the source of the batch if it isn't the input of the ingestor, e.g. a shard
+        :return: None
+        """
+        reasons = {}
+        for (index, reason, payload) in rejected:
+            self.rejects.add(reason,listens[index] if listens is not None else payload,
+                             offsets[index] if offsets is not None else offset,source)
+            reasons[reason] = reasons.get(reason,0) + 1
+        for reason, n in reasons.items():
+            self.metrics.inc("ingest_rejected_total",n,REJECTED_HELP,reason=reason)
+        if self.extractor.duplicates:
+            self.metrics.inc("ingest_duplicates_total",self.extractor.duplicates,
+                             "the number of listens skipped as ingested before")
+        self.deduplicator.discard([index for (index, reason, payload) in rejected])
+
+
+    def __update_progress__(self,n_listens,elapsed):
+        """
+        sets the gauges of the ingestion progress and writes the metrics file if it is due
+        :param n_listens: the number of listens stored in the last cycle of the loop
+        :param elapsed: the seconds the cycle took
+        :return: None
+        """
+        self.metrics.set("ingest_lag_bytes",self.__pending_bytes__(),
+                         "the number of bytes of the file not ingested yet")
+        self.metrics.set("ingest_rows_per_second",n_listens/elapsed if elapsed > 0 else 0.0,
+                         "the number of listens stored per second during the last cycle of the loop")
+        self.metrics.set("ingest_last_cycle_timestamp_seconds",time.time(),
+                         "the unix time the last cycle of the loop ended")
+        if self.metrics_writer is not None:
+            self.metrics_writer.maybe_write()
+
+
+    def main(self,backfill=False,workers=None,idle_timeout=10.0,pipeline=False):
+        """
+        runs the ingestion continuously
+        :param backfill: a flag to load the data already in the file with a pool of worker processes first - shards
+        are always loaded in parallel
+        :param workers: the number of worker processes used by the backfill and for the shards
+        :param idle_timeout: the maximum number of seconds to wait for the file to change - the progress gauges are
+        updated at least this often
+        :param pipeline: a flag to run the reading, parsing and writing concurrently, see IngestPipeline
+        :return: None
+        """
+        metrics = self.metrics
+        if self.metrics_port is not None:
+            MetricsServer(metrics,self.metrics_port).start()
+        self.metrics_writer = MetricsFileWriter(metrics,self.metrics_path) if self.metrics_path else None
+        if pipeline and self.sharded:
+            logging.warning("the pipeline reads a single file, the shards are ingested by worker processes instead")
+        elif pipeline:
+            try:
+                IngestPipeline(self,idle_timeout=idle_timeout).run(follow=True,backfill=backfill,workers=workers)
+            except Error as e:
+                logging.error(e)
+            return None
+        # create a database and open a connection to it
+        try:
+            self.__open_database__()
+
+            if backfill and not self.sharded:
+                self.backfill(workers)
+
+            # the watcher is set up before the first read, so no append after it can go unnoticed
+            self.watcher = make_watcher(watched_directory(self.path) if self.sharded else self.path)
             while True:
-                # setting a refresh rate of 1s
-                time.sleep(1)
-                # check for new data
-                new_json_list = self.get_new_data(old_json_list)
-                # instantiate the object only once - so that upon updation of new data the set of msids are not deleted
-                # and the new rows can be checked for duplication especially for the dimension tables e.g. artist & release
-                if flg:
-                    extractor_object = Extractor()
-                    flg = False
-
-                # if new rows have been added then
-                if len(new_json_list):
-
-                    #iterate over each element in the new list and extract the necessary values for each table
-                    new_data = extractor_object.get_rows_for_all_tables(new_json_list)
-
-                    # the below sequence is important to ensure foreign-key constraints
-                    artist_table_object.insert(new_data["artist_data"])
-                    release_table_object.insert(new_data["release_data"])
-                    recording_table_object.insert(new_data["recording_data"])
-                    listeners_table_object.insert(new_data["listener_data"])
-                    logging.info("all rows have been inserted into {}".format(db_name))
-
-                    # add indices to the tables for faster quering
-                    artist_table_object.add_index("artist_msid")
-                    release_table_object.add_index("release_msid")
-                    recording_table_object.add_index("recording_msid")
-
-                    # update the old data
-                    old_json_list.extend(new_json_list)
+                start = time.perf_counter()
+                n_listens = 0
+                if self.sharded:
+                    # the progress of every shard is committed with its batches
+                    n_listens = self.ingest_shards(workers)
                 else:
-                    pass
+                    # check for new data, one bounded batch at a time
+                    for new_json_list in self.get_new_data():
+                        #iterate over each element in the batch and extract the necessary values for each table
+                        new_data = self.__extract__(new_json_list)
+                        self.__write__(new_data)
+                        n_listens = n_listens + len(new_data["listener_data"])
+                        metrics.set("ingest_lag_bytes",self.tailer.pending_bytes(),
+                                    "the number of bytes of the file not ingested yet")
+
+                    # remember how far the file has been read, also past lines that were blank, duplicates or
+                    # quarantined
+                    self.rejects.flush(commit=False)
+                    self.tailer.save_checkpoint()
+                # the file has been caught up with
+                if not self.indexes_created:
+                    with metrics.time("ingest_stage_seconds",STAGE_HELP,stage="index"):
+                        self.__create_indexes__()
+                # only the periods the new listens fall in are recomputed
+                with metrics.time("ingest_stage_seconds",STAGE_HELP,stage="report"):
+                    self.__refresh_report__()
+                self.__apply_retention__()
+                self.__update_progress__(n_listens,time.perf_counter()-start)
+                # sleep until the file is written to
+                self.watcher.wait(idle_timeout)
 
         except Error as e:
             logging.error(e)
+        finally:
+            if self.watcher is not None:
+                self.watcher.close()
 
 
 if __name__=="__main__":
-    path = os.getcwd()+"\\..\\data\\dataset.txt"
-    DataIngestor(path).main()
-
+    parser = argparse.ArgumentParser(description="ingests the listens file continuously")
+    parser.add_argument("--input",default=os.path.join(os.getcwd(),"..","data","dataset.txt"),
+                        help="the listens file, or a directory or glob pattern of shards (.gz shards are decompressed)")
+    parser.add_argument("--workers",type=int,default=None,help="the number of worker processes")
+    parser.add_argument("--backfill",action="store_true",help="load the data already in the file in parallel first")
+    parser.add_argument("--pipeline",action="store_true",help="read, parse and write concurrently")
+    parser.add_argument("--columnar-dir",default=None,help="export the listens as memory-mapped columns here")
+    parser.add_argument("--metrics-port",type=int,default=None,help="serve the metrics on this port")
+    parser.add_argument("--metrics-file",default=None,help="write the metrics to this file periodically")
+    parser.add_argument("--retention-months",type=int,default=None,help="drop the listens older than this")
+    parser.add_argument("--key-cache-size",type=int,default=100000,help="the number of keys per table kept in memory")
+    parser.add_argument("--session-gap",type=int,default=SESSION_GAP,
+                        help="the seconds of inactivity that end a listening session")
+    # the hot paths can be profiled in production, the reports are made when the ingestor is stopped
+    add_profiling_arguments(parser)
+    args = parser.parse_args()
+    with profiled(args.profile,args.trace_memory):
+        DataIngestor(args.input,metrics_port=args.metrics_port,metrics_path=args.metrics_file,
+                     columnar_dir=args.columnar_dir,retention_months=args.retention_months,
+                     key_cache_size=args.key_cache_size,session_gap=args.session_gap).main(
+            backfill=args.backfill,workers=args.workers,pipeline=args.pipeline)
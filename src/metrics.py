@@ -0,0 +1,205 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# the upper bounds in seconds of the buckets of the stage timings, from a small batch to a full index build
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)
+STAGE_HELP = "the seconds each stage of the ingestion loop takes per batch"
+
+def format_labels(labels):
+    """
+    :param labels: the tuple of tuples (name, value)
+    :return: the labels in the prometheus notation, e.g. {stage="read"} - or an empty string
+    """
+    if not labels:
+        return ""
+    return "{" + ",".join('{0}="{1}"'.format(name, value) for (name, value) in labels) + "}"
+
+
+class Histogram():
+
+    """
+    the cumulative counts of observations per bucket, their number and their sum - like a prometheus histogram
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] = self.counts[i] + 1
+        self.count = self.count + 1
+        self.sum = self.sum + value
+
+
+class MetricsRegistry():
+
+    """
+    This class collects the metrics of the ingestion: counters that only go up, gauges that are set and histograms
+    of durations. Each metric is identified by its name and optionally by labels, e.g. the stage of the loop.
+    The ingestion updates the metrics from its thread while the exporters (MetricsServer, MetricsFileWriter)
+    render them from theirs, so every access holds a lock. Rendering produces the prometheus text format.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # name -> (type, help)
+        self.descriptions = {}
+        # (name, labels) -> value, or Histogram
+        self.values = {}
+
+    def __describe__(self, name, kind, help):
+        if name not in self.descriptions:
+            self.descriptions[name] = (kind, help)
+
+    def inc(self, name, value=1, help="", **labels):
+        """
+        increments a counter
+        :param name: the name of the counter, by convention ending in _total
+        :param value: the amount to add
+        :param help: the description shown by the exporters
+        :param labels: the labels of the counter
+        :return: None
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.__describe__(name, "counter", help)
+            self.values[key] = self.values.get(key, 0) + value
+
+    def set(self, name, value, help="", **labels):
+        """
+        sets a gauge
+        :return: None
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.__describe__(name, "gauge", help)
+            self.values[key] = value
+
+    def observe(self, name, value, help="", **labels):
+        """
+        adds an observation to a histogram
+        :return: None
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.__describe__(name, "histogram", help)
+            histogram = self.values.get(key)
+            if histogram is None:
+                histogram = self.values[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def time(self, name, help="", **labels):
+        """
+        observes the seconds the enclosed block takes
+        :return: None
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, help, **labels)
+
+    def get(self, name, **labels):
+        """
+        :return: the value of a counter or a gauge, the Histogram of a histogram, or None if nothing was recorded
+        """
+        with self.lock:
+            return self.values.get((name, tuple(sorted(labels.items()))))
+
+    def render(self):
+        """
+        :return: all metrics in the prometheus text exposition format
+        """
+        lines = []
+        with self.lock:
+            for name in sorted(self.descriptions):
+                kind, help = self.descriptions[name]
+                lines.append("# HELP {0} {1}".format(name, help))
+                lines.append("# TYPE {0} {1}".format(name, kind))
+                for (key_name, labels), value in sorted(self.values.items(), key=lambda item: item[0]):
+                    if key_name != name:
+                        continue
+                    if kind != "histogram":
+                        lines.append("{0}{1} {2}".format(name, format_labels(labels), value))
+                        continue
+                    for bound, count in zip(value.buckets, value.counts):
+                        lines.append("{0}_bucket{1} {2}".format(name, format_labels(labels + (("le", bound),)), count))
+                    lines.append("{0}_bucket{1} {2}".format(name, format_labels(labels + (("le", "+Inf"),)),
+                                                            value.count))
+                    lines.append("{0}_sum{1} {2}".format(name, format_labels(labels), value.sum))
+                    lines.append("{0}_count{1} {2}".format(name, format_labels(labels), value.count))
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer():
+
+    """
+    serves the metrics of a registry on http://host:port/metrics from a daemon thread
+    """
+
+    def __init__(self, registry, port=9108, host="127.0.0.1"):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # the scrapes are not worth a log line each
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        logging.info("serving the metrics on http://{0}:{1}/metrics".format(*self.server.server_address[:2]))
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class MetricsFileWriter():
+
+    """
+    writes the metrics of a registry to a file at most every `interval` seconds, e.g. for the textfile collector
+    of the node exporter. The file is replaced atomically so a reader never sees half of it
+    """
+
+    def __init__(self, registry, path, interval=10.0):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self.last_written = None
+
+    def maybe_write(self):
+        """
+        writes the file if the interval has passed since the last time
+        :return: True if the file has been written
+        """
+        now = time.monotonic()
+        if self.last_written is not None and now - self.last_written < self.interval:
+            return False
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as file:
+            file.write(self.registry.render())
+        os.replace(tmp_path, self.path)
+        self.last_written = now
+        return True
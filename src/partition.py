@@ -0,0 +1,208 @@
+import logging
+import re
+from datetime import date, timedelta
+from src.crud import CrudTable
+
+# the view over all partitions, the rest of the code reads the listens from it like from a table
+VIEW_NAME = "listeners"
+LISTENER_COLUMNS = "user_id, recording_id, listened_at, day"
+PARTITION_PATTERN = re.compile(r"^listeners_(\d{6})$")
+# (name, columns) of the indexes of every partition, the name is completed by the month e.g.
+# index_listeners_user_time_201904 - see DataIngestor.__create_indexes__ for what they serve
+PARTITION_INDEXES = (("index_listeners_user_time", ("user_id", "listened_at", "recording_id")),
+                     ("index_listeners_day_user", ("day", "user_id")),
+                     ("index_listeners_recording", ("recording_id",)))
+
+
+def month_of(day):
+    """
+    :param day: the number of a day bucket
+    :return: the month the day falls in as the integer YYYYMM
+    """
+    d = date(1970, 1, 1) + timedelta(days=day)
+    return d.year * 100 + d.month
+
+def first_day_of(month):
+    """
+    :param month: a month as the integer YYYYMM
+    :return: the number of the day bucket of its first day
+    """
+    return (date(month // 100, month % 100, 1) - date(1970, 1, 1)).days
+
+def partition_name(month):
+    return "listeners_{}".format(month)
+
+def list_partitions(conn):
+    """
+    :return: the sorted list of the months that have a partition
+    """
+    rows = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name LIKE 'listeners%'")
+    return sorted(int(match.group(1)) for match in (PARTITION_PATTERN.match(row[0]) for row in rows) if match)
+
+def listeners_source(conn, first_day=None, last_day=None):
+    """
+    prunes the partitions for a query over a range of days - only the partitions of the months the range touches
+    are read, the filter on the day still has to be applied by the query
+    :param first_day: the first day bucket of the range, None for no lower bound
+    :param last_day: the last day bucket of the range, None for no upper bound
+    :return: the table, or the sub-query over the tables, to select the listens of the range from - listeners
+    itself for a database without partitions
+    """
+    partitions = list_partitions(conn)
+    if not partitions:
+        return VIEW_NAME
+    low = None if first_day is None else month_of(first_day)
+    high = None if last_day is None else month_of(last_day)
+    months = [month for month in partitions if (low is None or month >= low) and (high is None or month <= high)]
+    if not months:
+        return "(SELECT {0} FROM {1} WHERE 0)".format(LISTENER_COLUMNS, VIEW_NAME)
+    if len(months) == 1:
+        return partition_name(months[0])
+    return "(" + " UNION ALL ".join("SELECT {0} FROM {1}".format(LISTENER_COLUMNS, partition_name(month))
+                                    for month in months) + ")"
+
+def per_partition(conn, select):
+    """
+    spreads an aggregate over the partitions - the select runs on every partition on its own, where it walks the
+    index of the partition, instead of on the view over all of them, which sqlite can only aggregate in a temporary
+    b-tree of all listens. The partial results are merged by the query around it, e.g. by summing the counts
+    :param select: the select over one table, with {listeners} in place of its name
+    :return: the sub-query - the UNION ALL of the select over every partition, over listeners itself for a
+    database without partitions
+    """
+    tables = [partition_name(month) for month in list_partitions(conn)] or [VIEW_NAME]
+    return "(" + " union all ".join(select.format(listeners=table) for table in tables) + ")"
+
+
+class PartitionManager():
+
+    """
+    This class stores the listens in one table per month, listeners_YYYYMM, instead of a single ever growing table:
+        1.a partition is created, with its indexes once the initial load is done, by the first listen of its month
+        2.the view listeners is the UNION ALL of all partitions, re-created whenever one is added or dropped, so
+        whatever reads the whole history keeps reading from listeners
+        3.a query over a range of days reads only the partitions the range touches, see listeners_source
+        4.old listens are removed by dropping whole partitions, see retain - no DELETE of single rows and no VACUUM.
+        The summaries, the report, the sketches and the fingerprints are not touched by that, they keep covering
+        the whole history. The ingestion rejects the listens arriving later for a dropped month, see
+        DataIngestor.__apply_retention__
+    All changes are made without committing, the caller commits together with the listens.
+    """
+
+    def __init__(self, db_conn, schema):
+        """
+        :param schema: the schema of the listeners as given by the Extractor
+        """
+        self.conn = db_conn
+        self.schema = schema
+        # the indexes are only created once the initial load is done, see create_indexes
+        self.indexed = False
+        self.months = list_partitions(db_conn)
+        self.tables = dict((month, CrudTable(partition_name(month), db_conn, schema)) for month in self.months)
+        self.__create_view__()
+        self.conn.commit()
+
+    def __create_view__(self):
+        """
+        (re-)creates the view over all partitions
+        :return: None
+        """
+        self.conn.execute("DROP VIEW IF EXISTS " + VIEW_NAME)
+        if self.months:
+            select = " UNION ALL ".join("SELECT {0} FROM {1}".format(LISTENER_COLUMNS, partition_name(month))
+                                        for month in self.months)
+        else:
+            # the columns of an empty view
+            select = "SELECT NULL AS user_id, NULL AS recording_id, NULL AS listened_at, NULL AS day WHERE 0"
+        self.conn.execute("CREATE VIEW {0} AS {1}".format(VIEW_NAME, select))
+
+    def __begin__(self):
+        """
+        opens a transaction if none is open - sqlite3 only opens one by itself before DML, the partitions have to be
+        created and dropped in the same transaction as the listens
+        :return: None
+        """
+        if not self.conn.in_transaction:
+            self.conn.execute("BEGIN")
+
+    def __index__(self, month):
+        for (name, columns) in PARTITION_INDEXES:
+            self.tables[month].add_index(columns, "{0}_{1}".format(name, month))
+
+    def __partition__(self, month):
+        """
+        :return: the table object of the partition of a month, created if it doesn't exist yet
+        """
+        table = self.tables.get(month)
+        if table is None:
+            self.__begin__()
+            table = self.tables[month] = CrudTable(partition_name(month), self.conn, self.schema)
+            if self.indexed:
+                self.__index__(month)
+            self.months = sorted(self.tables)
+            self.__create_view__()
+            logging.info("the partition {} has been created".format(partition_name(month)))
+        return table
+
+    def insert(self, listener_rows):
+        """
+        inserts a batch of listens into the partitions of their months, without committing
+        :param listener_rows: the list of tuples (user_id, recording_id, listened_at, day)
+        :return: None
+        """
+        rows_per_month = {}
+        months_of_days = {}
+        for row in listener_rows:
+            month = months_of_days.get(row[3])
+            if month is None:
+                month = months_of_days[row[3]] = month_of(row[3])
+            rows = rows_per_month.get(month)
+            if rows is None:
+                rows = rows_per_month[month] = []
+            rows.append(row)
+        for month, rows in rows_per_month.items():
+            self.__partition__(month).insert(rows, commit=False)
+
+    def rollback(self):
+        """
+        forgets the partitions created by a transaction that has been rolled back
+        :return: None
+        """
+        self.months = list_partitions(self.conn)
+        self.tables = dict((month, self.tables[month]) for month in self.months if month in self.tables)
+
+    def create_indexes(self):
+        """
+        indexes all partitions, and every partition created from now on right away
+        :return: None
+        """
+        for month in self.months:
+            self.__index__(month)
+        self.indexed = True
+        self.conn.commit()
+
+    def retain(self, n_months):
+        """
+        drops the partitions older than the newest n_months months, without committing. A listen inserted later for
+        a dropped month would create its partition again
+        :param n_months: the number of months to keep, counted back from the month of the newest listens
+        :return: the list of the months dropped
+        """
+        if not self.months:
+            return []
+        newest = self.months[-1]
+        year, number = divmod(newest, 100)
+        # the first month kept
+        index = year * 12 + number - 1 - (n_months - 1)
+        oldest = (index // 12) * 100 + index % 12 + 1
+        dropped = [month for month in self.months if month < oldest]
+        if dropped:
+            self.__begin__()
+        for month in dropped:
+            self.conn.execute("DROP TABLE " + partition_name(month))
+            del self.tables[month]
+        if dropped:
+            self.months = sorted(self.tables)
+            self.__create_view__()
+            logging.info("the partitions of {} have been dropped".format(dropped))
+        return dropped
@@ -0,0 +1,202 @@
+import asyncio
+import itertools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from json import JSONDecoder
+from src.backfill import parse_lines
+from src.metrics import STAGE_HELP
+from src.tail import FileTailer
+from src.watch import make_watcher
+
+QUEUE_HELP = "the number of batches waiting in front of a stage of the pipeline"
+
+
+class IngestPipeline():
+
+    """
+    This class runs the ingestion of a DataIngestor as three concurrent stages joined by bounded queues:
+        1.read - reads batches of complete lines from the file (in a worker thread, with its own FileTailer)
+        2.parse - decodes and validates the lines (see parse_lines)
+        3.write - rejects duplicates, extracts the rows and writes them in one transaction per batch
+    Every call into SQLite happens on one dedicated writer thread, which also opens the database, so the
+    connection never changes threads. SQLite releases the GIL while it works, so the next batches are read and
+    parsed while a batch is committed. When a queue is full the stage in front of it waits, so at most queue_size
+    batches are held per queue no matter how far the writer falls behind. The depths of the queues are exposed as
+    the gauge ingest_queue_depth and by queue_depths.
+    The checkpoint still only moves with the commit of the batch it belongs to: each batch carries the offset and
+    inode its last line ended at, and the offsets of its lines the listens rejected are quarantined with.
+    """
+
+    def __init__(self, ingestor, queue_size=4, idle_timeout=10.0):
+        self.ingestor = ingestor
+        self.metrics = ingestor.metrics
+        self.queue_size = queue_size
+        self.idle_timeout = idle_timeout
+        self.parse_queue = None
+        self.write_queue = None
+        # the tailer of the read stage, independent of the one the writer checkpoints with
+        self.reader = None
+        self.lines = None
+        self.watcher = None
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-writer")
+        # the listens stored since the file was last caught up with and when that was
+        self.cycle_listens = 0
+        self.cycle_start = time.perf_counter()
+
+    def queue_depths(self):
+        """
+        :return: a dictionary of the number of batches waiting per queue
+        """
+        return {"parse": self.parse_queue.qsize() if self.parse_queue else 0,
+                "write": self.write_queue.qsize() if self.write_queue else 0}
+
+    def __update_depths__(self):
+        for queue, depth in self.queue_depths().items():
+            self.metrics.set("ingest_queue_depth", depth, QUEUE_HELP, queue=queue)
+
+    def __open__(self, backfill, workers):
+        """
+        opens the database - on the writer thread
+        :return: None
+        """
+        self.ingestor.__open_database__()
+        if backfill:
+            self.ingestor.backfill(workers)
+        self.reader = FileTailer(self.ingestor.path, self.ingestor.conn)
+        self.reader.advance_to(self.ingestor.tailer.offset, self.ingestor.tailer.inode)
+
+    def __next_batch__(self):
+        """
+        reads the next batch of lines - in a worker thread
+        :return: a tuple (the list of lines, the list of their offsets, the offset after the last one, the inode of
+        the file) - blank lines are left out, the lists are None once the file has been caught up with
+        """
+        with self.metrics.time("ingest_stage_seconds", STAGE_HELP, stage="read"):
+            if self.lines is None:
+                self.lines = self.reader.read_lines()
+            batch = list(itertools.islice(self.lines, self.ingestor.batch_size))
+            if not batch:
+                self.lines = None
+                return None, None, self.reader.offset, self.reader.inode
+        # parse_lines skips the blank lines, so they are dropped here to keep the offsets aligned with its output
+        lines = [line for (offset, line) in batch if line.strip()]
+        line_offsets = [offset for (offset, line) in batch if line.strip()]
+        return lines, line_offsets, self.reader.offset, self.reader.inode
+
+    def __write_batch__(self, item):
+        """
+        merges one parsed batch into the database - on the writer thread
+        :param item: a tuple (the list of tuples (fingerprint, normalized listen), the list of the offsets of their
+        lines, offset, inode), the lists are None for the marker that the file has been caught up with
+        :return: None
+        """
+        ingestor = self.ingestor
+        metrics = self.metrics
+        keyed, line_offsets, offset, inode = item
+        ingestor.tailer.advance_to(offset, inode)
+        if keyed is None:
+            # remember how far the file has been read, also past lines that were blank, duplicates or quarantined
+            ingestor.rejects.flush(commit=False)
+            ingestor.tailer.save_checkpoint()
+            if not ingestor.indexes_created:
+                with metrics.time("ingest_stage_seconds", STAGE_HELP, stage="index"):
+                    ingestor.__create_indexes__()
+            with metrics.time("ingest_stage_seconds", STAGE_HELP, stage="report"):
+                ingestor.__refresh_report__()
+            ingestor.__apply_retention__()
+            ingestor.__update_progress__(self.cycle_listens, time.perf_counter() - self.cycle_start)
+            self.cycle_listens = 0
+            self.cycle_start = time.perf_counter()
+            return None
+        with metrics.time("ingest_stage_seconds", STAGE_HELP, stage="dedup"):
+            kept = ingestor.deduplicator.filter_keyed([(fingerprint, i)
+                                                       for i, (fingerprint, record) in enumerate(keyed)])
+            records = [keyed[i][1] for i in kept]
+            offsets = [line_offsets[i] for i in kept]
+        with metrics.time("ingest_stage_seconds", STAGE_HELP, stage="extract"):
+            new_data = ingestor.extractor.get_rows_for_normalized(records)
+        metrics.inc("ingest_lines_read_total", len(keyed), "the number of listens decoded")
+        metrics.inc("ingest_duplicates_total", len(keyed) - len(records),
+                    "the number of listens skipped as ingested before")
+        ingestor.__quarantine__(ingestor.extractor.rejected, offsets=offsets)
+        ingestor.__write__(new_data)
+        self.cycle_listens = self.cycle_listens + len(new_data["listener_data"])
+        metrics.set("ingest_lag_bytes", ingestor.tailer.pending_bytes(),
+                    "the number of bytes of the file not ingested yet")
+
+    async def __read_stage__(self, follow):
+        loop = asyncio.get_running_loop()
+        while True:
+            lines, line_offsets, offset, inode = await loop.run_in_executor(None, self.__next_batch__)
+            await self.parse_queue.put((lines, line_offsets, offset, inode))
+            self.__update_depths__()
+            if lines is None:
+                if not follow:
+                    await self.parse_queue.put(None)
+                    return None
+                # sleep until the file is written to
+                await loop.run_in_executor(None, self.watcher.wait, self.idle_timeout)
+
+    async def __parse_stage__(self):
+        dec = JSONDecoder()
+        while True:
+            item = await self.parse_queue.get()
+            self.__update_depths__()
+            if item is None:
+                await self.write_queue.put(None)
+                return None
+            lines, line_offsets, offset, inode = item
+            if lines is not None:
+                with self.metrics.time("ingest_stage_seconds", STAGE_HELP, stage="parse"):
+                    item = (parse_lines(lines, dec), line_offsets, offset, inode)
+                # let the other stages run between two batches
+                await asyncio.sleep(0)
+            await self.write_queue.put(item)
+            self.__update_depths__()
+
+    async def __write_stage__(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self.write_queue.get()
+            self.__update_depths__()
+            if item is None:
+                return None
+            start = time.perf_counter()
+            await loop.run_in_executor(self.writer, self.__write_batch__, item)
+            if item[0] is not None:
+                self.metrics.observe("ingest_stage_seconds", time.perf_counter() - start, STAGE_HELP, stage="write")
+
+    async def __run__(self, follow, backfill, workers):
+        loop = asyncio.get_running_loop()
+        self.parse_queue = asyncio.Queue(self.queue_size)
+        self.write_queue = asyncio.Queue(self.queue_size)
+        await loop.run_in_executor(self.writer, self.__open__, backfill, workers)
+        # the watcher is set up before the first read, so no append after it can go unnoticed
+        self.watcher = make_watcher(self.ingestor.path) if follow else None
+        tasks = [asyncio.ensure_future(self.__read_stage__(follow)),
+                 asyncio.ensure_future(self.__parse_stage__()),
+                 asyncio.ensure_future(self.__write_stage__())]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            if self.watcher is not None:
+                self.watcher.close()
+            if self.ingestor.conn is not None:
+                await loop.run_in_executor(self.writer, self.ingestor.conn.close)
+
+    def run(self, follow=True, backfill=False, workers=None):
+        """
+        runs the pipeline - the connection of the ingestor is closed when it ends
+        :param follow: a flag to keep waiting for new lines, otherwise the pipeline ends once the file is caught up with
+        :param backfill: a flag to load the data already in the file with a pool of worker processes first
+        :param workers: the number of worker processes used by the backfill
+        :return: None
+        """
+        try:
+            asyncio.run(self.__run__(follow, backfill, workers))
+        finally:
+            self.writer.shutdown(wait=True)
+        logging.info("the pipeline has stopped")
@@ -0,0 +1,92 @@
+import logging
+import signal
+import sys
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+# the profile argument that prints the statistics instead of writing them to a file
+PRINT_PROFILE = "-"
+
+
+def add_profiling_arguments(parser):
+    """
+    adds the --profile and --trace-memory switches to a command line parser, see profiled
+    :param parser: an argparse.ArgumentParser
+    :return: None
+    """
+    parser.add_argument("--profile", nargs="?", const=PRINT_PROFILE, default=None, metavar="PATH",
+                        help="profile with cProfile - the statistics are written to PATH (for pstats or snakeviz), "
+                             "or the slowest functions printed to stderr without it. The threads started meanwhile, "
+                             "e.g. the writer of --pipeline, are profiled too")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="trace the allocations with tracemalloc, the peak and the largest sites are printed to "
+                             "stderr")
+
+@contextmanager
+def profiled(profile=None, trace_memory=False, top=25, stream=None):
+    """
+    runs the block under cProfile and/or tracemalloc and reports once it is left, also by an exception, a
+    KeyboardInterrupt or a SIGTERM (turned into a SystemExit meanwhile) - so a long running ingestion can be profiled
+    up to where it is stopped. cProfile only sees the thread it is enabled in, so every thread started within the
+    block gets a profiler of its own and their statistics are added up
+    :param profile: the path the cProfile statistics are written to, PRINT_PROFILE to print the top functions by
+    cumulative time instead, None not to profile
+    :param trace_memory: a flag to trace the memory allocations
+    :param top: the number of functions and allocation sites reported
+    :param stream: where the reports are printed - stderr by default
+    :return: None
+    """
+    stream = stream or sys.stderr
+    profiler = None
+    # the profilers of the threads started within the block
+    thread_profilers = []
+    if profile is not None:
+        # imported only when profiling, to keep the start of the command lines fast
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+
+        def profile_thread(frame, event, arg):
+            # called once in each new thread, the profiler enabled here replaces this hook
+            thread_profiler = cProfile.Profile()
+            thread_profilers.append(thread_profiler)
+            thread_profiler.enable()
+
+    def terminate(signum, frame):
+        raise SystemExit(128 + signum)
+
+    # the default action of SIGTERM ends the process without leaving the block - signals are handled in the main
+    # thread only
+    handling_sigterm = (profile is not None or trace_memory) and threading.current_thread() is threading.main_thread()
+    if handling_sigterm:
+        previous_handler = signal.signal(signal.SIGTERM, terminate)
+    if trace_memory:
+        tracemalloc.start()
+    if profiler is not None:
+        threading.setprofile(profile_thread)
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if handling_sigterm:
+            signal.signal(signal.SIGTERM, previous_handler)
+        if profiler is not None:
+            profiler.disable()
+            threading.setprofile(None)
+            stats = pstats.Stats(profiler, stream=stream)
+            for thread_profiler in thread_profilers:
+                stats.add(thread_profiler)
+            if profile == PRINT_PROFILE:
+                stats.sort_stats("cumulative").print_stats(top)
+            else:
+                stats.dump_stats(profile)
+                logging.info("the profile has been written to {}".format(profile))
+        if trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print("memory traced: {0:.1f} MB allocated, {1:.1f} MB at the peak".format(current / 1e6, peak / 1e6),
+                  file=stream)
+            for stat in snapshot.statistics("lineno")[:top]:
+                print(stat, file=stream)
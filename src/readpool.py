@@ -0,0 +1,96 @@
+import logging
+import queue
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+
+def ensure_wal(db_path):
+    """
+    switches a database to WAL journaling if it isn't already - the mode is stored in the file, so it holds for
+    every later connection. In WAL mode readers don't block the writer and the writer doesn't block readers
+    :param db_path: the path of the database file - it has to exist, a wrong path raises instead of creating an
+    empty database
+    :return: the journal mode in effect
+    """
+    conn = sqlite3.connect("file:{}?mode=rw".format(db_path), uri=True)
+    try:
+        journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        if journal_mode != "wal":
+            journal_mode = conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+            logging.info("{0} has been switched to the {1} journal mode".format(db_path, journal_mode))
+        return journal_mode
+    finally:
+        conn.close()
+
+
+class ReadPool():
+
+    """
+    This class is the read side of the database for the BI queries and the report while the ingestion is writing.
+    It holds a fixed number of read-only connections to a database in WAL mode, which are handed out one per
+    thread:
+        1.a connection is read-only (mode=ro and query_only), so a query can never take the write lock
+        2.each use of a connection is one read transaction, so all queries of a `with pool.connection()` block see
+        the same snapshot of the database, however many batches are committed meanwhile
+        3.a reader never waits for the writer nor the writer for a reader, the only wait is for an idle connection
+    """
+
+    def __init__(self, db_path, size=4, busy_timeout_ms=5000, mmap_size_mb=256):
+        self.db_path = db_path
+        self.size = size
+        ensure_wal(db_path)
+        self.idle = queue.Queue()
+        for i in range(size):
+            conn = sqlite3.connect("file:{}?mode=ro".format(db_path), uri=True, check_same_thread=False,
+                                   isolation_level=None)
+            conn.execute("PRAGMA query_only=ON")
+            conn.execute("PRAGMA busy_timeout={}".format(busy_timeout_ms))
+            conn.execute("PRAGMA mmap_size={}".format(mmap_size_mb * 1024 * 1024))
+            self.idle.put(conn)
+        self.executor = None
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """
+        lends a connection for one snapshot-consistent read transaction
+        :param timeout: the maximum number of seconds to wait for an idle connection, None to wait however long
+        :return: yields the connection
+        """
+        conn = self.idle.get(timeout=timeout)
+        try:
+            conn.execute("BEGIN")
+            # the snapshot is taken by the first read of the transaction
+            conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            self.idle.put(conn)
+
+    def run(self, function, *args, **kwargs):
+        """
+        calls function(connection, *args, **kwargs) in a snapshot
+        :return: what the function returns
+        """
+        with self.connection() as conn:
+            return function(conn, *args, **kwargs)
+
+    def submit(self, function, *args, **kwargs):
+        """
+        runs a function like run in one of the threads of the pool
+        :return: the future of the result
+        """
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix="sqlite-reader")
+        return self.executor.submit(self.run, function, *args, **kwargs)
+
+    def close(self):
+        """
+        closes all connections - to be called once no query runs anymore
+        :return: None
+        """
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+        for i in range(self.size):
+            self.idle.get().close()
@@ -0,0 +1,101 @@
+import json
+import logging
+import time
+from collections import Counter, namedtuple
+
+# the reasons a line is quarantined for
+# the line is not valid JSON
+MALFORMED_JSON = "malformed_json"
+# the listen lacks its track_metadata or additional_info
+SPARSE = "sparse"
+# the recording msid is missing or doesn't match MSID_PATTERN
+INVALID_MSID = "invalid_msid"
+# the user name or the timestamp is missing or of the wrong type
+INVALID_FIELD = "invalid_field"
+# the recording can't be stored: its track name is missing or the msid of its artist or release is invalid
+UNKNOWN_RECORDING = "unknown_recording"
+# the listen is older than the listens kept by the retention, its month has been dropped already
+EXPIRED = "expired"
+# the timestamp is before 1970 or in the future, e.g. in milliseconds
+INVALID_TIMESTAMP = "invalid_timestamp"
+REASONS = (MALFORMED_JSON, SPARSE, INVALID_MSID, INVALID_FIELD, UNKNOWN_RECORDING, EXPIRED, INVALID_TIMESTAMP)
+
+# a line rejected before it reaches the Extractor, e.g. by a worker process, together with the line itself
+Rejected = namedtuple("Rejected", ("reason", "payload"))
+
+
+class RejectStore():
+
+    """
+    This class keeps what the ingestion rejects instead of throwing it away, in the table
+        quarantine (id, reason, source, offset, payload) - offset is the byte offset of the line in the source, or
+        the offset its batch was read up to where the line itself isn't known
+    The rejections are buffered and written with the batch they came with, in its transaction. Instead of a log
+    line per rejection a summary of the counts per reason is logged at most every log_interval seconds.
+    """
+
+    def __init__(self, db_conn, source=None, log_interval=10.0):
+        """
+        :param source: the default source of the rejections, e.g. the path of the file
+        """
+        self.conn = db_conn
+        self.source = source
+        self.log_interval = log_interval
+        self.pending = []
+        # the rejections per reason since the start, and since the last summary was logged
+        self.counts = Counter()
+        self.unlogged = Counter()
+        self.last_log = time.monotonic()
+        self.conn.execute("CREATE TABLE IF NOT EXISTS quarantine "
+                          "(id INTEGER PRIMARY KEY, "
+                          "reason TEXT, "
+                          "source TEXT, "
+                          "offset INTEGER, "
+                          "payload TEXT)")
+        self.conn.commit()
+
+    def add(self, reason, payload, offset=None, source=None):
+        """
+        buffers a rejection
+        :param reason: one of REASONS
+        :param payload: the line, or the listen - which is stored as json
+        :return: None
+        """
+        self.pending.append((reason, source or self.source, offset, payload))
+
+    def flush(self, commit=True):
+        """
+        writes the buffered rejections to the database and logs the summary if it is due
+        :param commit: a flag to commit the transaction - set it to False to commit together with the data
+        :return: None
+        """
+        if self.pending:
+            rows = [(reason, source, offset, payload if isinstance(payload, str) else json.dumps(payload, default=str))
+                    for (reason, source, offset, payload) in self.pending]
+            self.conn.executemany("INSERT INTO quarantine (reason, source, offset, payload) VALUES (?,?,?,?)", rows)
+            counts = Counter(row[0] for row in rows)
+            self.counts.update(counts)
+            self.unlogged.update(counts)
+            self.pending = []
+        if commit:
+            self.conn.commit()
+        self.__maybe_log__()
+
+    def __maybe_log__(self):
+        now = time.monotonic()
+        if self.unlogged and now - self.last_log >= self.log_interval:
+            logging.warning("{0} lines have been quarantined in the last {1:.0f}s: {2}".format(
+                sum(self.unlogged.values()), now - self.last_log,
+                ", ".join("{0} {1}".format(n, reason) for (reason, n) in self.unlogged.most_common())))
+            self.unlogged = Counter()
+            self.last_log = now
+
+
+def read_quarantine(conn, reason=None, limit=100):
+    """
+    :param reason: one of REASONS, None for all
+    :return: the list of the first tuples (reason, source, offset, payload) quarantined
+    """
+    cmd = "SELECT reason, source, offset, payload FROM quarantine " + \
+          ("WHERE reason = ? " if reason is not None else "") + "ORDER BY id LIMIT ?"
+    return conn.execute(cmd, ((reason,) if reason is not None else ()) + (limit,)).fetchall()
@@ -0,0 +1,255 @@
+import logging
+from collections import Counter
+from datetime import date, timedelta
+from sqlite3 import OperationalError
+from src.rollup import SECONDS_PER_DAY
+from src.partition import listeners_source
+
+# the granularities of the report
+GRAINS = ("day", "week", "month")
+# the number of top tracks and top artists kept per period
+TOP_N = 10
+EPOCH = date(1970, 1, 1)
+
+def period_start(grain, day):
+    """
+    :param grain: one of GRAINS
+    :param day: the number of a day bucket
+    :return: the number of the first day of the period of the given grain the day falls in - weeks start on monday
+    """
+    if grain == "day":
+        return day
+    if grain == "week":
+        # 1970-01-01 was a thursday
+        return day - (day + 3) % 7
+    d = EPOCH + timedelta(days=day)
+    return (date(d.year, d.month, 1) - EPOCH).days
+
+def first_period_from(grain, day):
+    """
+    :param grain: one of GRAINS
+    :param day: the number of a day bucket
+    :return: the number of the first day of the first period of the given grain that starts on the day or later
+    """
+    start = period_start(grain, day)
+    if start < day:
+        # a week or a month is at most 31 days long
+        start = period_start(grain, start + (31 if grain == "month" else 7))
+    return start
+
+def day_to_iso(day):
+    """
+    :return: the date of a day bucket in the form YYYY-MM-DD
+    """
+    return (EPOCH + timedelta(days=day)).isoformat()
+
+
+class ReportEngine():
+
+    """
+    This class materializes the management report of Task #3: for every day, week and month the number of listens,
+    active users and new users (users whose first listen falls in the period) and the top tracks and artists.
+        report_metrics (grain, period_start, listens, active_users, new_users)
+        report_top (grain, period_start, kind, rank, item_id, listens) - kind is 'track' or 'artist'
+        report_sessions (grain, period_start, sessions, listening_seconds) - the sessions starting in the period
+        and the approximate time listened in them, read from the sessions table (see SessionMaintainer) if it exists
+    The ingestion only notes the earliest day it touched since the last refresh (report_state). A refresh then
+    recomputes the periods from that day on - normally just the trailing ones - in a single scan over the listens
+    of those days, computing all grains at once. Every period before stays as it was materialized.
+    Once the retention has dropped listens, report_state also holds the first day kept (retained_from): the
+    periods starting before it are never recomputed, as their listens are gone only partly or entirely.
+    """
+
+    def __init__(self, db_conn):
+        # the listeners table has to exist already
+        self.conn = db_conn
+        self.__create_report_tables__()
+
+    def __create_report_tables__(self):
+        """
+        creates the report tables if they don't exist yet
+        :return: None
+        """
+        self.conn.execute("CREATE TABLE IF NOT EXISTS report_metrics "
+                          "(grain TEXT, "
+                          "period_start INTEGER, "
+                          "listens INTEGER, "
+                          "active_users INTEGER, "
+                          "new_users INTEGER, "
+                          "PRIMARY KEY(grain, period_start)) WITHOUT ROWID")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS report_top "
+                          "(grain TEXT, "
+                          "period_start INTEGER, "
+                          "kind TEXT, "
+                          "rank INTEGER, "
+                          "item_id INTEGER, "
+                          "listens INTEGER, "
+                          "PRIMARY KEY(grain, period_start, kind, rank)) WITHOUT ROWID")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS report_sessions "
+                          "(grain TEXT, "
+                          "period_start INTEGER, "
+                          "sessions INTEGER, "
+                          "listening_seconds INTEGER, "
+                          "PRIMARY KEY(grain, period_start)) WITHOUT ROWID")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS report_state "
+                          "(id INTEGER PRIMARY KEY CHECK (id = 1), "
+                          "dirty_from INTEGER, "
+                          "retained_from INTEGER)")
+        # the listens stored before the report existed are all to be reported on the first refresh
+        self.conn.execute("INSERT OR IGNORE INTO report_state (id, dirty_from) SELECT 1, min(day) FROM listeners")
+        try:
+            sessions_missing = self.conn.execute("SELECT EXISTS (SELECT 1 FROM sessions) "
+                                                 "AND NOT EXISTS (SELECT 1 FROM report_sessions)").fetchone()[0]
+        except OperationalError:
+            sessions_missing = False
+        if sessions_missing:
+            # so are the sessions of a report materialized before they were part of it
+            self.conn.execute("UPDATE report_state SET dirty_from = (SELECT min(day) FROM listeners) WHERE id = 1")
+        self.conn.commit()
+
+    def mark_dirty(self, listener_rows, first_day=None):
+        """
+        notes the earliest day of a batch of listens without committing, the caller commits together with the
+        listens themselves
+        :param listener_rows: the list of tuples (user_id, recording_id, listened_at, day) inserted into listeners
+        :param first_day: an earlier day the batch changed, e.g. the start of a session it extended
+        :return: None
+        """
+        if listener_rows:
+            first_day = min([row[3] for row in listener_rows] + ([first_day] if first_day is not None else []))
+            self.conn.execute("UPDATE report_state SET dirty_from = min(coalesce(dirty_from, ?), ?) WHERE id = 1",
+                              (first_day, first_day))
+
+    def retained_from(self):
+        """
+        :return: the first day of the listens kept by the retention, None if none have been dropped
+        """
+        return self.conn.execute("SELECT retained_from FROM report_state WHERE id = 1").fetchone()[0]
+
+    def retain(self, first_day):
+        """
+        notes that the listens before a day have been dropped without committing, the caller commits together with
+        the partitions dropped
+        :param first_day: the first day of the listens kept
+        :return: None
+        """
+        self.conn.execute("UPDATE report_state SET retained_from = max(coalesce(retained_from, ?), ?) WHERE id = 1",
+                          (first_day, first_day))
+
+    def refresh(self):
+        """
+        recomputes the periods touched since the last refresh and commits
+        :return: the number of the first day recomputed, or None if the report was up to date
+        """
+        dirty_from, retained_from = self.conn.execute("SELECT dirty_from, retained_from FROM report_state "
+                                                      "WHERE id = 1").fetchone()
+        if dirty_from is None:
+            return None
+        # every period of every grain containing the dirty day or a later one is recomputed - except those that
+        # started before the retention floor, they keep what was materialized from all their listens
+        starts = dict((grain, period_start(grain, dirty_from)) for grain in GRAINS)
+        if retained_from is not None:
+            starts = dict((grain, max(start, first_period_from(grain, retained_from)))
+                          for (grain, start) in starts.items())
+        scan_from = min(starts.values())
+
+        listens = dict((grain, Counter()) for grain in GRAINS)
+        users = dict((grain, {}) for grain in GRAINS)
+        tracks = dict((grain, {}) for grain in GRAINS)
+        artists = dict((grain, {}) for grain in GRAINS)
+        # the periods of a day are the same for all its listens, they are computed once per day
+        periods_of_day = {}
+
+        # the single scan over the listens of the periods to recompute, only their partitions are read
+        cmd = "SELECT listeners.day, listeners.user_id, listeners.recording_id, recordings.artist_id " \
+              "FROM {} AS listeners JOIN recordings ON listeners.recording_id = recordings.recording_id " \
+              "WHERE listeners.day >= ?".format(listeners_source(self.conn, scan_from))
+        for (day, user_id, recording_id, artist_id) in self.conn.execute(cmd, (scan_from,)):
+            periods = periods_of_day.get(day)
+            if periods is None:
+                periods = periods_of_day[day] = [(grain, period_start(grain, day)) for grain in GRAINS
+                                                 if period_start(grain, day) >= starts[grain]]
+            for (grain, start) in periods:
+                listens[grain][start] += 1
+                period_users = users[grain].get(start)
+                if period_users is None:
+                    period_users = users[grain][start] = set()
+                    tracks[grain][start] = Counter()
+                    artists[grain][start] = Counter()
+                period_users.add(user_id)
+                tracks[grain][start][recording_id] += 1
+                artists[grain][start][artist_id] += 1
+
+        # the new users of each period follow from the first listen of each user
+        new_users = dict((grain, Counter()) for grain in GRAINS)
+        cmd = "SELECT first_listened_at / ? FROM user_stats WHERE first_listened_at >= ?"
+        for (first_day,) in self.conn.execute(cmd, (SECONDS_PER_DAY, scan_from * SECONDS_PER_DAY)):
+            for grain in GRAINS:
+                start = period_start(grain, first_day)
+                if start >= starts[grain]:
+                    new_users[grain][start] += 1
+
+        # the sessions are counted in the period they start in - imported here, reading the report needs no numpy
+        from src.sessions import TRACK_SECONDS
+        sessions = dict((grain, Counter()) for grain in GRAINS)
+        seconds = dict((grain, Counter()) for grain in GRAINS)
+        cmd = "SELECT started_at / ?, count(*), sum(ended_at - started_at) + count(*) * ? FROM sessions " \
+              "WHERE started_at >= ? GROUP BY 1"
+        try:
+            for (day, count, total) in self.conn.execute(cmd, (SECONDS_PER_DAY, TRACK_SECONDS,
+                                                               scan_from * SECONDS_PER_DAY)):
+                for grain in GRAINS:
+                    start = period_start(grain, day)
+                    if start >= starts[grain]:
+                        sessions[grain][start] += count
+                        seconds[grain][start] += total
+        except OperationalError:
+            # a database without sessions
+            pass
+
+        for grain in GRAINS:
+            self.conn.execute("DELETE FROM report_sessions WHERE grain = ? AND period_start >= ?",
+                              (grain, starts[grain]))
+            self.conn.executemany("INSERT INTO report_sessions VALUES (?,?,?,?)",
+                                  ((grain, start, count, seconds[grain][start])
+                                   for (start, count) in sessions[grain].items()))
+            self.conn.execute("DELETE FROM report_metrics WHERE grain = ? AND period_start >= ?",
+                              (grain, starts[grain]))
+            self.conn.execute("DELETE FROM report_top WHERE grain = ? AND period_start >= ?",
+                              (grain, starts[grain]))
+            self.conn.executemany("INSERT INTO report_metrics VALUES (?,?,?,?,?)",
+                                  ((grain, start, count, len(users[grain][start]), new_users[grain][start])
+                                   for (start, count) in listens[grain].items()))
+            for kind, counters in (("track", tracks[grain]), ("artist", artists[grain])):
+                self.conn.executemany("INSERT INTO report_top VALUES (?,?,?,?,?,?)",
+                                      ((grain, start, kind, rank, item_id, count)
+                                       for (start, counter) in counters.items()
+                                       for (rank, (item_id, count)) in enumerate(counter.most_common(TOP_N), 1)))
+        self.conn.execute("UPDATE report_state SET dirty_from = NULL WHERE id = 1")
+        self.conn.commit()
+        logging.info("the report has been recomputed from {}".format(day_to_iso(scan_from)))
+        return scan_from
+
+
+def read_report(conn, grain="month"):
+    """
+    reads the materialized report - the top track and top artist of each period are joined to their names
+    :param conn: the connection to the database
+    :param grain: one of GRAINS
+    :return: the list of tuples (period, listens, active_users, new_users, top_track, top_artist, sessions_per_user,
+    hours_listened) ordered by period - the last two are None for a period without sessions
+    """
+    cmd = "SELECT m.period_start, m.listens, m.active_users, m.new_users, " \
+          "recordings.track_name, artists.artist_name, " \
+          "round(1.0 * s.sessions / m.active_users, 2), round(s.listening_seconds / 3600.0, 1) " \
+          "FROM report_metrics AS m " \
+          "LEFT JOIN report_top AS t ON t.grain = m.grain AND t.period_start = m.period_start " \
+          "AND t.kind = 'track' AND t.rank = 1 " \
+          "LEFT JOIN recordings ON recordings.recording_id = t.item_id " \
+          "LEFT JOIN report_top AS a ON a.grain = m.grain AND a.period_start = m.period_start " \
+          "AND a.kind = 'artist' AND a.rank = 1 " \
+          "LEFT JOIN artists ON artists.artist_id = a.item_id " \
+          "LEFT JOIN report_sessions AS s ON s.grain = m.grain AND s.period_start = m.period_start " \
+          "WHERE m.grain = ? " \
+          "ORDER BY m.period_start"
+    return [(day_to_iso(row[0]),) + tuple(row[1:]) for row in conn.execute(cmd, (grain,))]
@@ -0,0 +1,95 @@
+import logging
+from datetime import date
+
+# the number of seconds per day bucket, days are counted in UTC since the unix epoch
+SECONDS_PER_DAY = 86400
+
+def day_number(iso_date):
+    """
+    :param iso_date: a date in the form YYYY-MM-DD
+    :return: the number of the day bucket the date falls in
+    """
+    return (date.fromisoformat(iso_date) - date(1970, 1, 1)).days
+
+class RollupMaintainer():
+
+    """
+    This class keeps summary tables for the Task #2 questions up to date, in the same transaction as each batch of
+    listens is inserted, so that the BI queries read a handful of rows instead of scanning the fact table:
+        user_stats (user_id, listen_count, first_listened_at, first_recording_id) - one row per user
+        user_days (day, user_id) - which users were active on which day
+        daily_active_users (day, active_users) - the number of distinct users per day
+    Each batch is aggregated in memory first, so every summary row is touched at most once per batch.
+    """
+
+    def __init__(self, db_conn):
+        self.conn = db_conn
+        self.__create_rollup_tables__()
+
+    def __create_rollup_tables__(self):
+        """
+        creates the summary tables if they don't exist yet
+        :return: None
+        """
+        self.conn.execute("CREATE TABLE IF NOT EXISTS user_stats "
+                          "(user_id INTEGER PRIMARY KEY, "
+                          "listen_count INTEGER, "
+                          "first_listened_at INTEGER, "
+                          "first_recording_id INTEGER)")
+        # serves the ordering by activity of query1 without sorting all users
+        self.conn.execute("CREATE INDEX IF NOT EXISTS index_user_stats_listen_count ON user_stats(listen_count)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS user_days "
+                          "(day INTEGER, "
+                          "user_id INTEGER, "
+                          "PRIMARY KEY(day, user_id)) WITHOUT ROWID")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS daily_active_users "
+                          "(day INTEGER PRIMARY KEY, "
+                          "active_users INTEGER)")
+        self.conn.commit()
+
+    def apply(self, listener_rows):
+        """
+        folds a batch of listens into the summary tables without committing, the caller commits together with
+        the listens themselves
+        :param listener_rows: the list of tuples (user_id, recording_id, listened_at, day) inserted into listeners
+        :return: None
+        """
+        if not listener_rows:
+            return None
+        # aggregate the batch per user and per day
+        users = {}
+        days = {}
+        for (user_id, recording_id, listened_at, day) in listener_rows:
+            stats = users.get(user_id)
+            if stats is None:
+                users[user_id] = [1, listened_at, recording_id]
+            else:
+                stats[0] = stats[0] + 1
+                if listened_at < stats[1]:
+                    stats[1] = listened_at
+                    stats[2] = recording_id
+            day_users = days.get(day)
+            if day_users is None:
+                days[day] = day_users = set()
+            day_users.add(user_id)
+
+        cmd = "INSERT INTO user_stats VALUES (?,?,?,?) " \
+              "ON CONFLICT(user_id) DO UPDATE SET " \
+              "listen_count = listen_count + excluded.listen_count, " \
+              "first_recording_id = CASE WHEN excluded.first_listened_at < first_listened_at " \
+              "THEN excluded.first_recording_id ELSE first_recording_id END, " \
+              "first_listened_at = min(first_listened_at, excluded.first_listened_at)"
+        self.conn.executemany(cmd, ((user_id, stats[0], stats[1], stats[2]) for (user_id, stats) in users.items()))
+
+        for day, day_users in days.items():
+            # only the pairs not stored yet make a user newly active on that day
+            changes_before = self.conn.total_changes
+            self.conn.executemany("INSERT OR IGNORE INTO user_days VALUES (?,?)",
+                                  ((day, user_id) for user_id in day_users))
+            added = self.conn.total_changes - changes_before
+            if added:
+                cmd = "INSERT INTO daily_active_users VALUES (?,?) " \
+                      "ON CONFLICT(day) DO UPDATE SET active_users = active_users + excluded.active_users"
+                self.conn.execute(cmd, (day, added))
+        logging.info("the summaries of {0} users and {1} days have been updated".format(len(users), len(days)))
+        return None
@@ -0,0 +1,64 @@
+import logging
+from sqlite3 import Error
+
+# the version of the database layout written by this code - bump it whenever a table definition changes
+SCHEMA_VERSION = 7
+
+class SchemaManager():
+
+    """
+    This class keeps track of the layout of the database across restarts. The version is recorded in the
+    user_version header field of the database file. On startup:
+        1.a new database (version 0, no tables) simply gets all the tables created
+        2.a database with the current version is used as it is, so the ingestion resumes where it stopped
+        3.a database with an older version (or written before versions were recorded) is wiped, all its content
+        is derived from the input file and gets re-ingested from the start
+        4.a database written by a newer version of this code is refused
+    The tables themselves are created by their owners (CrudTable, FileTailer, ListenDeduplicator, ...) only if
+    they don't exist yet.
+    """
+
+    def __init__(self, db_conn):
+        self.conn = db_conn
+
+    def get_version(self):
+        """
+        :return: the schema version recorded in the database
+        """
+        return self.conn.execute("PRAGMA user_version").fetchone()[0]
+
+    def __list_tables__(self):
+        """
+        :return: the names of all tables in the database
+        """
+        cmd = "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'"
+        return [row[0] for row in self.conn.execute(cmd)]
+
+    def prepare(self):
+        """
+        checks the recorded version and wipes an outdated database - to be called before any table is created
+        :return: True if the existing content can be resumed from, False if the tables start out empty
+        """
+        version = self.get_version()
+        tables = self.__list_tables__()
+        if version > SCHEMA_VERSION:
+            raise Error("the database has schema version {0}, this code only knows up to {1}".format(
+                version, SCHEMA_VERSION))
+        if version == SCHEMA_VERSION:
+            logging.info("resuming with the existing database (schema version {})".format(version))
+            return True
+        if tables:
+            logging.warning("the database has the outdated schema version {0}, its tables {1} are re-created".format(
+                version, tables))
+            for table_name in tables:
+                self.conn.execute("DROP TABLE IF EXISTS " + table_name)
+            self.conn.commit()
+        return False
+
+    def commit_version(self):
+        """
+        records the current version - to be called once all tables have been created
+        :return: None
+        """
+        self.conn.execute("PRAGMA user_version={}".format(SCHEMA_VERSION))
+        self.conn.commit()
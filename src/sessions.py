@@ -0,0 +1,142 @@
+import logging
+import numpy as np
+from src.rollup import SECONDS_PER_DAY
+
+# the default inactivity gap in seconds that ends a listening session
+SESSION_GAP = 1800
+# the assumed length of the last track of a session, its end isn't known from the listens - the time listened in a
+# session is approximated as ended_at - started_at + TRACK_SECONDS
+TRACK_SECONDS = 210
+# larger than any timestamp, shifts the times of each user above those of the users sorted before it
+USER_SHIFT = 1 << 34
+
+
+def sessionize(users, starts, ends, counts, gap):
+    """
+    merges the intervals of each user that are at most gap seconds apart into sessions, vectorized. A single listen
+    is the interval (listened_at, listened_at) counted once
+    :param users: the array of the user ids of the intervals
+    :param starts: the array of the first timestamps of the intervals
+    :param ends: the array of the last timestamps of the intervals - not negative
+    :param counts: the array of the numbers of listens of the intervals
+    :param gap: the inactivity gap in seconds
+    :return: a tuple (order, group) - the order the intervals are sorted in and the session of each sorted interval
+    numbered from 0, and the arrays (users, starts, ends, counts) of the sessions
+    """
+    order = np.lexsort((starts, users))
+    users, starts, ends, counts = users[order], starts[order], ends[order], counts[order]
+    user_changes = users[1:] != users[:-1]
+    # the latest end seen so far per user, the shift keeps the running maximum from crossing to the next user
+    shift = np.concatenate(([0], np.cumsum(user_changes))) * USER_SHIFT
+    reach = np.maximum.accumulate(ends + shift) - shift
+    new = np.ones(len(users), dtype=bool)
+    new[1:] = user_changes | (starts[1:] > reach[:-1] + gap)
+    first = np.flatnonzero(new)
+    group = np.cumsum(new) - 1
+    return (order, group), (users[first], np.minimum.reduceat(starts, first), np.maximum.reduceat(ends, first),
+                            np.add.reduceat(counts, first))
+
+
+class SessionMaintainer():
+
+    """
+    This class groups the listens of each user into listening sessions - runs of listens no more than gap seconds
+    apart - in the same transaction as each batch of listens, like the RollupMaintainer:
+        sessions (session_id, user_id, started_at, ended_at, listens)
+    The open sessions are not held in memory between batches, the sessions table is the state: per batch only the
+    stored sessions of its users that the batch can extend or join are read, merged with the listens of the batch
+    in one vectorized pass (see sessionize) and written back. Listens arriving out of order are merged the same way,
+    so the sessions are those of all listens stored whatever order they came in. A changed gap only applies to the
+    listens from then on.
+    A database ingested before the sessions existed gets them built from the listeners once.
+    """
+
+    def __init__(self, db_conn, gap=SESSION_GAP):
+        """
+        :param gap: the inactivity gap in seconds that ends a session
+        """
+        self.conn = db_conn
+        self.gap = gap
+        self.__create_session_tables__()
+
+    def __create_session_tables__(self):
+        """
+        creates the sessions table if it doesn't exist yet
+        :return: None
+        """
+        exists = self.conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='sessions'").fetchone()
+        self.conn.execute("CREATE TABLE IF NOT EXISTS sessions "
+                          "(session_id INTEGER PRIMARY KEY, "
+                          "user_id INTEGER, "
+                          "started_at INTEGER, "
+                          "ended_at INTEGER, "
+                          "listens INTEGER)")
+        # serves the sessions a batch may extend, and the sessions of the periods of the report
+        self.conn.execute("CREATE INDEX IF NOT EXISTS index_sessions_user_end ON sessions(user_id, ended_at)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS index_sessions_start ON sessions(started_at)")
+        if not exists:
+            self.rebuild()
+        self.conn.commit()
+
+    def rebuild(self, chunk_size=100000):
+        """
+        builds the sessions from all listens stored so far, without committing
+        :return: None
+        """
+        self.conn.execute("DELETE FROM sessions")
+        cursor = self.conn.execute("SELECT user_id, recording_id, listened_at, day FROM listeners")
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            self.apply(rows)
+
+    def __load_sessions__(self, user_ids, low, high, chunk_size=500):
+        """
+        :param user_ids: the list of the users of a batch
+        :param low: the first timestamp of the batch minus the gap
+        :param high: the last timestamp of the batch plus the gap
+        :return: the list of tuples (session_id, user_id, started_at, ended_at, listens) of the stored sessions of
+        the users that overlap [low, high]
+        """
+        sessions = []
+        for i in range(0, len(user_ids), chunk_size):
+            chunk = user_ids[i:i + chunk_size]
+            cmd = "SELECT session_id, user_id, started_at, ended_at, listens FROM sessions " \
+                  "WHERE user_id IN ({}) AND ended_at >= ? AND started_at <= ?".format(",".join("?" * len(chunk)))
+            sessions.extend(self.conn.execute(cmd, chunk + [low, high]))
+        return sessions
+
+    def apply(self, listener_rows):
+        """
+        folds a batch of listens into the sessions without committing, the caller commits together with the
+        listens themselves
+        :param listener_rows: the list of tuples (user_id, recording_id, listened_at, day) inserted into listeners
+        :return: the first day of the sessions written, None for an empty batch
+        """
+        if not listener_rows:
+            return None
+        rows = np.array(listener_rows, dtype=np.int64)
+        users, times = rows[:, 0], rows[:, 2]
+        stored = self.__load_sessions__(np.unique(users).tolist(), int(times.min()) - self.gap,
+                                        int(times.max()) + self.gap)
+        stored = np.array(stored, dtype=np.int64).reshape(-1, 5)
+        # the listens of the batch are sessionized together with the stored sessions, which have an id
+        ids = np.concatenate((np.full(len(rows), -1, dtype=np.int64), stored[:, 0]))
+        (order, group), (session_users, starts, ends, counts) = sessionize(
+            np.concatenate((users, stored[:, 1])), np.concatenate((times, stored[:, 2])),
+            np.concatenate((times, stored[:, 3])), np.concatenate((np.ones(len(rows), dtype=np.int64), stored[:, 4])),
+            self.gap)
+        # only the sessions with listens of the batch change, the stored sessions merged into them are replaced
+        ids = ids[order]
+        changed = np.zeros(len(starts), dtype=bool)
+        changed[group[ids < 0]] = True
+        replaced = ids[(ids >= 0) & changed[group]]
+        if len(replaced):
+            self.conn.executemany("DELETE FROM sessions WHERE session_id = ?", ((id,) for id in replaced.tolist()))
+        new_sessions = np.column_stack((session_users, starts, ends, counts))[changed]
+        self.conn.executemany("INSERT INTO sessions (user_id, started_at, ended_at, listens) VALUES (?,?,?,?)",
+                              new_sessions.tolist())
+        logging.info("{0} sessions have been written in place of {1} stored ones".format(
+            len(new_sessions), len(replaced)))
+        return int(new_sessions[:, 1].min()) // SECONDS_PER_DAY
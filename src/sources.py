@@ -0,0 +1,245 @@
+import glob
+import gzip
+import logging
+import multiprocessing
+import os
+import queue
+from concurrent.futures import ProcessPoolExecutor
+from json import JSONDecoder
+from src.backfill import parse_lines
+
+# the characters that make an input path a glob pattern
+GLOB_CHARS = "*?["
+
+
+def is_sharded(spec):
+    """
+    :param spec: the input given to the ingestor
+    :return: True if it names a directory or a glob pattern of shards rather than a single file
+    """
+    return os.path.isdir(spec) or any(char in spec for char in GLOB_CHARS)
+
+def list_shards(spec):
+    """
+    :param spec: a file, a directory (all of its files are shards) or a glob pattern
+    :return: the sorted list of the paths of the shards - daily files named by date are in chronological order
+    """
+    if os.path.isdir(spec):
+        paths = [os.path.join(spec, name) for name in os.listdir(spec) if not name.startswith(".")]
+        paths = [path for path in paths if os.path.isfile(path)]
+    elif any(char in spec for char in GLOB_CHARS):
+        paths = [path for path in glob.glob(spec) if os.path.isfile(path)]
+    else:
+        paths = [spec] if os.path.isfile(spec) else []
+    return sorted(os.path.abspath(path) for path in paths)
+
+def watched_directory(spec):
+    """
+    :return: the directory in which new shards of the input appear
+    """
+    if os.path.isdir(spec):
+        return spec
+    return os.path.dirname(os.path.abspath(spec.split("*")[0].split("?")[0].split("[")[0]) + "x")
+
+def is_compressed(path):
+    return path.endswith(".gz")
+
+def read_shard_lines(path, offset=0, chunk_size=1 << 20):
+    """
+    a generator over the complete lines of a shard from an offset on. A plain file may still be written to, so a last
+    line without its newline is left for later. A compressed file is complete, its last line is read as it is. It
+    is decompressed while it is read - the offsets of compressed files count the decompressed bytes, so resuming
+    one decompresses and skips everything before the offset
+    :param path: the path of the shard
+    :param offset: the byte offset to start at, it has to be at the start of a line
+    :return: yields tuples (the offset right after the line, the decoded line without the newline)
+    """
+    compressed = is_compressed(path)
+    with (gzip.open(path, "rb") if compressed else open(path, "rb")) as file:
+        if compressed:
+            skipped = 0
+            while skipped < offset:
+                data = file.read(min(chunk_size, offset - skipped))
+                if not data:
+                    break
+                skipped = skipped + len(data)
+        else:
+            file.seek(offset)
+        position = offset
+        buffer = b""
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+            lines = (buffer + chunk).split(b"\n")
+            buffer = lines.pop()
+            for line in lines:
+                position = position + len(line) + 1
+                yield position, line.decode("utf-8", errors="replace")
+        if compressed and buffer:
+            yield position + len(buffer), buffer.decode("utf-8", errors="replace")
+
+def shard_chunks(task):
+    """
+    decodes and validates a shard in chunks, the stateless part of its ingestion
+    :param task: a tuple (path, offset, number of lines per chunk)
+    :return: yields tuples (path, inode, the list of tuples (fingerprint, normalized listen), the offset after the
+    chunk, a flag whether it is the last chunk)
+    """
+    path, offset, chunk_lines = task
+    inode = os.stat(path).st_ino
+    dec = JSONDecoder()
+    lines = []
+    for offset, line in read_shard_lines(path, offset):
+        lines.append(line)
+        if len(lines) >= chunk_lines:
+            yield path, inode, parse_lines(lines, dec), offset, False
+            lines = []
+    yield path, inode, parse_lines(lines, dec), offset, True
+
+
+# the queue the chunks of a worker process are sent through and the event telling it to stop, set up by init_worker
+worker_queue = None
+worker_stop = None
+
+def init_worker(chunk_queue, stop):
+    global worker_queue, worker_stop
+    worker_queue = chunk_queue
+    worker_stop = stop
+
+def send_chunk(chunk):
+    """
+    puts a chunk into the queue, waiting while it is full unless the parent process asks the workers to stop
+    :return: False if the workers are to stop
+    """
+    while not worker_stop.is_set():
+        try:
+            worker_queue.put(chunk, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def stream_shard(task):
+    """
+    sends the chunks of a shard to the parent process - in a worker process. The queue is bounded, so a worker waits
+    while the parent is busy writing and holds at most one chunk at a time
+    :return: None
+    """
+    try:
+        for chunk in shard_chunks(task):
+            if not send_chunk(chunk):
+                return None
+    except Exception as e:
+        logging.error("the shard {0} could not be read: {1}".format(task[0], e))
+        send_chunk((task[0], None, None, None, True))
+
+
+class ShardProgress():
+
+    """
+    This class records how far each compressed shard has been ingested, in the table
+        shard_progress (path, inode, offset, done) - offset counts the decompressed bytes
+    so that a restart skips the shards done and resumes the others. Plain shards are recorded by their FileTailer
+    instead, which also follows them while they are appended to.
+    """
+
+    def __init__(self, db_conn):
+        self.conn = db_conn
+        self.conn.execute("CREATE TABLE IF NOT EXISTS shard_progress "
+                          "(path TEXT PRIMARY KEY, "
+                          "inode INTEGER, "
+                          "offset INTEGER, "
+                          "done INTEGER)")
+        self.conn.commit()
+
+    def get(self, path):
+        """
+        :return: the offset to resume a compressed shard at, or None if it has been ingested completely
+        """
+        row = self.conn.execute("SELECT inode, offset, done FROM shard_progress WHERE path = ?", (path,)).fetchone()
+        if row is None or row[0] != os.stat(path).st_ino:
+            # new, or a different file under the same name
+            return 0
+        return None if row[2] else row[1]
+
+    def save(self, path, inode, offset, done, commit=True):
+        """
+        :param commit: a flag to commit the transaction - set it to False to commit together with the data
+        :return: None
+        """
+        self.conn.execute("INSERT OR REPLACE INTO shard_progress VALUES (?,?,?,?)", (path, inode, offset, int(done)))
+        if commit:
+            self.conn.commit()
+
+
+class ShardLoader():
+
+    """
+    This class ingests several shards at once. The shards are independent, so each is decoded and validated by its
+    own worker process (see shard_chunks), while the chunks are merged into the database by the calling process in
+    the order they arrive - the dedup and the msid sets of the Extractor don't depend on the order of the shards.
+    With a single worker the shards are read in the calling process one after another.
+    """
+
+    def __init__(self, workers=None, chunk_lines=10000):
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_lines = chunk_lines
+
+    def run(self, tasks, consume):
+        """
+        :param tasks: the list of tuples (path, offset) of the shards to read
+        :param consume: a callable taking (path, inode, keyed, offset, done) for every chunk, in the calling process
+        :return: None
+        """
+        tasks = [(path, offset, self.chunk_lines) for (path, offset) in tasks]
+        if self.workers == 1 or len(tasks) == 1:
+            for task in tasks:
+                for chunk in shard_chunks(task):
+                    consume(*chunk)
+            return None
+        context = multiprocessing.get_context()
+        chunk_queue = context.Queue(maxsize=2 * self.workers)
+        stop = context.Event()
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=context, initializer=init_worker,
+                                 initargs=(chunk_queue, stop)) as pool:
+            futures = [pool.submit(stream_shard, task) for task in tasks]
+            try:
+                remaining = len(tasks)
+                while remaining:
+                    try:
+                        path, inode, keyed, offset, done = chunk_queue.get(timeout=1)
+                    except queue.Empty:
+                        if all(future.done() for future in futures) and chunk_queue.empty():
+                            logging.error("{} shards have not been finished by their workers".format(remaining))
+                            break
+                        continue
+                    if keyed is not None:
+                        consume(path, inode, keyed, offset, done)
+                    if done:
+                        remaining = remaining - 1
+            except BaseException:
+                # the workers would wait on the full queue forever and the pool for them on leaving the with block
+                self.__stop_workers__(futures, chunk_queue, stop)
+                raise
+        return None
+
+    def __stop_workers__(self, futures, chunk_queue, stop):
+        """
+        stops the workers after consume has failed - the shards not started are cancelled, the running ones stop
+        at their next chunk, and the chunks left in the queue are thrown away
+        :return: None
+        """
+        stop.set()
+        for future in futures:
+            future.cancel()
+        while not all(future.done() for future in futures):
+            try:
+                chunk_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        while True:
+            try:
+                chunk_queue.get_nowait()
+            except queue.Empty:
+                break
@@ -0,0 +1,142 @@
+import logging
+import os
+
+
+class FileTailer():
+
+    """
+    This class reads only the bytes that have been appended to a text file since the last read.
+    It remembers the byte offset (always at the start of a line) and the inode of the file it last reached
+    and keeps that checkpoint in the database, so that a restart resumes where the previous run stopped.
+    The following cases are handled:
+        1.a partially written trailing line is not consumed until its newline has been written
+        2.if the file got smaller than the checkpoint (truncation) it is read again from the start
+        3.if the path points to a different inode (rotation) the new file is read from the start
+    """
+
+    def __init__(self, path, db_conn, chunk_size=1 << 20):
+        self.path = os.path.abspath(path)
+        self.conn = db_conn
+        self.chunk_size = chunk_size
+        # byte offset right after the last line handed out and the inode it belongs to
+        self.offset = 0
+        self.inode = None
+        self.__create_checkpoint_table__()
+        self.__load_checkpoint__()
+
+    def __create_checkpoint_table__(self):
+        """
+        creates the table holding one checkpoint per tailed file if it doesn't exist yet
+        :return: None
+        """
+        cmd = "CREATE TABLE IF NOT EXISTS ingest_checkpoint " \
+              "(path TEXT PRIMARY KEY, " \
+              "inode INTEGER, " \
+              "offset INTEGER)"
+        self.conn.execute(cmd)
+        self.conn.commit()
+
+    def __load_checkpoint__(self):
+        """
+        restores the offset and inode saved by a previous run
+        :return: None
+        """
+        cmd = "SELECT inode, offset FROM ingest_checkpoint WHERE path=?"
+        row = self.conn.execute(cmd, (self.path,)).fetchone()
+        if row:
+            self.inode, self.offset = row
+            logging.info("resuming {0} from byte {1}".format(self.path, self.offset))
+
+    def save_checkpoint(self, commit=True):
+        """
+        persists the current offset and inode
+        :param commit: a flag to commit the transaction - set it to False to commit together with the data
+        :return: None
+        """
+        cmd = "INSERT OR REPLACE INTO ingest_checkpoint VALUES (?,?,?)"
+        self.conn.execute(cmd, (self.path, self.inode, self.offset))
+        if commit:
+            self.conn.commit()
+
+    def reset(self):
+        """
+        forgets the checkpoint so that the file is read again from the beginning
+        :return: None
+        """
+        self.offset = 0
+        self.inode = None
+        self.save_checkpoint()
+
+    def advance_to(self, offset, inode=None):
+        """
+        marks the file as read up to an offset reached by some other reader, e.g. the backfill
+        :param offset: the byte offset, it has to be at the start of a line
+        :param inode: the inode of the file the offset belongs to - defaults to the file currently at the path
+        :return: None
+        """
+        self.inode = inode if inode is not None else os.stat(self.path).st_ino
+        self.offset = offset
+
+    def __check_rotation__(self, stat):
+        """
+        starts over from the beginning if the file has been rotated or truncated since the last read
+        :param stat: the os.stat_result of the currently opened file
+        :return: None
+        """
+        if self.inode is not None and stat.st_ino != self.inode:
+            logging.warning("{} has been rotated, reading the new file from the start".format(self.path))
+            self.offset = 0
+        elif stat.st_size < self.offset:
+            logging.warning("{} has been truncated, reading it again from the start".format(self.path))
+            self.offset = 0
+        self.inode = stat.st_ino
+
+    def resume_offset(self):
+        """
+        stats the file and applies the rotation and truncation checks without reading it
+        :return: the offset to resume reading at, None if the file doesn't exist or has nothing new
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        self.__check_rotation__(stat)
+        return self.offset if stat.st_size > self.offset else None
+
+    def pending_bytes(self):
+        """
+        :return: the number of bytes in the file that have not been read yet
+        """
+        try:
+            return max(os.stat(self.path).st_size - self.offset, 0)
+        except FileNotFoundError:
+            return 0
+
+    def read_lines(self):
+        """
+        a generator over the complete lines appended since the last read. The offset is advanced while the lines
+        are consumed but it is only persisted by save_checkpoint
+        :return: yields tuples of (byte offset of the line, the decoded line without the newline)
+        """
+        try:
+            file = open(self.path, "rb")
+        except FileNotFoundError:
+            logging.warning("{} does not exist (yet)".format(self.path))
+            return
+        with file:
+            self.__check_rotation__(os.fstat(file.fileno()))
+            file.seek(self.offset)
+            position = self.offset
+            buffer = b""
+            while True:
+                chunk = file.read(self.chunk_size)
+                if not chunk:
+                    break
+                lines = (buffer + chunk).split(b"\n")
+                # the last piece is either empty or a line that is still being written
+                buffer = lines.pop()
+                for line in lines:
+                    start = position
+                    position = position + len(line) + 1
+                    self.offset = position
+                    yield start, line.decode("utf-8", errors="replace")
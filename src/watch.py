@@ -0,0 +1,156 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import time
+
+# the inotify flags used, see inotify(7)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+# the header of an inotify event: wd, mask, cookie, length of the name
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class PollingWatcher():
+
+    """
+    This class waits for a file to change by comparing its inode, size and modification time at intervals.
+    The interval starts at min_interval and doubles every time nothing has changed, up to max_interval, so a busy
+    file is noticed within milliseconds while a quiet one costs one stat call per max_interval. A change resets the
+    interval to min_interval.
+    """
+
+    def __init__(self, path, min_interval=0.01, max_interval=1.0):
+        self.path = path
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.signature = self.__signature__()
+
+    def __signature__(self):
+        try:
+            if os.path.isdir(self.path):
+                # a directory of shards changes when any of its files does
+                return tuple(sorted((entry.name, entry.inode(), entry.stat().st_size, entry.stat().st_mtime_ns)
+                                    for entry in os.scandir(self.path)))
+            stat = os.stat(self.path)
+            return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        except FileNotFoundError:
+            return None
+
+    def wait(self, timeout=None):
+        """
+        blocks until the file has changed since the last call or the timeout has passed
+        :param timeout: the maximum number of seconds to wait, None to wait for a change however long it takes
+        :return: True if the file has changed, False if the timeout passed first
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            signature = self.__signature__()
+            if signature != self.signature:
+                self.signature = signature
+                self.interval = self.min_interval
+                return True
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                time.sleep(min(self.interval, remaining))
+            else:
+                time.sleep(self.interval)
+            self.interval = min(self.interval * 2, self.max_interval)
+
+    def close(self):
+        return None
+
+
+class InotifyWatcher():
+
+    """
+    This class waits for a file to change with inotify, the kernel wakes it up as soon as the file is written to.
+    The directory of the file is watched rather than the file itself, so that a file created or moved into place
+    after a rotation is noticed as well. The events of other files in the directory are ignored, unless the path is
+    a directory itself - then a change of any of its files counts, e.g. of the shards of the input.
+    libc is called through ctypes, so this only works on linux - see make_watcher for the fallback.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        if os.path.isdir(self.path):
+            directory = self.path
+            self.name = None
+        else:
+            directory = os.path.dirname(self.path)
+            self.name = os.fsencode(os.path.basename(self.path))
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+        wd = libc.inotify_add_watch(self.fd, os.fsencode(directory), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, "inotify_add_watch failed for {}".format(directory))
+
+    def __drain__(self):
+        """
+        reads all pending events
+        :return: True if any of them concerns the watched file
+        """
+        changed = False
+        while True:
+            try:
+                buffer = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return changed
+            position = 0
+            while position < len(buffer):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(buffer, position)
+                name = buffer[position + EVENT_HEADER.size:position + EVENT_HEADER.size + length].rstrip(b"\0")
+                position = position + EVENT_HEADER.size + length
+                # after an overflow events got lost, the file may have changed
+                if self.name is None or name == self.name or mask & IN_Q_OVERFLOW:
+                    changed = True
+
+    def wait(self, timeout=None):
+        """
+        blocks until the file has changed since the last call or the timeout has passed
+        :param timeout: the maximum number of seconds to wait, None to wait for a change however long it takes
+        :return: True if the file has changed, False if the timeout passed first
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            readable, unused, unused = select.select([self.fd], [], [], remaining)
+            if readable and self.__drain__():
+                return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+
+    def close(self):
+        os.close(self.fd)
+
+
+def make_watcher(path, min_interval=0.01, max_interval=1.0):
+    """
+    :param path: the path of the file to watch, or of a directory to watch all of its files
+    :param min_interval: the shortest interval of the polling fallback
+    :param max_interval: the longest interval of the polling fallback
+    :return: an InotifyWatcher on linux, a PollingWatcher where inotify is not available
+    """
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(path)
+        except (OSError, AttributeError) as e:
+            logging.warning("inotify is not available ({}), falling back to polling".format(e))
+    return PollingWatcher(path, min_interval, max_interval)
@@ -0,0 +1,109 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from src.backfill import split_file, parse_range, parse_lines
+from src.dedup import ListenDeduplicator
+from src.generator import ListenGenerator
+from src.main import DataIngestor
+from src.reject import Rejected, read_quarantine
+
+class TestBackfillMethods(unittest.TestCase):
+
+    def setUp(self):
+        """
+        this method copies the test data and appends a line that is still being written
+        :return:
+        """
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "dataset.txt")
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_data", "test.txt"), "rb") as file:
+            self.data = file.read()
+        if not self.data.endswith(b"\n"):
+            self.data = self.data + b"\n"
+        with open(self.path, "wb") as file:
+            file.write(self.data + b'{"user_name":')
+
+    def test_split_file(self):
+        """
+        this function tests that the ranges cover the file without gaps and start at line boundaries
+        :return: None
+        """
+        ranges = split_file(self.path, 3)
+        assert(ranges[0][0] == 0 and ranges[-1][1] == os.path.getsize(self.path))
+        for (start, end), (next_start, next_end) in zip(ranges, ranges[1:]):
+            assert(end == next_start)
+            assert(self.data[next_start - 1:next_start] == b"\n")
+
+    def test_split_file_from_offset(self):
+        """
+        this function tests that the ranges start at the offset given and that nothing is left after the end
+        :return: None
+        """
+        start = self.data.index(b"\n") + 1
+        ranges = split_file(self.path, 3, start)
+        assert(ranges[0][0] == start and ranges[-1][1] == os.path.getsize(self.path))
+        assert(split_file(self.path, 3, os.path.getsize(self.path)) == [])
+
+    def test_parse_range(self):
+        """
+        this function tests that all complete lines are parsed and the partial one is left out
+        :return: None
+        """
+        n_lines = 0
+        offset = 0
+        for (start, end) in split_file(self.path, 3):
+            keyed, offset = parse_range((self.path, start, end))
+            n_lines = n_lines + len(keyed)
+        assert(n_lines == self.data.count(b"\n"))
+        assert(offset == len(self.data))
+
+    def test_rejected_lines_bypass_dedup(self):
+        """
+        this function tests that identical rejected lines are all passed on to be quarantined, not deduplicated
+        :return: None
+        """
+        conn = sqlite3.connect(":memory:")
+        keyed = parse_lines(['{"user_name": ', '{"user_name": "a"}'] * 2)
+        assert([fingerprint for (fingerprint, record) in keyed] == [None] * 4)
+        records = ListenDeduplicator(conn).filter_keyed(keyed)
+        assert(len(records) == 4 and all(type(record) is Rejected for record in records))
+        conn.close()
+
+    def test_second_backfill(self):
+        """
+        this function tests that a second backfill starts at the checkpoint, so it neither stores nor quarantines
+        anything again, and that it picks up the lines appended since
+        :return: None
+        """
+        path = os.path.join(self.dir.name, "listens.txt")
+        ListenGenerator(n_users=20, n_tracks=50, days=30).write(path, 500)
+        with open(path, "a") as file:
+            file.write('{"user_name": \n')
+        ingestor = DataIngestor(path, os.path.join(self.dir.name, "spotify"))
+        ingestor.__open_database__()
+        ingestor.backfill(workers=1)
+        n_listens = ingestor.conn.execute("SELECT count(*) FROM listeners").fetchone()[0]
+        assert(n_listens > 0)
+        assert(len(read_quarantine(ingestor.conn)) == 1)
+        ingestor.backfill(workers=1)
+        assert(ingestor.conn.execute("SELECT count(*) FROM listeners").fetchone()[0] == n_listens)
+        assert(len(read_quarantine(ingestor.conn)) == 1)
+        with open(path, "a") as file:
+            for line, kind in ListenGenerator(n_users=20, n_tracks=50, days=30, seed=7).lines(100):
+                file.write(line + "\n")
+        ingestor.backfill(workers=1)
+        assert(ingestor.conn.execute("SELECT count(*) FROM listeners").fetchone()[0] > n_listens)
+        assert(len(read_quarantine(ingestor.conn)) == 1)
+        ingestor.conn.close()
+
+    def tearDown(self):
+        """
+        this function removes the temporary files
+        :return:
+        """
+        self.dir.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
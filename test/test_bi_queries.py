@@ -0,0 +1,177 @@
+import contextlib
+import io
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from src.main import DataIngestor
+from src.generator import ListenGenerator
+from src.partition import list_partitions
+from src import bi_queries
+from src.cache import QueryCache
+from src.sketch import TOTAL_DAY
+
+class TestBiQueries(unittest.TestCase):
+
+    def setUp(self):
+        """
+        this method ingests the test data into a temporary database the way DataIngestor.main does
+        :return:
+        """
+        logging.disable(logging.WARNING)
+        self.dir = tempfile.TemporaryDirectory()
+        path = os.path.join(self.dir.name, "dataset.txt")
+        shutil.copy(os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_data", "test.txt"), path)
+        # the last line of the test data has no newline, the tailer would wait for it to be completed
+        with open(path, "a") as file:
+            file.write("\n")
+        self.ingestor = DataIngestor(path, os.path.join(self.dir.name, "spotify"), batch_size=3)
+        self.ingestor.__open_database__()
+        for new_json_list in self.ingestor.get_new_data():
+            self.ingestor.__write__(self.ingestor.extractor.get_rows_for_all_tables(new_json_list))
+        self.ingestor.__create_indexes__()
+        self.conn = self.ingestor.conn
+
+    def test_query_plans_use_indexes(self):
+        """
+        this function tests that every BI query is answered using the index it was designed for
+        :return: None
+        """
+        assert(bi_queries.check_query_plans(self.conn) == [])
+
+    def test_query_plans_over_partitions(self):
+        """
+        this function tests that on a database of several partitions every partition is read through its index
+        and that the merged partial results equal the answers from the summary tables
+        :return: None
+        """
+        path = os.path.join(self.dir.name, "months.txt")
+        ListenGenerator(n_users=50, n_tracks=200, days=90).write(path, 3000)
+        ingestor = DataIngestor(path, os.path.join(self.dir.name, "months"), batch_size=1000)
+        ingestor.__open_database__()
+        for new_json_list in ingestor.get_new_data():
+            ingestor.__write__(ingestor.__extract__(new_json_list))
+        ingestor.__create_indexes__()
+        conn = ingestor.conn
+        assert(list_partitions(conn) == [201901, 201902, 201903])
+        assert(bi_queries.check_query_plans(conn) == [])
+        with contextlib.redirect_stdout(io.StringIO()):
+            for query in (bi_queries.query1, bi_queries.query3):
+                rollup = query(conn).sort_values("user_name").reset_index(drop=True)
+                facts = query(conn, use_rollups=False).sort_values("user_name").reset_index(drop=True)
+                assert(rollup.equals(facts))
+        # the same from the view over all partitions
+        counts = "(select recording_id, count(*) as cnt from listeners group by recording_id)"
+        for cmd in (bi_queries.DWH_TRACKS_CMD, bi_queries.DWH_ARTISTS_CMD):
+            merged = conn.execute(bi_queries.over_partitions(conn, cmd, bi_queries.DWH_RECORDINGS_PARTIAL_CMD))
+            assert(merged.fetchall() == conn.execute(cmd.format(partials=counts)).fetchall())
+        users = conn.execute(bi_queries.over_partitions(conn, bi_queries.DWH_USERS_CMD,
+                                                        bi_queries.DWH_USERS_PARTIAL_CMD)).fetchone()[0]
+        assert(users == conn.execute("SELECT count(DISTINCT user_id) FROM listeners").fetchone()[0])
+        conn.close()
+
+    def test_rollups_match_facts(self):
+        """
+        this function tests that the answers from the summary tables equal the ones computed from the facts
+        :return: None
+        """
+        with contextlib.redirect_stdout(io.StringIO()):
+            for query in (bi_queries.query1, bi_queries.query3):
+                rollup = query(self.conn).sort_values("user_name").reset_index(drop=True)
+                facts = query(self.conn, use_rollups=False).sort_values("user_name").reset_index(drop=True)
+                assert(rollup.equals(facts))
+            for day in ("2019-04-14", "2019-04-15", "2019-04-16"):
+                assert(bi_queries.query2(self.conn, day).equals(bi_queries.query2(self.conn, day, use_rollups=False)))
+        assert(bi_queries.query2(self.conn, "2019-04-14", use_rollups=False).iloc[0, 0] == 2)
+
+    def test_report_matches_dwh(self):
+        """
+        this function tests that the daily report adds up to the metrics of the whole dataset
+        :return: None
+        """
+        self.ingestor.report.refresh()
+        with contextlib.redirect_stdout(io.StringIO()):
+            df = bi_queries.make_report(self.conn, "day")
+        listens = self.conn.execute("SELECT count(*) FROM listeners").fetchone()[0]
+        users = self.conn.execute(bi_queries.over_partitions(self.conn, bi_queries.DWH_USERS_CMD,
+                                                             bi_queries.DWH_USERS_PARTIAL_CMD)).fetchone()[0]
+        assert(df["listens"].sum() == listens)
+        assert(df["new_users"].sum() == users)
+
+    def test_cache(self):
+        """
+        this function tests that the cached results are served until a batch is written
+        :return: None
+        """
+        cache = QueryCache(self.conn)
+        with contextlib.redirect_stdout(io.StringIO()):
+            df = bi_queries.query1(self.conn, cache=cache)
+            assert(bi_queries.query1(self.conn, cache=cache) is df)
+            bi_queries.make_dwh(self.conn, cache=cache)
+            assert(cache.misses == 5)
+            self.ingestor.__write__(self.ingestor.extractor.get_rows_for_all_tables([]))
+            assert(bi_queries.query1(self.conn, cache=cache) is not df)
+
+    def test_approximate(self):
+        """
+        this function tests that the sketches give the exact answers on a dataset this small
+        :return: None
+        """
+        with contextlib.redirect_stdout(io.StringIO()):
+            for day in ("2019-04-14", "2019-04-15"):
+                assert(bi_queries.query2(self.conn, day, approximate=True).iloc[0, 0] ==
+                       bi_queries.query2(self.conn, day).iloc[0, 0])
+        users = bi_queries.read_distinct_users(self.conn, TOTAL_DAY, "distinct_users")
+        assert(users.equals(bi_queries.read_query(self.conn, bi_queries.over_partitions(
+            self.conn, bi_queries.DWH_USERS_CMD, bi_queries.DWH_USERS_PARTIAL_CMD))))
+        for sketch_cmd, exact_cmd in ((bi_queries.SKETCH_TRACKS_CMD, bi_queries.DWH_TRACKS_CMD),
+                                      (bi_queries.SKETCH_ARTISTS_CMD, bi_queries.DWH_ARTISTS_CMD)):
+            sketch = bi_queries.read_query(self.conn, sketch_cmd)
+            exact = bi_queries.read_query(self.conn, bi_queries.over_partitions(
+                self.conn, exact_cmd, bi_queries.DWH_RECORDINGS_PARTIAL_CMD))
+            assert(sorted(map(tuple, sketch.values)) == sorted(map(tuple, exact.values)))
+
+    def test_import_is_light(self):
+        """
+        this function tests that neither pandas nor numpy is imported until a data frame is asked for
+        :return: None
+        """
+        cmd = "import sys, src.bi_queries; print(sorted(set(('numpy', 'pandas')) & set(sys.modules)))"
+        root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+        out = subprocess.run([sys.executable, "-c", cmd], cwd=root, capture_output=True, text=True, check=True)
+        assert(out.stdout.strip() == "[]")
+
+    def test_command_line(self):
+        """
+        this function tests that the subcommands stream the same rows the data frames hold
+        :return: None
+        """
+        db_path = os.path.join(self.dir.name, "spotify.db")
+        for (argv, function) in ((["query1"], bi_queries.query1),
+                                 (["--facts", "--day", "2019-04-14", "query2"],
+                                  lambda conn: bi_queries.query2(conn, "2019-04-14", use_rollups=False)),
+                                 (["report"], bi_queries.make_report)):
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out):
+                bi_queries.main(["--db", db_path] + argv)
+                df = function(self.conn)
+            lines = out.getvalue().splitlines()
+            assert(lines[0].split("\t") == list(df.columns))
+            assert(lines[1:len(df) + 1] == ["\t".join("" if value is None else str(value) for value in row)
+                                            for row in df.astype(object).where(df.notna(), None).values])
+
+    def tearDown(self):
+        """
+        this function closes the database and removes the temporary files
+        :return:
+        """
+        logging.disable(logging.NOTSET)
+        self.conn.close()
+        self.dir.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
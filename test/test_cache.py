@@ -0,0 +1,87 @@
+import sqlite3
+import unittest
+from src.cache import IngestWatermark, QueryCache, read_watermark
+
+class TestQueryCacheMethods(unittest.TestCase):
+
+    def setUp(self):
+        """
+        this method sets up a table with a watermark, written through one connection and read through another
+        :return:
+        """
+        self.conn = sqlite3.connect("file:cache?mode=memory&cache=shared", uri=True)
+        self.conn.execute("CREATE TABLE listens (user_id INTEGER)")
+        self.watermark = IngestWatermark(self.conn)
+        self.reader = sqlite3.connect("file:cache?mode=memory&cache=shared", uri=True)
+        self.test_object = QueryCache(self.reader, max_entries=2)
+        self.computed = []
+
+    def __count__(self, user_id=None):
+        def compute():
+            self.computed.append(user_id)
+            cmd = "SELECT count(*) FROM listens" + ("" if user_id is None else " WHERE user_id = ?")
+            return self.reader.execute(cmd, () if user_id is None else (user_id,)).fetchone()[0]
+        return self.test_object.get("count", (user_id,), compute)
+
+    def __ingest__(self, user_id):
+        self.conn.execute("INSERT INTO listens VALUES (?)", (user_id,))
+        self.watermark.bump()
+        self.conn.commit()
+
+    def test_invalidation(self):
+        """
+        this function tests that results are reused until the watermark moves
+        :return: None
+        """
+        assert(read_watermark(sqlite3.connect(":memory:")) == 0)
+        self.__ingest__(1)
+        assert(self.__count__() == 1)
+        assert(self.__count__() == 1)
+        assert(self.computed == [None])
+        self.__ingest__(2)
+        assert(read_watermark(self.reader) == 2)
+        assert(self.__count__() == 2)
+        assert(self.computed == [None, None])
+        assert((self.test_object.hits, self.test_object.misses) == (1, 2))
+
+    def test_eviction(self):
+        """
+        this function tests that the least recently used result is evicted
+        :return: None
+        """
+        self.__count__(1)
+        self.__count__(2)
+        self.__count__(1)
+        self.__count__(3)
+        assert(list(self.test_object.entries) == [("count", (1,)), ("count", (3,))])
+        self.__count__(2)
+        assert(self.computed == [1, 2, 3, 2])
+
+    def test_hit_reads_no_table(self):
+        """
+        this function tests that a hit on unchanged data neither computes the result nor reads the watermark table
+        :return: None
+        """
+        self.__ingest__(1)
+        self.__count__()
+        marker = self.test_object.change_marker
+        statements = []
+        self.reader.set_trace_callback(statements.append)
+        for i in range(100):
+            self.__count__()
+        self.reader.set_trace_callback(None)
+        assert(self.computed == [None])
+        assert(self.test_object.change_marker == marker)
+        assert(set(statements) == {"PRAGMA data_version"})
+
+    def tearDown(self):
+        """
+        this function closes the database
+        :return:
+        """
+        self.reader.close()
+        self.conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import contextlib
+import io
+import json
+import logging
+import os
+import tempfile
+import unittest
+import numpy as np
+from src.main import DataIngestor
+from src.generator import ListenGenerator
+from src.columnar import ColumnarExport, LISTENER_COLUMNS
+from src.analytics import ListenAnalytics
+from src import bi_queries
+
+class TestColumnarAnalytics(unittest.TestCase):
+
+    def setUp(self):
+        """
+        this method ingests a generated dataset - with a batch of late listens at the end - exporting the columns
+        :return:
+        """
+        logging.disable(logging.ERROR)
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "dataset.txt")
+        self.columnar_dir = os.path.join(self.dir.name, "columns")
+        ListenGenerator(n_users=40, n_tracks=300, duplicate_rate=0.02, days=30,
+                        start=1551398400).write(self.path, 4000)
+        # listens of the first days arriving last
+        with open(self.path, "a") as file:
+            for line, kind in ListenGenerator(n_users=40, n_tracks=300, days=2, start=1551398400,
+                                              seed=1).lines(300):
+                file.write(line + "\n")
+        self.db_name = os.path.join(self.dir.name, "spotify")
+        self.ingestor = DataIngestor(self.path, self.db_name, batch_size=500, columnar_dir=self.columnar_dir)
+        self.ingestor.__open_database__()
+        for new_json_list in self.ingestor.get_new_data():
+            self.ingestor.__write__(self.ingestor.__extract__(new_json_list))
+        self.ingestor.__create_indexes__()
+        self.conn = self.ingestor.conn
+
+    def __check_same_answers__(self):
+        """
+        checks the answers from the columns against the ones from sql
+        :return: None
+        """
+        analytics = ListenAnalytics(self.columnar_dir, self.conn)
+        with contextlib.redirect_stdout(io.StringIO()):
+            assert(sorted(analytics.query1()["cnt"]) == sorted(bi_queries.query1(self.conn)["cnt"]))
+            for day in ("2019-03-01", "2019-03-02", "2019-03-15", "2019-05-01"):
+                assert(analytics.query2(day).equals(bi_queries.query2(self.conn, day)))
+            expected = bi_queries.query3(self.conn).sort_values("user_name").reset_index(drop=True)
+            assert(analytics.query3().sort_values("user_name").reset_index(drop=True).equals(expected))
+        distinct_users, tracks, artists = analytics.make_dwh()
+        assert(distinct_users.iloc[0, 0] == self.conn.execute(bi_queries.over_partitions(
+            self.conn, bi_queries.DWH_USERS_CMD, bi_queries.DWH_USERS_PARTIAL_CMD)).fetchone()[0])
+        for df, cmd in ((tracks, bi_queries.DWH_TRACKS_CMD), (artists, bi_queries.DWH_ARTISTS_CMD)):
+            cmd = bi_queries.over_partitions(self.conn, cmd, bi_queries.DWH_RECORDINGS_PARTIAL_CMD)
+            assert(list(df["times_listened"]) == [row[1] for row in self.conn.execute(cmd)])
+
+    def test_same_answers_as_sql(self):
+        """
+        this function tests that the analytics over the columns answer the same as the sql queries, with the late
+        listens in an unsorted tail as well as after they have been sorted in
+        :return: None
+        """
+        export = self.ingestor.columnar
+        assert(export.rows == self.conn.execute("SELECT count(*) FROM listeners").fetchone()[0])
+        assert(export.sorted_rows == export.rows - 300)
+        self.__check_same_answers__()
+        export.compact()
+        assert(export.sorted_rows == export.rows)
+        self.__check_same_answers__()
+
+    def test_rebuild(self):
+        """
+        this function tests that an export out of step with the database is rebuilt on startup
+        :return: None
+        """
+        with open(os.path.join(self.columnar_dir, "meta.json"), "w") as file:
+            json.dump({"rows": 10, "sorted_rows": 10, "last_listened_at": 0}, file)
+        assert(ColumnarExport(self.columnar_dir).sync(self.conn))
+        assert(not ColumnarExport(self.columnar_dir).sync(self.conn))
+        self.__check_same_answers__()
+
+    def test_retention(self):
+        """
+        this function tests that the listens dropped by the retention are trimmed off the export, which then needs
+        no rebuild
+        :return: None
+        """
+        with open(self.path, "a") as file:
+            for line, kind in ListenGenerator(n_users=40, n_tracks=300, days=5, start=1554076800,
+                                              seed=2).lines(500):
+                file.write(line + "\n")
+        for new_json_list in self.ingestor.get_new_data():
+            self.ingestor.__write__(self.ingestor.__extract__(new_json_list))
+        self.ingestor.retention_months = 1
+        self.ingestor.__apply_retention__()
+        export = self.ingestor.columnar
+        assert(export.rows == self.conn.execute("SELECT count(*) FROM listeners").fetchone()[0] > 0)
+        assert(export.sorted_rows == export.rows)
+        assert(not ColumnarExport(self.columnar_dir).sync(self.conn))
+        stored = self.conn.execute("SELECT user_id, recording_id, listened_at FROM listeners "
+                                   "ORDER BY listened_at, user_id, recording_id").fetchall()
+        columns = [np.fromfile(export.path(column), dtype) for (column, dtype) in LISTENER_COLUMNS]
+        assert(sorted(zip(*[values.tolist() for values in columns]), key=lambda row: (row[2], row[0], row[1]))
+               == stored)
+
+    def tearDown(self):
+        """
+        this function closes the database and removes the temporary files
+        :return:
+        """
+        logging.disable(logging.NOTSET)
+        self.conn.close()
+        self.dir.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import sqlite3
+import unittest
+from src.dedup import ListenDeduplicator, fingerprint_listen
+
+class TestListenDeduplicatorMethods(unittest.TestCase):
+
+    def setUp(self):
+        """
+        this method sets up a deduplicator with a tiny in-memory tier so that the database tier gets exercised
+        :return:
+        """
+        self.conn = sqlite3.connect(":memory:")
+        self.test_object = ListenDeduplicator(self.conn, cache_size=2)
+
+    def __listen__(self, user_name, listened_at, recording_msid="1e1b2aa0-b2db-42ed-a8ba-89c303499408"):
+        return {"user_name": user_name, "listened_at": listened_at,
+                "track_metadata": {"additional_info": {"recording_msid": recording_msid}}}
+
+    def test_filter_new(self):
+        """
+        this function tests that duplicates are rejected across batches and after eviction, while the copies of a
+        new listen within a batch are all passed on and accepted once
+        :return: None
+        """
+        batch = [self.__listen__("a", 1), self.__listen__("a", 1), self.__listen__("b", 1)]
+        assert(self.test_object.filter_new(batch) == batch)
+        assert(len(self.test_object.pending) == 2)
+        self.test_object.flush()
+        # push the first listens out of the in-memory tier
+        self.test_object.filter_new([self.__listen__("c", 2), self.__listen__("d", 3), self.__listen__("e", 4)])
+        self.test_object.flush()
+        assert(len(self.test_object.cache) == 2)
+        assert(self.test_object.filter_new([self.__listen__("a", 1), self.__listen__("a", 2)]) ==
+               [self.__listen__("a", 2)])
+
+    def test_discard_and_types(self):
+        """
+        this function tests that discarded listens are accepted again and that the types of the fields count
+        :return: None
+        """
+        assert(fingerprint_listen(self.__listen__("a", 1555286560)) !=
+               fingerprint_listen(self.__listen__("a", "1555286560")))
+        batch = [self.__listen__("a", 1), self.__listen__("b", 1), self.__listen__("c", 1)]
+        assert(self.test_object.filter_new(batch) == batch)
+        self.test_object.discard([0, 2])
+        self.test_object.flush()
+        assert(self.test_object.filter_new(batch) == [batch[0], batch[2]])
+
+    def test_discard_copy(self):
+        """
+        this function tests that a listen stays accepted if only one of its copies within the batch is discarded
+        :return: None
+        """
+        batch = [self.__listen__("a", 1), self.__listen__("a", 1), self.__listen__("b", 1), self.__listen__("b", 1)]
+        assert(self.test_object.filter_new(batch) == batch)
+        self.test_object.discard([0, 2, 3])
+        self.test_object.flush()
+        assert(self.test_object.filter_new(batch) == batch[2:])
+
+    def test_rollback(self):
+        """
+        this function tests that the listens of a batch rolled back are accepted again and those committed are not
+        :return: None
+        """
+        self.test_object.filter_new([self.__listen__("a", 1)])
+        self.test_object.flush()
+        batch = [self.__listen__("a", 1), self.__listen__("b", 1)]
+        assert(self.test_object.filter_new(batch) == batch[1:])
+        self.test_object.flush(commit=False)
+        self.conn.rollback()
+        self.test_object.rollback()
+        assert(self.test_object.filter_new(batch) == batch[1:])
+
+    def test_reset(self):
+        """
+        this function tests that a reset forgets all fingerprints
+        :return: None
+        """
+        self.test_object.filter_new([self.__listen__("a", 1)])
+        self.test_object.flush()
+        self.test_object.reset()
+        assert(len(self.test_object.filter_new([self.__listen__("a", 1)])) == 1)
+
+    def tearDown(self):
+        """
+        this function closes the database
+        :return:
+        """
+        self.conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import sqlite3
+import unittest
+from src.encode import KeyEncoder
+
+class TestKeyEncoderMethods(unittest.TestCase):
+
+    def setUp(self):
+        """
+        this method sets up an encoder over a users table holding one user already
+        :return:
+        """
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.execute("CREATE TABLE users (user_id INTEGER PRIMARY KEY, user_name TEXT UNIQUE)")
+        self.conn.execute("INSERT INTO users VALUES (7, 'batman')")
+        self.test_object = KeyEncoder(self.conn, "users", "user_id", "user_name", cache_size=1)
+
+    def test_encode_many(self):
+        """
+        this function tests that stored keys keep their id and new keys get the next ids, once per key
+        :return: None
+        """
+        ids, new_keys = self.test_object.encode_many(["batman", "robin", "robin", "joker"])
+        assert(ids == [7, 8, 8, 9])
+        assert(new_keys == [(8, "robin"), (9, "joker")])
+        self.conn.executemany("INSERT INTO users VALUES (?,?)", new_keys)
+        self.test_object.commit()
+        # robin has been evicted from the cache by now and is found in the table
+        ids, new_keys = self.test_object.encode_many(["robin", "alfred"])
+        assert(ids == [8, 10])
+
+    def test_cache_smaller_than_batch(self):
+        """
+        this function tests that a batch holding more stored keys than the cache does still get their ids
+        :return: None
+        """
+        self.conn.executemany("INSERT INTO users VALUES (?,?)", [(1, "a"), (2, "b"), (3, "c")])
+        test_object = KeyEncoder(self.conn, "users", "user_id", "user_name", cache_size=2)
+        ids, new_keys = test_object.encode_many(["batman", "a", "b", "c", "batman", "d"])
+        assert(ids == [7, 1, 2, 3, 7, 8])
+        assert(new_keys == [(8, "d")])
+
+    def test_rollback(self):
+        """
+        this function tests that the ids of a rolled back batch are handed out again
+        :return: None
+        """
+        ids, new_keys = self.test_object.encode_many(["robin"])
+        self.test_object.rollback()
+        ids, new_keys = self.test_object.encode_many(["joker"])
+        assert(ids == [8])
+
+    def tearDown(self):
+        """
+        this function closes the database
+        :return:
+        """
+        self.conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,8 @@
+import os
+import time
 import unittest
 from src.extract import Extractor
+from src.reject import INVALID_TIMESTAMP
 from json import JSONDecoder
 
 class TestExtractorMethods(unittest.TestCase):
@@ -11,7 +14,7 @@ class TestExtractorMethods(unittest.TestCase):
         """
         test_json_list = []
         dec = JSONDecoder()
-        with open("test_data\\test.txt") as file:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_data", "test.txt")) as file:
             for line in file:
                 test_json_list.append(dec.decode(line))
         self.test_object = Extractor(test_json_list)
@@ -26,6 +29,38 @@ class TestExtractorMethods(unittest.TestCase):
         assert(len(row["artist_data"])==4)
         assert(len(row["release_data"])==5)
 
+    def test_invalid_msid_rejected(self):
+        """
+        this function tests that a listen whose recording msid is invalid yields neither a recording nor a listener row
+        :return: None
+        """
+        ele = {"track_metadata": {"additional_info": {"release_msid": "34dbfc73-31e4-45c3-9d6e-04d8b6c5fd4a",
+                                                      "artist_msid": "f1d39567-27e7-40af-852a-abaed88ec838",
+                                                      "recording_msid": "not-an-msid"},
+                                  "artist_name": "Withered Hand", "track_name": "Mothercornflake",
+                                  "release_name": "Bad News"},
+               "listened_at": 1555286560, "user_name": "spiderman"}
+        row = Extractor().get_rows_for_all_tables([ele])
+        assert(len(row["artist_data"])==1)
+        assert(len(row["recording_data"])==0)
+        assert(len(row["listener_data"])==0)
+
+    def test_implausible_timestamp_rejected(self):
+        """
+        this function tests that a timestamp in milliseconds or in the future yields no listener row
+        :return: None
+        """
+        msid = "f1d39567-27e7-40af-852a-abaed88ec838"
+        listens = [{"track_metadata": {"additional_info": {"release_msid": msid, "artist_msid": msid,
+                                                           "recording_msid": msid},
+                                       "artist_name": "a", "track_name": "t", "release_name": "r"},
+                    "listened_at": listened_at, "user_name": "spiderman"}
+                   for listened_at in (1555286560000, int(time.time()) + 30 * 86400, -1, 1555286560)]
+        extractor = Extractor()
+        row = extractor.get_rows_for_all_tables(listens)
+        assert(row["listener_data"] == [("spiderman", msid, 1555286560)])
+        assert([(index, reason) for (index, reason, record) in extractor.rejected] ==
+               [(0, INVALID_TIMESTAMP), (1, INVALID_TIMESTAMP), (2, INVALID_TIMESTAMP)])
 
 
     def tearDown(self):
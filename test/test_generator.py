@@ -0,0 +1,69 @@
+import json
+import os
+import tempfile
+import unittest
+from collections import Counter
+from src.generator import ListenGenerator, CORRUPTION_KINDS
+from src.extract import Extractor
+
+class TestListenGeneratorMethods(unittest.TestCase):
+
+    def setUp(self):
+        """
+        this method sets up a generator with duplicates and every kind of corruption
+        :return:
+        """
+        self.test_object = ListenGenerator(n_users=50, n_tracks=200, duplicate_rate=0.05, corrupt_rate=0.05, seed=7)
+
+    def test_deterministic(self):
+        """
+        this function tests that the same arguments produce the same lines, and another seed different ones
+        :return: None
+        """
+        lines = list(self.test_object.lines(2000))
+        assert(lines == list(ListenGenerator(n_users=50, n_tracks=200, duplicate_rate=0.05, corrupt_rate=0.05,
+                                             seed=7).lines(2000)))
+        assert(lines != list(ListenGenerator(n_users=50, n_tracks=200, duplicate_rate=0.05, corrupt_rate=0.05,
+                                             seed=8).lines(2000)))
+
+    def test_kinds_of_lines(self):
+        """
+        this function tests that the duplicates repeat earlier lines, the valid listens are extracted and every
+        kind of corruption is rejected
+        :return: None
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "dataset.txt")
+            counts = self.test_object.write(path, 5000)
+            with open(path) as file:
+                lines = file.read().splitlines()
+        assert(sum(counts.values()) == len(lines) == 5000)
+        assert(set(counts) == set(CORRUPTION_KINDS) | {"listen", "duplicate"})
+
+        kinds = [kind for line, kind in self.test_object.lines(5000)]
+        seen = set()
+        listens = []
+        for line, kind in zip(lines, kinds):
+            if kind == "duplicate":
+                assert(line in seen)
+            elif kind == "truncated":
+                self.assertRaises(ValueError, json.loads, line)
+            else:
+                listens.append(json.loads(line))
+            seen.add(line)
+        rows = Extractor().get_rows_for_all_tables(listens)
+        assert(len(rows["listener_data"]) == counts["listen"])
+
+    def test_skew(self):
+        """
+        this function tests that the most popular user is far more active than the median one
+        :return: None
+        """
+        users = Counter(json.loads(line)["user_name"] for line, kind in self.test_object.lines(5000)
+                        if kind == "listen")
+        counts = sorted(users.values(), reverse=True)
+        assert(counts[0] > 5 * counts[len(counts) // 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import sqlite3
+import unittest
+import uuid
+from src.keystore import BloomFilter, KeyStore, compact_key
+
+class TestKeyStoreMethods(unittest.TestCase):
+
+    def setUp(self):
+        """
+        this method sets up a key store with a tiny cache over an artists table holding 1000 msids already
+        :return:
+        """
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.execute("CREATE TABLE artists (artist_id INTEGER PRIMARY KEY, artist_msid TEXT UNIQUE)")
+        self.stored = [str(uuid.UUID(int=i * 7919 + 1)) for i in range(1000)]
+        self.conn.executemany("INSERT INTO artists (artist_msid) VALUES (?)", ((msid,) for msid in self.stored))
+        self.test_object = KeyStore(self.conn, "artists", "artist_msid", cache_size=10)
+
+    def test_bloom_filter(self):
+        """
+        this function tests that the filter knows every key added and few others
+        :return: None
+        """
+        bloom = BloomFilter(10000, 0.01)
+        added = [compact_key(str(uuid.uuid4())) for i in range(10000)]
+        bloom.add_many(b"".join(added))
+        assert(bloom.contains_many(b"".join(added)).all())
+        others = [compact_key(str(uuid.uuid4())) for i in range(10000)]
+        assert(bloom.contains_many(b"".join(others)).sum() < 300)
+        assert(compact_key(self.stored[0]) == uuid.UUID(self.stored[0]).bytes)
+
+    def test_present(self):
+        """
+        this function tests that stored and added keys are found beyond the cache and rolled back keys are not
+        :return: None
+        """
+        new = [str(uuid.uuid4()) for i in range(3)]
+        assert(self.test_object.present(self.stored + new[:1] + [None]) == set(self.stored))
+        assert(len(self.test_object.cache) == 10)
+        self.test_object.add(new[0])
+        assert(self.test_object.present(new[:1]) == {new[0]})
+        self.conn.execute("INSERT INTO artists (artist_msid) VALUES (?)", (new[0],))
+        self.test_object.commit()
+        self.test_object.add(new[1])
+        self.test_object.rollback()
+        assert(self.test_object.present(new) == {new[0]})
+        assert(len(self.test_object) == 1001)
+
+    def test_bloom_filter_grows(self):
+        """
+        this function tests that the filter is rebuilt larger once it holds more keys than it was sized for
+        :return: None
+        """
+        self.test_object.present([])
+        capacity = self.test_object.bloom.capacity
+        new = [str(uuid.uuid4()) for i in range(capacity)]
+        for msid in new:
+            self.test_object.add(msid)
+        self.conn.executemany("INSERT INTO artists (artist_msid) VALUES (?)", ((msid,) for msid in new))
+        self.test_object.commit()
+        assert(self.test_object.bloom.capacity > capacity)
+        assert(self.test_object.present(new + self.stored[:5]) == set(new + self.stored[:5]))
+
+    def tearDown(self):
+        """
+        this function closes the database
+        :return:
+        """
+        self.conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+import urllib.request
+from src.metrics import MetricsRegistry, MetricsServer, MetricsFileWriter
+from src.main import DataIngestor
+from src.reject import REASONS
+
+class TestMetricsRegistryMethods(unittest.TestCase):
+
+    def setUp(self):
+        """
+        this method sets up a registry with a counter, a gauge and a histogram
+        :return:
+        """
+        self.test_object = MetricsRegistry()
+        self.test_object.inc("rows_total", 3, "the rows")
+        self.test_object.inc("rows_total", 2, "the rows")
+        self.test_object.set("lag_bytes", 42, "the lag")
+        for value in (0.002, 0.02, 2.0):
+            self.test_object.observe("stage_seconds", value, "the stages", stage="read")
+
+    def test_render(self):
+        """
+        this function tests the prometheus text format
+        :return: None
+        """
+        text = self.test_object.render()
+        assert("# TYPE rows_total counter\nrows_total 5\n" in text)
+        assert("# TYPE lag_bytes gauge\nlag_bytes 42\n" in text)
+        assert('stage_seconds_bucket{stage="read",le="0.001"} 0\n' in text)
+        assert('stage_seconds_bucket{stage="read",le="0.005"} 1\n' in text)
+        assert('stage_seconds_bucket{stage="read",le="0.05"} 2\n' in text)
+        assert('stage_seconds_bucket{stage="read",le="+Inf"} 3\n' in text)
+        assert('stage_seconds_count{stage="read"} 3\n' in text)
+
+    def test_exporters(self):
+        """
+        this function tests that the http endpoint and the file serve the same text
+        :return: None
+        """
+        server = MetricsServer(self.test_object, port=0).start()
+        try:
+            url = "http://127.0.0.1:{}/metrics".format(server.server.server_address[1])
+            with urllib.request.urlopen(url) as response:
+                assert(response.read().decode("utf-8") == self.test_object.render())
+        finally:
+            server.stop()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "ingest.prom")
+            writer = MetricsFileWriter(self.test_object, path, interval=60)
+            assert(writer.maybe_write())
+            assert(not writer.maybe_write())
+            with open(path) as file:
+                assert(file.read() == self.test_object.render())
+
+
+class TestIngestorMetrics(unittest.TestCase):
+
+    def test_ingestion_counters(self):
+        """
+        this function tests the counters and the stage timings of ingesting the test data
+        :return: None
+        """
+        logging.disable(logging.WARNING)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "dataset.txt")
+            shutil.copy(os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_data", "test.txt"), path)
+            with open(path, "a") as file:
+                file.write("\n")
+            ingestor = DataIngestor(path, os.path.join(tmp, "spotify"), batch_size=3)
+            ingestor.__open_database__()
+            for new_json_list in ingestor.get_new_data():
+                ingestor.__write__(ingestor.__extract__(new_json_list))
+            metrics = ingestor.metrics
+            listens = ingestor.conn.execute("SELECT count(*) FROM listeners").fetchone()[0]
+            assert(metrics.get("ingest_listens_total") == listens)
+            rejected = sum(metrics.get("ingest_rejected_total", reason=reason) or 0 for reason in REASONS)
+            assert(metrics.get("ingest_lines_read_total") == listens + metrics.get("ingest_duplicates_total")
+                   + rejected)
+            for stage in ("read", "decode", "dedup", "extract", "encode", "insert"):
+                assert(metrics.get("ingest_stage_seconds", stage=stage).count == metrics.get("ingest_batches_total"))
+            ingestor.conn.close()
+        logging.disable(logging.NOTSET)
+
+    def test_file_written_per_batch(self):
+        """
+        this function tests that the metrics file is written while the batches are committed, before the loop
+        has caught up with the file
+        :return: None
+        """
+        logging.disable(logging.WARNING)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "dataset.txt")
+            shutil.copy(os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_data", "test.txt"), path)
+            ingestor = DataIngestor(path, os.path.join(tmp, "spotify"), batch_size=3)
+            ingestor.__open_database__()
+            ingestor.metrics_writer = MetricsFileWriter(ingestor.metrics, os.path.join(tmp, "metrics.prom"), interval=0)
+            new_json_list = next(ingestor.get_new_data())
+            ingestor.__write__(ingestor.__extract__(new_json_list))
+            with open(os.path.join(tmp, "metrics.prom")) as file:
+                assert("ingest_batches_total 1" in file.read())
+            ingestor.conn.close()
+        logging.disable(logging.NOTSET)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import sqlite3
+import unittest
+from src.extract import Extractor
+from src.partition import PartitionManager, listeners_source, list_partitions, month_of
+from src.rollup import day_number
+
+class TestPartitionManagerMethods(unittest.TestCase):
+
+    def setUp(self):
+        """
+        this method creates an in-memory database with listens spread over four months
+        :return:
+        """
+        self.conn = sqlite3.connect(":memory:")
+        self.test_object = PartitionManager(self.conn, Extractor().get_schema_for_all_tables()[0])
+        self.rows = [(user, user, (day_number(iso) + user) * 86400, day_number(iso) + user)
+                     for iso in ("2019-01-10", "2019-02-10", "2019-03-10", "2019-04-10") for user in range(5)]
+        self.test_object.insert(self.rows)
+        self.conn.commit()
+
+    def __count__(self, source, day=None):
+        cmd = "SELECT count(*) FROM {} ".format(source) + ("WHERE day = ?" if day is not None else "")
+        return self.conn.execute(cmd, () if day is None else (day,)).fetchone()[0]
+
+    def test_insert_and_prune(self):
+        """
+        this function tests that the listens land in the partitions of their months and that a query over a range
+        only reads the partitions of the range
+        :return: None
+        """
+        assert(month_of(day_number("2019-02-28")) == 201902)
+        assert(list_partitions(self.conn) == [201901, 201902, 201903, 201904])
+        assert(self.__count__("listeners") == 20)
+        day = day_number("2019-02-12")
+        assert(listeners_source(self.conn, day, day) == "listeners_201902")
+        assert(self.__count__(listeners_source(self.conn, day, day), day) == 1)
+        source = listeners_source(self.conn, day_number("2019-02-20"), day_number("2019-03-05"))
+        assert("listeners_201901" not in source and "listeners_201904" not in source)
+        assert(self.__count__(source) == 10)
+        assert(self.__count__(listeners_source(self.conn, day_number("2020-01-01"))) == 0)
+
+    def test_indexes_and_retention(self):
+        """
+        this function tests that a partition created after the initial load is indexed right away and that the
+        retention drops whole partitions
+        :return: None
+        """
+        self.test_object.create_indexes()
+        self.test_object.insert([(1, 1, day_number("2019-05-01") * 86400, day_number("2019-05-01"))])
+        indexes = [row[0] for row in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' "
+                                                       "AND tbl_name = 'listeners_201905'")]
+        assert(len(indexes) == 3)
+        assert(self.test_object.retain(3) == [201901, 201902])
+        self.conn.commit()
+        assert(list_partitions(self.conn) == [201903, 201904, 201905])
+        assert(self.__count__("listeners") == 11)
+        # a partition created by a batch that is rolled back is forgotten
+        self.test_object.insert([(1, 1, day_number("2019-06-01") * 86400, day_number("2019-06-01"))])
+        self.conn.rollback()
+        self.test_object.rollback()
+        assert(self.test_object.months == [201903, 201904, 201905])
+        self.test_object.insert([(1, 1, day_number("2019-06-01") * 86400, day_number("2019-06-01"))])
+        assert(self.__count__("listeners") == 12)
+
+    def tearDown(self):
+        """
+        this function closes the database
+        :return:
+        """
+        self.conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
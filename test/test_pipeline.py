@@ -0,0 +1,85 @@
+import logging
+import os
+import sqlite3
+import tempfile
+import unittest
+from src.main import DataIngestor
+from src.pipeline import IngestPipeline
+from src.generator import ListenGenerator
+from src.reject import read_quarantine
+
+# the listens with their natural keys, independent of the ids handed out
+LISTENS_CMD = "SELECT user_name, recording_msid, listened_at FROM listeners " \
+              "JOIN users ON listeners.user_id = users.user_id " \
+              "JOIN recordings ON listeners.recording_id = recordings.recording_id " \
+              "ORDER BY 1, 2, 3"
+
+class TestIngestPipeline(unittest.TestCase):
+
+    def setUp(self):
+        """
+        this method generates a dataset with duplicates and invalid listens
+        :return:
+        """
+        logging.disable(logging.ERROR)
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "dataset.txt")
+        ListenGenerator(n_users=30, n_tracks=100, duplicate_rate=0.05, corrupt_rate=0.02,
+                        corrupt_kinds=("invalid_msid", "missing_field", "wrong_type")).write(self.path, 3000)
+
+    def __sequential__(self):
+        """
+        :return: the listens stored by the sequential loop and the reasons and offsets of the listens it quarantined
+        """
+        ingestor = DataIngestor(self.path, os.path.join(self.dir.name, "sequential"), batch_size=100)
+        ingestor.__open_database__()
+        for new_json_list in ingestor.get_new_data():
+            ingestor.__write__(ingestor.__extract__(new_json_list))
+        ingestor.rejects.flush()
+        listens = ingestor.conn.execute(LISTENS_CMD).fetchall()
+        quarantined = [row[0:3:2] for row in read_quarantine(ingestor.conn, limit=-1)]
+        ingestor.conn.close()
+        return listens, quarantined
+
+    def test_same_as_sequential(self):
+        """
+        this function tests that the pipeline stores the same listens as the sequential loop, in two runs the
+        second of which only picks up the appended lines
+        :return: None
+        """
+        expected, quarantined = self.__sequential__()
+        db_name = os.path.join(self.dir.name, "pipeline")
+        with open(self.path) as file:
+            lines = file.readlines()
+        with open(self.path, "w") as file:
+            file.writelines(lines[:1800])
+
+        ingestor = DataIngestor(self.path, db_name, batch_size=100)
+        pipeline = IngestPipeline(ingestor, queue_size=2)
+        pipeline.run(follow=False)
+        assert(pipeline.queue_depths() == {"parse": 0, "write": 0})
+        assert(ingestor.metrics.get("ingest_stage_seconds", stage="write").count == 18)
+        with open(self.path, "a") as file:
+            file.writelines(lines[1800:])
+        IngestPipeline(DataIngestor(self.path, db_name, batch_size=100), queue_size=2).run(follow=False)
+
+        conn = sqlite3.connect(db_name + ".db")
+        assert(conn.execute(LISTENS_CMD).fetchall() == expected)
+        # the listens rejected are quarantined with the offsets of their own lines
+        assert(len(quarantined) > 0)
+        assert(sorted(row[0:3:2] for row in read_quarantine(conn, limit=-1)) == sorted(quarantined))
+        offset = conn.execute("SELECT offset FROM ingest_checkpoint").fetchone()[0]
+        assert(offset == os.path.getsize(self.path))
+        conn.close()
+
+    def tearDown(self):
+        """
+        this function removes the temporary files
+        :return:
+        """
+        logging.disable(logging.NOTSET)
+        self.dir.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
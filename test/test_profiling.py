@@ -0,0 +1,92 @@
+import io
+import os
+import pstats
+import signal
+import tempfile
+import threading
+import unittest
+from src.profiling import profiled, PRINT_PROFILE
+
+class TestProfilingMethods(unittest.TestCase):
+
+    def setUp(self):
+        """
+        this method creates a temporary directory for the profiles
+        :return:
+        """
+        self.dir = tempfile.TemporaryDirectory()
+
+    def __work__(self):
+        return sorted(str(i) for i in range(20000))
+
+    def __thread_work__(self):
+        return sorted(str(i) for i in range(20000))
+
+    def test_profile(self):
+        """
+        this function tests that the profile is written to the file, or printed, also if the block raises
+        :return: None
+        """
+        path = os.path.join(self.dir.name, "ingest.prof")
+        with self.assertRaises(KeyboardInterrupt):
+            with profiled(path):
+                self.__work__()
+                raise KeyboardInterrupt()
+        stats = pstats.Stats(path)
+        assert(any(function[2] == "__work__" for function in stats.stats))
+        out = io.StringIO()
+        with profiled(PRINT_PROFILE, stream=out):
+            self.__work__()
+        assert("__work__" in out.getvalue())
+
+    def test_sigterm(self):
+        """
+        this function tests that a SIGTERM leaves the block with a SystemExit, so the profile is still written, and
+        that the previous handler is restored afterwards
+        :return: None
+        """
+        path = os.path.join(self.dir.name, "ingest.prof")
+        previous_handler = signal.getsignal(signal.SIGTERM)
+        with self.assertRaises(SystemExit):
+            with profiled(path):
+                self.__work__()
+                os.kill(os.getpid(), signal.SIGTERM)
+                self.__work__()
+        assert(any(function[2] == "__work__" for function in pstats.Stats(path).stats))
+        assert(signal.getsignal(signal.SIGTERM) == previous_handler)
+
+    def test_threads(self):
+        """
+        this function tests that the threads started within the block are profiled too
+        :return: None
+        """
+        out = io.StringIO()
+        with profiled(PRINT_PROFILE, stream=out):
+            thread = threading.Thread(target=self.__thread_work__)
+            thread.start()
+            thread.join()
+        assert("__thread_work__" in out.getvalue())
+
+    def test_trace_memory(self):
+        """
+        this function tests that the peak and the allocation sites are reported
+        :return: None
+        """
+        out = io.StringIO()
+        with profiled(trace_memory=True, top=3, stream=out):
+            work = self.__work__()
+        lines = out.getvalue().splitlines()
+        assert(lines[0].startswith("memory traced"))
+        assert(1 < len(lines) <= 4)
+        assert("test_profiling.py" in out.getvalue())
+
+    def tearDown(self):
+        """
+        this function removes the temporary directory
+        :return:
+        """
+        self.dir.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
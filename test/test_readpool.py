@@ -0,0 +1,71 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from src.readpool import ReadPool, ensure_wal
+
+class TestReadPoolMethods(unittest.TestCase):
+
+    def setUp(self):
+        """
+        this method creates a database in the rollback journal mode with a writer connection
+        :return:
+        """
+        self.dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.dir.name, "spotify.db")
+        self.writer = sqlite3.connect(self.db_path)
+        self.writer.execute("CREATE TABLE listens (user_id INTEGER)")
+        self.writer.execute("INSERT INTO listens VALUES (1)")
+        self.writer.commit()
+        self.test_object = ReadPool(self.db_path, size=2)
+
+    def __count__(self, conn):
+        return conn.execute("SELECT count(*) FROM listens").fetchone()[0]
+
+    def test_snapshot(self):
+        """
+        this function tests that a reader keeps its snapshot while the writer commits, without blocking it
+        :return: None
+        """
+        conn = sqlite3.connect(self.db_path)
+        assert(conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal")
+        conn.close()
+        with self.test_object.connection() as conn:
+            assert(self.__count__(conn) == 1)
+            self.writer.execute("INSERT INTO listens VALUES (2)")
+            self.writer.commit()
+            assert(self.__count__(conn) == 1)
+        assert(self.test_object.run(self.__count__) == 2)
+
+    def test_parallel_read_only(self):
+        """
+        this function tests that the queries run in parallel threads and can't write
+        :return: None
+        """
+        futures = [self.test_object.submit(self.__count__) for i in range(10)]
+        assert([future.result() for future in futures] == [1] * 10)
+        with self.test_object.connection() as conn:
+            self.assertRaises(sqlite3.OperationalError, conn.execute, "INSERT INTO listens VALUES (3)")
+
+    def test_missing_database(self):
+        """
+        this function tests that a wrong path raises instead of creating an empty database
+        :return: None
+        """
+        path = os.path.join(self.dir.name, "missing.db")
+        self.assertRaises(sqlite3.OperationalError, ensure_wal, path)
+        self.assertRaises(sqlite3.OperationalError, ReadPool, path)
+        assert(not os.path.exists(path))
+
+    def tearDown(self):
+        """
+        this function closes the database and removes the temporary files
+        :return:
+        """
+        self.test_object.close()
+        self.writer.close()
+        self.dir.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import unittest
+from src.main import DataIngestor
+from src.generator import ListenGenerator
+from src.reject import RejectStore, read_quarantine, MALFORMED_JSON, INVALID_MSID, UNKNOWN_RECORDING, INVALID_TIMESTAMP, REASONS
+
+class TestRejectStoreMethods(unittest.TestCase):
+
+    def setUp(self):
+        """
+        this method creates an in-memory database with the quarantine
+        :return:
+        """
+        self.conn = sqlite3.connect(":memory:")
+        self.test_object = RejectStore(self.conn, source="dataset.txt", log_interval=60)
+
+    def test_flush_and_summary(self):
+        """
+        this function tests that the rejections are written in batches and summarized in a single log line at most
+        every log_interval seconds
+        :return: None
+        """
+        self.test_object.add(MALFORMED_JSON, '{"user_name": ', 10)
+        self.test_object.add(INVALID_MSID, {"user_name": "a"}, 42)
+        assert(read_quarantine(self.conn) == [])
+        with self.assertLogs(level="WARNING") as logs:
+            self.test_object.last_log = 0
+            self.test_object.flush()
+            for i in range(100):
+                self.test_object.add(INVALID_MSID, "line", i)
+                self.test_object.flush()
+            logging.warning("the end")
+        assert(len(logs.output) == 2)
+        assert("1 malformed_json" in logs.output[0])
+        assert(read_quarantine(self.conn, MALFORMED_JSON) == [(MALFORMED_JSON, "dataset.txt", 10, '{"user_name": ')])
+        assert(read_quarantine(self.conn, INVALID_MSID, 1) == [(INVALID_MSID, "dataset.txt", 42, '{"user_name": "a"}')])
+        assert(self.test_object.counts[INVALID_MSID] == 101)
+
+    def test_corrupted_feed(self):
+        """
+        this function tests that every corrupted line of a feed is quarantined with the offset of its line while
+        the rest is ingested
+        :return: None
+        """
+        logging.disable(logging.ERROR)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "dataset.txt")
+            counts = ListenGenerator(n_users=30, n_tracks=100, corrupt_rate=0.1).write(path, 2000)
+            ingestor = DataIngestor(path, os.path.join(tmp, "spotify"), batch_size=100)
+            ingestor.__open_database__()
+            for new_json_list in ingestor.get_new_data():
+                ingestor.__write__(ingestor.__extract__(new_json_list))
+            ingestor.rejects.flush()
+            quarantined = read_quarantine(ingestor.conn, limit=10000)
+            assert(len(quarantined) == 2000 - counts["listen"])
+            assert(ingestor.conn.execute("SELECT count(*) FROM listeners").fetchone()[0] == counts["listen"])
+            assert(sum(ingestor.metrics.get("ingest_rejected_total", reason=reason) or 0 for reason in REASONS)
+                   == len(quarantined))
+            with open(path, "rb") as file:
+                data = file.read()
+            for (reason, source, offset, payload) in quarantined:
+                assert(source == path)
+                assert(data[offset:].split(b"\n")[0].decode() == payload or reason != MALFORMED_JSON)
+            ingestor.conn.close()
+        logging.disable(logging.NOTSET)
+
+    def test_rejected_copy(self):
+        """
+        this function tests that a listen rejected by the checks doesn't keep a valid copy of it in the same batch
+        from being stored, and that the listen is stored once however many valid copies follow
+        :return: None
+        """
+        logging.disable(logging.ERROR)
+        msid = "1e1b2aa0-b2db-42ed-a8ba-89c303499408"
+        valid = {"user_name": "a", "listened_at": 1555286560,
+                 "track_metadata": {"track_name": "t", "artist_name": "x", "release_name": "r",
+                                    "additional_info": {"recording_msid": msid, "artist_msid": msid,
+                                                        "release_msid": msid}}}
+        rejected = json.loads(json.dumps(valid))
+        del rejected["track_metadata"]["track_name"]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "dataset.txt")
+            with open(path, "w") as file:
+                file.write(json.dumps(rejected) + "\n" + json.dumps(valid) + "\n" + json.dumps(valid) + "\n")
+            ingestor = DataIngestor(path, os.path.join(tmp, "spotify"))
+            ingestor.__open_database__()
+            for new_json_list in ingestor.get_new_data():
+                ingestor.__write__(ingestor.__extract__(new_json_list))
+            assert(ingestor.conn.execute("SELECT count(*) FROM listeners").fetchone()[0] == 1)
+            assert([row[0] for row in read_quarantine(ingestor.conn)] == [UNKNOWN_RECORDING])
+            ingestor.conn.close()
+        logging.disable(logging.NOTSET)
+
+    def test_implausible_timestamps(self):
+        """
+        this function tests that listens stamped in milliseconds or in the future are quarantined and neither stop
+        the ingestion nor move the retention window past the real listens
+        :return: None
+        """
+        logging.disable(logging.ERROR)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "dataset.txt")
+            counts = ListenGenerator(n_users=30, n_tracks=100, days=120).write(path, 1000)
+            with open(path) as file:
+                listen = json.loads(file.readline())
+            with open(path, "a") as file:
+                for listened_at in (1555286560000, 1900000000):
+                    listen["listened_at"] = listened_at
+                    file.write(json.dumps(listen) + "\n")
+            ingestor = DataIngestor(path, os.path.join(tmp, "spotify"), batch_size=300, retention_months=6)
+            ingestor.__open_database__()
+            for new_json_list in ingestor.get_new_data():
+                ingestor.__write__(ingestor.__extract__(new_json_list))
+            ingestor.__apply_retention__()
+            assert(ingestor.conn.execute("SELECT count(*) FROM listeners").fetchone()[0] == counts["listen"])
+            assert([row[0] for row in read_quarantine(ingestor.conn)] == [INVALID_TIMESTAMP] * 2)
+            assert(ingestor.extractor.expired_before is None)
+            ingestor.conn.close()
+        logging.disable(logging.NOTSET)
+
+    def test_failed_batch_rolled_back(self):
+        """
+        this function tests that a batch failing with an exception other than a database error is rolled back
+        :return: None
+        """
+        logging.disable(logging.ERROR)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "dataset.txt")
+            ListenGenerator(n_users=30, n_tracks=100).write(path, 100)
+            ingestor = DataIngestor(path, os.path.join(tmp, "spotify"), batch_size=100)
+            ingestor.__open_database__()
+            new_data = ingestor.__extract__(next(ingestor.get_new_data()))
+
+            def fail(rows):
+                raise OverflowError("date value out of range")
+
+            apply = ingestor.rollups.apply
+            ingestor.rollups.apply = fail
+            with self.assertRaises(OverflowError):
+                ingestor.__write__(new_data)
+            assert(not ingestor.conn.in_transaction)
+            assert(ingestor.deduplicator.pending == [])
+            assert(ingestor.conn.execute("SELECT count(*) FROM listeners").fetchone()[0] == 0)
+            ingestor.rollups.apply = apply
+            ingestor.conn.close()
+        logging.disable(logging.NOTSET)
+
+    def tearDown(self):
+        """
+        this function closes the database
+        :return:
+        """
+        self.conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+import json
+import logging
+import os
+import random
+import sqlite3
+import tempfile
+import unittest
+from src.generator import ListenGenerator
+from src.main import DataIngestor
+from src.partition import list_partitions
+from src.reject import read_quarantine, EXPIRED
+from src.rollup import RollupMaintainer, day_number
+from src.report import ReportEngine, read_report, period_start, first_period_from
+
+class TestReportEngineMethods(unittest.TestCase):
+
+    def setUp(self):
+        """
+        this method sets up plain listeners and recordings tables with the summaries and the report around them
+        :return:
+        """
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.execute("CREATE TABLE listeners (user_id INTEGER, recording_id INTEGER, listened_at INTEGER, "
+                          "day INTEGER)")
+        self.conn.execute("CREATE TABLE recordings (recording_id INTEGER PRIMARY KEY, artist_id INTEGER, "
+                          "track_name TEXT)")
+        self.conn.execute("CREATE TABLE artists (artist_id INTEGER PRIMARY KEY, artist_name TEXT)")
+        self.conn.executemany("INSERT INTO recordings VALUES (?,?,?)",
+                              [(i, i % 7, "track {}".format(i)) for i in range(50)])
+        self.conn.executemany("INSERT INTO artists VALUES (?,?)", [(i, "artist {}".format(i)) for i in range(7)])
+        self.rollups = RollupMaintainer(self.conn)
+        self.test_object = ReportEngine(self.conn)
+        self.rnd = random.Random(1)
+
+    def __ingest__(self, first_day, n_days, n_rows=300):
+        """
+        inserts a batch of random listens the way the ingestor does
+        :return: None
+        """
+        start = day_number(first_day) * 86400
+        rows = [(self.rnd.randrange(30), self.rnd.randrange(50), start + self.rnd.randrange(n_days * 86400))
+                for i in range(n_rows)]
+        rows = [row + (row[2] // 86400,) for row in rows]
+        self.conn.executemany("INSERT INTO listeners VALUES (?,?,?,?)", rows)
+        self.rollups.apply(rows)
+        self.test_object.mark_dirty(rows)
+        self.conn.commit()
+
+    def __expected__(self, grain):
+        """
+        computes the listens, active users and new users of every period straight from the listeners table
+        :return: the list of tuples (period_start, listens, active_users, new_users)
+        """
+        firsts = dict(self.conn.execute("SELECT user_id, min(day) FROM listeners GROUP BY user_id"))
+        periods = {}
+        for (user_id, day) in self.conn.execute("SELECT user_id, day FROM listeners"):
+            start = period_start(grain, day)
+            period = periods.setdefault(start, [0, set(), set()])
+            period[0] += 1
+            period[1].add(user_id)
+            if firsts[user_id] == day:
+                period[2].add(user_id)
+        return [(start, p[0], len(p[1]), len(p[2])) for (start, p) in sorted(periods.items())]
+
+    def __actual__(self, grain):
+        return self.conn.execute("SELECT period_start, listens, active_users, new_users FROM report_metrics "
+                                 "WHERE grain = ? ORDER BY period_start", (grain,)).fetchall()
+
+    def test_period_start(self):
+        """
+        this function tests the first days of the periods
+        :return: None
+        """
+        day = day_number("2019-03-14")
+        assert(period_start("day", day) == day)
+        # 2019-03-14 was a thursday
+        assert(period_start("week", day) == day_number("2019-03-11"))
+        assert(period_start("month", day) == day_number("2019-03-01"))
+        assert(first_period_from("week", day) == day_number("2019-03-18"))
+        assert(first_period_from("month", day_number("2019-03-01")) == day_number("2019-03-01"))
+
+    def test_incremental_refresh(self):
+        """
+        this function tests that refreshing after every batch yields the same report as computing it from scratch,
+        also when a batch reaches back into a period that was materialized already
+        :return: None
+        """
+        self.__ingest__("2019-01-01", 60)
+        assert(self.test_object.refresh() == day_number("2019-01-01") - 1)
+        # nothing new, nothing recomputed
+        assert(self.test_object.refresh() is None)
+        # only the trailing periods are recomputed
+        self.__ingest__("2019-03-02", 5)
+        assert(self.test_object.refresh() == day_number("2019-02-25"))
+        # late listens reach back into january
+        self.__ingest__("2019-01-20", 2, 20)
+        self.test_object.refresh()
+        for grain in ("day", "week", "month"):
+            assert(self.__actual__(grain) == self.__expected__(grain))
+
+        top = self.conn.execute("SELECT artist_id, count(*) FROM listeners JOIN recordings USING (recording_id) "
+                                "WHERE day >= ? GROUP BY artist_id ORDER BY 2 DESC LIMIT 1",
+                                (day_number("2019-03-01"),)).fetchone()
+        report = read_report(self.conn, "month")
+        assert([row[0] for row in report] == ["2019-01-01", "2019-02-01", "2019-03-01"])
+        assert(report[-1][5] == "artist {}".format(top[0]))
+
+    def test_retention_floor(self):
+        """
+        this function tests that the report keeps the periods whose listens the retention dropped, and that a late
+        listen of a dropped month is quarantined instead of bringing back its partition
+        :return: None
+        """
+        logging.disable(logging.ERROR)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "dataset.txt")
+            ListenGenerator(n_users=30, n_tracks=100, days=120).write(path, 2000)
+            ingestor = DataIngestor(path, os.path.join(tmp, "spotify"), batch_size=500, retention_months=2)
+            ingestor.__open_database__()
+
+            def cycle():
+                for new_json_list in ingestor.get_new_data():
+                    ingestor.__write__(ingestor.__extract__(new_json_list))
+                ingestor.rejects.flush(commit=False)
+                ingestor.tailer.save_checkpoint()
+                ingestor.__refresh_report__()
+                ingestor.__apply_retention__()
+
+            cycle()
+            assert(list_partitions(ingestor.conn) == [201903, 201904])
+            reports = dict((grain, read_report(ingestor.conn, grain)) for grain in ("day", "week", "month"))
+            with open(path) as file:
+                late = json.loads(file.readline())
+            late["user_name"] = "late user"
+            with open(path, "a") as file:
+                file.write(json.dumps(late) + "\n")
+            cycle()
+            assert(list_partitions(ingestor.conn) == [201903, 201904])
+            assert([row[0] for row in read_quarantine(ingestor.conn)] == [EXPIRED])
+            for grain, report in reports.items():
+                assert(read_report(ingestor.conn, grain) == report)
+            assert(read_report(ingestor.conn, "month")[0][0] == "2019-01-01")
+            # a late listen after the floor is still reported
+            late["listened_at"] = day_number("2019-03-02") * 86400
+            with open(path, "a") as file:
+                file.write(json.dumps(late) + "\n")
+            cycle()
+            march = dict((row[0], row) for row in read_report(ingestor.conn, "month"))["2019-03-01"]
+            assert(march[1] == dict((row[0], row) for row in reports["month"])["2019-03-01"][1] + 1)
+            ingestor.conn.close()
+        logging.disable(logging.NOTSET)
+
+    def tearDown(self):
+        """
+        this function closes the database
+        :return:
+        """
+        self.conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import random
+import sqlite3
+import unittest
+from src.rollup import RollupMaintainer, day_number
+
+class TestRollupMaintainerMethods(unittest.TestCase):
+
+    def setUp(self):
+        """
+        this method sets up the summary tables next to a plain listeners table holding the same listens
+        :return:
+        """
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.execute("CREATE TABLE listeners (user_id INTEGER, recording_id INTEGER, listened_at INTEGER, "
+                          "day INTEGER)")
+        self.test_object = RollupMaintainer(self.conn)
+        rnd = random.Random(1)
+        for batch in range(5):
+            rows = [(rnd.randrange(20), rnd.randrange(50), 1551398400 + rnd.randrange(3 * 86400))
+                    for i in range(200)]
+            rows = [row + (row[2] // 86400,) for row in rows]
+            self.conn.executemany("INSERT INTO listeners VALUES (?,?,?,?)", rows)
+            self.test_object.apply(rows)
+        self.conn.commit()
+
+    def test_user_stats(self):
+        """
+        this function tests the listen counts and first listens against the listeners table
+        :return: None
+        """
+        expected = self.conn.execute("SELECT user_id, count(*), min(listened_at) FROM listeners "
+                                     "GROUP BY user_id ORDER BY user_id").fetchall()
+        actual = self.conn.execute("SELECT user_id, listen_count, first_listened_at FROM user_stats "
+                                   "ORDER BY user_id").fetchall()
+        assert(actual == expected)
+        for (user_id, recording_id, first_listened_at) in self.conn.execute(
+                "SELECT user_id, first_recording_id, first_listened_at FROM user_stats"):
+            assert(self.conn.execute("SELECT count(*) FROM listeners WHERE user_id=? AND recording_id=? "
+                                     "AND listened_at=?", (user_id, recording_id, first_listened_at)).fetchone()[0])
+
+    def test_daily_active_users(self):
+        """
+        this function tests the distinct users per day against the listeners table
+        :return: None
+        """
+        expected = self.conn.execute("SELECT listened_at / 86400, count(DISTINCT user_id) FROM listeners "
+                                     "GROUP BY 1 ORDER BY 1").fetchall()
+        actual = self.conn.execute("SELECT day, active_users FROM daily_active_users ORDER BY day").fetchall()
+        assert(actual == expected)
+        assert(expected[0][0] == day_number("2019-03-01"))
+
+    def tearDown(self):
+        """
+        this function closes the database
+        :return:
+        """
+        self.conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
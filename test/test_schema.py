@@ -0,0 +1,81 @@
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from src.main import DataIngestor
+from src.schema import SchemaManager, SCHEMA_VERSION
+
+class TestResumableStartup(unittest.TestCase):
+
+    def setUp(self):
+        """
+        this method copies the test data into a temporary directory which also holds the database
+        :return:
+        """
+        logging.disable(logging.WARNING)
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "dataset.txt")
+        self.db_name = os.path.join(self.dir.name, "spotify")
+        shutil.copy(os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_data", "test.txt"), self.path)
+        # the last line of the test data has no newline, the tailer would wait for it to be completed
+        with open(self.path, "a") as file:
+            file.write("\n")
+
+    def __ingest__(self):
+        """
+        opens the database the way DataIngestor.main does and ingests everything new in the file
+        :return: the ingestor
+        """
+        ingestor = DataIngestor(self.path, self.db_name)
+        ingestor.__open_database__()
+        for new_json_list in ingestor.get_new_data():
+            ingestor.__write__(ingestor.extractor.get_rows_for_all_tables(new_json_list))
+        ingestor.tailer.save_checkpoint()
+        return ingestor
+
+    def test_restart_resumes(self):
+        """
+        this function tests that a restart keeps the rows, reads only the new lines and restores the msids
+        :return: None
+        """
+        self.__ingest__().conn.close()
+        with open(self.path) as file:
+            first_line = file.readline()
+        with open(self.path, "a") as file:
+            # a duplicate of an ingested listen and a new listen of a known recording
+            file.write(first_line)
+            file.write(first_line.replace("1555286560", "1555286561"))
+        ingestor = self.__ingest__()
+        assert(SchemaManager(ingestor.conn).get_version() == SCHEMA_VERSION)
+        assert(ingestor.conn.execute("SELECT count(*) FROM listeners").fetchone()[0] == 8)
+        assert(ingestor.conn.execute("SELECT count(*) FROM artists").fetchone()[0] == 4)
+        assert(len(ingestor.extractor.set_of_recording_msids) == 6)
+        ingestor.conn.close()
+
+    def test_outdated_schema_is_rebuilt(self):
+        """
+        this function tests that a database written before versions were recorded is wiped and re-ingested
+        :return: None
+        """
+        conn = sqlite3.connect(self.db_name + ".db")
+        conn.execute("CREATE TABLE listeners (user_name TEXT)")
+        conn.execute("INSERT INTO listeners VALUES ('stale')")
+        conn.commit()
+        conn.close()
+        ingestor = self.__ingest__()
+        assert(ingestor.conn.execute("SELECT count(*) FROM listeners").fetchone()[0] == 7)
+        ingestor.conn.close()
+
+    def tearDown(self):
+        """
+        this function removes the temporary files
+        :return:
+        """
+        logging.disable(logging.NOTSET)
+        self.dir.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import random
+import sqlite3
+import unittest
+import numpy as np
+from src.sessions import SessionMaintainer, sessionize, TRACK_SECONDS
+from src.report import ReportEngine, read_report
+from src.rollup import RollupMaintainer
+
+class TestSessionMethods(unittest.TestCase):
+
+    def setUp(self):
+        """
+        this method creates an in-memory database with plain listeners and recordings tables and random listens
+        :return:
+        """
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.execute("CREATE TABLE listeners (user_id INTEGER, recording_id INTEGER, listened_at INTEGER, "
+                          "day INTEGER)")
+        self.conn.execute("CREATE TABLE recordings (recording_id INTEGER PRIMARY KEY, artist_id INTEGER, "
+                          "track_name TEXT)")
+        self.conn.execute("CREATE TABLE artists (artist_id INTEGER PRIMARY KEY, artist_name TEXT)")
+        self.conn.execute("INSERT INTO recordings VALUES (1, 1, 'track')")
+        self.conn.execute("INSERT INTO artists VALUES (1, 'artist')")
+        rnd = random.Random(3)
+        start = 1555286400
+        self.rows = [(user, 1, start + rnd.randrange(3 * 86400)) for user in range(5) for i in range(200)]
+        self.rows = [row + (row[2] // 86400,) for row in self.rows]
+        rnd.shuffle(self.rows)
+
+    def __expected__(self, gap):
+        """
+        computes the sessions from all listens at once
+        :return: the sorted list of tuples (user_id, started_at, ended_at, listens)
+        """
+        sessions = []
+        for (user_id, recording_id, listened_at, day) in sorted(self.rows):
+            last = sessions[-1] if sessions else None
+            if last is not None and last[0] == user_id and listened_at - last[2] <= gap:
+                last[2] = listened_at
+                last[3] += 1
+            else:
+                sessions.append([user_id, listened_at, listened_at, 1])
+        return [tuple(session) for session in sessions]
+
+    def __actual__(self):
+        return self.conn.execute("SELECT user_id, started_at, ended_at, listens FROM sessions "
+                                 "ORDER BY user_id, started_at").fetchall()
+
+    def test_sessionize(self):
+        """
+        this function tests that intervals closer than the gap are merged per user only
+        :return: None
+        """
+        users = np.array([2, 1, 1, 1, 2])
+        starts = np.array([100, 0, 50, 500, 10])
+        ends = np.array([120, 10, 60, 600, 10])
+        (order, group), sessions = sessionize(users, starts, ends, np.ones(5, dtype=np.int64), 40)
+        assert([array.tolist() for array in sessions] == [[1, 1, 2, 2], [0, 500, 10, 100], [60, 600, 10, 120],
+                                                          [2, 1, 1, 1]])
+        assert(group.tolist() == [0, 0, 1, 2, 3])
+
+    def test_batches_out_of_order(self):
+        """
+        this function tests that the sessions of shuffled batches are those of all listens at once
+        :return: None
+        """
+        test_object = SessionMaintainer(self.conn, gap=1800)
+        for i in range(0, len(self.rows), 97):
+            test_object.apply(self.rows[i:i + 97])
+        assert(self.__actual__() == self.__expected__(1800))
+
+    def test_rebuild_and_report(self):
+        """
+        this function tests that the sessions are built from the listens stored before and reported per period
+        :return: None
+        """
+        self.conn.executemany("INSERT INTO listeners VALUES (?,?,?,?)", self.rows)
+        RollupMaintainer(self.conn).apply(self.rows)
+        ReportEngine(self.conn).refresh()
+        SessionMaintainer(self.conn, gap=600)
+        expected = self.__expected__(600)
+        assert(self.__actual__() == expected)
+        # the report materialized without sessions is recomputed with them
+        ReportEngine(self.conn).refresh()
+        report = read_report(self.conn, "month")
+        seconds = sum(ended_at - started_at + TRACK_SECONDS for (user_id, started_at, ended_at, n) in expected)
+        assert(report[0][6] == round(len(expected) / 5, 2))
+        assert(report[0][7] == round(seconds / 3600, 1))
+
+    def tearDown(self):
+        """
+        this function closes the database
+        :return:
+        """
+        self.conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+import numpy as np
+from src.main import DataIngestor
+from src.sketch import HyperLogLog, SketchMaintainer, merge_top, approx_distinct_users, hll_precision, TOTAL_DAY
+
+class TestSketchMethods(unittest.TestCase):
+
+    def setUp(self):
+        """
+        this method creates an in-memory database with the tables the sketches are built from
+        :return:
+        """
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.execute("CREATE TABLE listeners (user_id INTEGER, recording_id INTEGER, listened_at INTEGER, "
+                          "day INTEGER)")
+        self.conn.execute("CREATE TABLE recordings (recording_id INTEGER PRIMARY KEY, artist_id INTEGER)")
+        self.conn.executemany("INSERT INTO recordings VALUES (?,?)", ((i, i % 10) for i in range(100)))
+        self.conn.commit()
+
+    def test_hyperloglog(self):
+        """
+        this function tests that the estimates are within the error bound and that merging gives the union
+        :return: None
+        """
+        for n in (10, 1000, 200000):
+            hll = HyperLogLog(12)
+            hll.add(np.arange(n))
+            hll.add(np.arange(n))
+            assert(abs(hll.count() - n) <= max(3 * 0.0163 * n, 1))
+        left = HyperLogLog(12)
+        left.add(np.arange(0, 60000))
+        right = HyperLogLog.from_bytes(HyperLogLog(12).to_bytes())
+        right.add(np.arange(40000, 100000))
+        left.merge(right)
+        assert(abs(left.count() - 100000) <= 3 * 0.0163 * 100000)
+
+    def test_merge_top(self):
+        """
+        this function tests that the heavy hitters of a skewed stream are found with counts within their error
+        :return: None
+        """
+        rnd = np.random.RandomState(0)
+        weights = 1.0 / np.arange(1, 1001) ** 1.2
+        stream = rnd.choice(1000, size=100000, p=weights / weights.sum())
+        summary = {}
+        for batch in np.array_split(stream, 50):
+            items, counts = np.unique(batch, return_counts=True)
+            summary = merge_top(summary, dict(zip(items.tolist(), counts.tolist())), 50)
+        exact = np.bincount(stream, minlength=1000)
+        top = sorted(summary, key=lambda item: -summary[item][0])[:5]
+        assert(top == np.argsort(-exact)[:5].tolist())
+        for item, (count, error) in summary.items():
+            assert(count - error <= exact[item] <= count)
+            assert(error <= len(stream) / 50)
+
+    def test_maintainer(self):
+        """
+        this function tests that the sketches of a batch are exact for small counts and are rebuilt for listens
+        stored before the sketches existed
+        :return: None
+        """
+        rows = [(user, user % 7, 86400 * day, day) for day in range(3) for user in range(day * 5, day * 5 + 20)]
+        self.conn.executemany("INSERT INTO listeners VALUES (?,?,?,?)", rows[:30])
+        test_object = SketchMaintainer(self.conn)
+        test_object.apply(rows[30:])
+        self.conn.commit()
+        assert(approx_distinct_users(self.conn, TOTAL_DAY) == 30)
+        assert(approx_distinct_users(self.conn, 1) == 20)
+        assert(approx_distinct_users(self.conn, 5) == 0)
+        tracks = dict(self.conn.execute("SELECT item_id, listens FROM sketch_topk WHERE kind = 'track'"))
+        assert(tracks == {i: sum(1 for row in rows if row[1] == i) for i in range(7)})
+        assert(SketchMaintainer(self.conn).precision == test_object.precision)
+
+    def test_total_apart_from_days(self):
+        """
+        this function tests that the sketch of all days doesn't share its key with any day bucket, not even the
+        day before 1970-01-01
+        :return: None
+        """
+        test_object = SketchMaintainer(self.conn)
+        test_object.apply([(user, 0, -86400, -1) for user in range(10)] + [(user, 0, 0, 0) for user in range(5, 25)])
+        self.conn.commit()
+        assert(approx_distinct_users(self.conn, -1) == 10)
+        assert(approx_distinct_users(self.conn, 0) == 20)
+        assert(approx_distinct_users(self.conn, TOTAL_DAY) == 25)
+
+    def test_error_bounds_of_ingestor(self):
+        """
+        this function tests that the error bounds given to the DataIngestor size the sketches
+        :return: None
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            ingestor = DataIngestor(os.path.join(tmp, "dataset.txt"), os.path.join(tmp, "spotify"), hll_error=0.01,
+                                    topk_error=0.01)
+            ingestor.__open_database__()
+            assert(ingestor.sketches.precision == hll_precision(0.01))
+            assert(ingestor.sketches.capacity == 100)
+            ingestor.conn.close()
+
+    def tearDown(self):
+        """
+        this function closes the database
+        :return:
+        """
+        self.conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
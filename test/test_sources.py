@@ -0,0 +1,121 @@
+import gzip
+import logging
+import os
+import tempfile
+import threading
+import unittest
+from src.main import DataIngestor
+from src.generator import ListenGenerator
+from src.sources import ShardLoader, list_shards, read_shard_lines
+
+# the listens with their natural keys, independent of the ids handed out
+LISTENS_CMD = "SELECT user_name, recording_msid, listened_at FROM listeners " \
+              "JOIN users ON listeners.user_id = users.user_id " \
+              "JOIN recordings ON listeners.recording_id = recordings.recording_id " \
+              "ORDER BY 1, 2, 3"
+
+class TestSources(unittest.TestCase):
+
+    def setUp(self):
+        """
+        this method generates a dataset and splits it into a rotated plain shard, two compressed ones and the plain
+        shard still being written to
+        :return:
+        """
+        logging.disable(logging.ERROR)
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "dataset.txt")
+        ListenGenerator(n_users=30, n_tracks=100, duplicate_rate=0.05, corrupt_rate=0.02,
+                        corrupt_kinds=("invalid_msid", "missing_field", "wrong_type")).write(self.path, 2000)
+        with open(self.path) as file:
+            lines = file.readlines()
+        self.shards = os.path.join(self.dir.name, "shards")
+        os.mkdir(self.shards)
+        with open(os.path.join(self.shards, "listens-01.txt"), "w") as file:
+            file.writelines(lines[:500])
+        for i, (start, end) in enumerate(((500, 1000), (1000, 1500))):
+            with gzip.open(os.path.join(self.shards, "listens-0{}.txt.gz".format(i + 2)), "wt") as file:
+                file.writelines(lines[start:end])
+        self.live = os.path.join(self.shards, "listens-04.txt")
+        with open(self.live, "w") as file:
+            file.writelines(lines[1500:1800])
+        self.rest = lines[1800:]
+
+    def __ingestor__(self, name, path):
+        ingestor = DataIngestor(path, os.path.join(self.dir.name, name), batch_size=100)
+        ingestor.__open_database__()
+        return ingestor
+
+    def test_read_shard_lines(self):
+        """
+        this function tests that a compressed shard is resumed at an offset in its decompressed bytes
+        :return: None
+        """
+        path = os.path.join(self.shards, "listens-02.txt.gz")
+        lines = list(read_shard_lines(path, chunk_size=1000))
+        assert(len(lines) == 500)
+        offset = lines[199][0]
+        assert(list(read_shard_lines(path, offset, chunk_size=1000)) == lines[200:])
+        assert(len(list_shards(self.shards)) == 4)
+        assert(list_shards(os.path.join(self.shards, "*.gz")) == [path, path.replace("02", "03")])
+
+    def test_shards_match_file(self):
+        """
+        this function tests that the shards, loaded by parallel workers and followed while one of them grows, store
+        the same listens as the whole file and that a restart resumes from the progress of every shard
+        :return: None
+        """
+        ingestor = self.__ingestor__("sharded", self.shards)
+        assert(ingestor.ingest_shards(workers=2) > 0)
+        with open(self.live, "a") as file:
+            file.writelines(self.rest)
+        assert(ingestor.ingest_shards(workers=2) > 0)
+        assert(ingestor.ingest_shards(workers=2) == 0)
+        ingestor.conn.close()
+
+        ingestor = self.__ingestor__("sharded", self.shards)
+        assert(ingestor.ingest_shards(workers=1) == 0)
+        assert(ingestor.__pending_bytes__() == 0)
+        sharded = ingestor.conn.execute(LISTENS_CMD).fetchall()
+        ingestor.conn.close()
+
+        ingestor = self.__ingestor__("single", self.path)
+        for new_json_list in ingestor.get_new_data():
+            ingestor.__write__(ingestor.__extract__(new_json_list))
+        assert(ingestor.conn.execute(LISTENS_CMD).fetchall() == sharded)
+        ingestor.conn.close()
+
+    def test_failing_consume(self):
+        """
+        this function tests that an error while merging the chunks stops the workers instead of leaving them waiting
+        on the full queue, which would keep the pool from shutting down
+        :return: None
+        """
+        errors = []
+
+        def consume(path, inode, keyed, offset, done):
+            raise ValueError("the batch could not be written")
+
+        def run():
+            try:
+                ShardLoader(workers=2, chunk_lines=20).run([(path, 0) for path in list_shards(self.shards)], consume)
+            except ValueError as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        thread.join(60)
+        assert(not thread.is_alive())
+        assert(len(errors) == 1)
+
+    def tearDown(self):
+        """
+        this function removes the temporary files
+        :return:
+        """
+        logging.disable(logging.NOTSET)
+        self.dir.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
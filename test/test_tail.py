@@ -0,0 +1,92 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from src.tail import FileTailer
+
+class TestFileTailerMethods(unittest.TestCase):
+
+    def setUp(self):
+        """
+        this method creates an empty text file and a database to keep the checkpoint in
+        :return:
+        """
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "dataset.txt")
+        self.db_path = os.path.join(self.dir.name, "test.db")
+        self.conn = sqlite3.connect(self.db_path)
+        self.__write__(b"")
+
+    def __write__(self, data, mode="ab"):
+        with open(self.path, mode) as file:
+            file.write(data)
+
+    def test_read_only_appended_lines(self):
+        """
+        this function tests that every line is handed out exactly once and partial lines are held back
+        :return: None
+        """
+        tailer = FileTailer(self.path, self.conn, chunk_size=4)
+        self.__write__(b'{"a":1}\n{"b":2}\n{"c"')
+        lines = list(tailer.read_lines())
+        assert([line for (offset, line) in lines] == ['{"a":1}', '{"b":2}'])
+        assert([offset for (offset, line) in lines] == [0, 8])
+        self.__write__(b':3}\n')
+        assert(list(tailer.read_lines()) == [(16, '{"c":3}')])
+        assert(list(tailer.read_lines()) == [])
+
+    def test_resume_from_checkpoint(self):
+        """
+        this function tests that a new tailer continues from the checkpoint saved by the previous one
+        :return: None
+        """
+        self.__write__(b'1\n2\n')
+        tailer = FileTailer(self.path, self.conn)
+        assert(len(list(tailer.read_lines())) == 2)
+        tailer.save_checkpoint()
+        self.__write__(b'3\n')
+        tailer = FileTailer(self.path, sqlite3.connect(self.db_path))
+        assert([line for (offset, line) in tailer.read_lines()] == ['3'])
+
+    def test_truncation_and_rotation(self):
+        """
+        this function tests that a truncated or replaced file is read again from the start
+        :return: None
+        """
+        self.__write__(b'1\n2\n')
+        tailer = FileTailer(self.path, self.conn)
+        list(tailer.read_lines())
+        self.__write__(b'9\n', mode="wb")
+        assert([line for (offset, line) in tailer.read_lines()] == ['9'])
+        rotated = self.path + ".1"
+        os.rename(self.path, rotated)
+        with open(rotated, "ab") as file:
+            file.write(b'late\n')
+        self.__write__(b'new\n')
+        assert([line for (offset, line) in tailer.read_lines()] == ['new'])
+
+    def test_resume_offset(self):
+        """
+        this function tests the offset to resume at, before and after a truncation
+        :return: None
+        """
+        tailer = FileTailer(self.path, self.conn)
+        assert(tailer.resume_offset() is None)
+        self.__write__(b'1\n2\n')
+        assert(tailer.resume_offset() == 0)
+        list(tailer.read_lines())
+        assert(tailer.resume_offset() is None)
+        self.__write__(b'9\n', mode="wb")
+        assert(tailer.resume_offset() == 0)
+
+    def tearDown(self):
+        """
+        this function closes the database and removes the temporary files
+        :return:
+        """
+        self.conn.close()
+        self.dir.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
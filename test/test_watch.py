@@ -0,0 +1,84 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from src.watch import PollingWatcher, InotifyWatcher, make_watcher
+
+def append_later(path, delay, text="line\n"):
+    """
+    appends to a file from another thread after a delay
+    :return: the started thread
+    """
+    def append():
+        time.sleep(delay)
+        with open(path, "a") as file:
+            file.write(text)
+    thread = threading.Thread(target=append)
+    thread.start()
+    return thread
+
+class TestWatchers(unittest.TestCase):
+
+    def setUp(self):
+        """
+        this method creates an empty file to watch
+        :return:
+        """
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "dataset.txt")
+        open(self.path, "w").close()
+
+    def __check_watcher__(self, watcher):
+        """
+        checks that the watcher times out on a quiet file and wakes up on an append - only the outcome is checked,
+        not how long it took, the deadline is generous so that a loaded machine doesn't fail the test
+        :return: None
+        """
+        try:
+            assert(not watcher.wait(0.2))
+            thread = append_later(self.path, 0.1)
+            assert(watcher.wait(30))
+            # it has been woken up by the append, not before it
+            assert(os.path.getsize(self.path) > 0)
+            thread.join()
+        finally:
+            watcher.close()
+
+    def test_polling_watcher(self):
+        """
+        this function tests the polling watcher and its backoff
+        :return: None
+        """
+        watcher = PollingWatcher(self.path, min_interval=0.01, max_interval=0.05)
+        deadline = time.monotonic() + 30
+        while watcher.interval < 0.05 and time.monotonic() < deadline:
+            assert(not watcher.wait(0.05))
+        assert(watcher.interval == 0.05)
+        self.__check_watcher__(watcher)
+        assert(watcher.interval == 0.01)
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "inotify is only available on linux")
+    def test_inotify_watcher(self):
+        """
+        this function tests the inotify watcher - including that writes to other files don't wake it up
+        :return: None
+        """
+        watcher = InotifyWatcher(self.path)
+        append_later(os.path.join(self.dir.name, "other.txt"), 0).join()
+        self.__check_watcher__(watcher)
+        watcher = make_watcher(self.path)
+        assert(isinstance(watcher, InotifyWatcher))
+        watcher.close()
+
+    def tearDown(self):
+        """
+        this function removes the temporary files
+        :return:
+        """
+        self.dir.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()